@@ -1,19 +1,149 @@
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobServiceClient, ContentSettings
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
+import io
+import glob
+import time
+import zlib
+import argparse
+import mimetypes
 
 load_dotenv()
 
 connection_string = os.getenv("blob_container_connection_string")
 container_name = "azetlpipelineblob"
+# uploaded when no paths are given
 json_file_path = "json_file.json"
-blob_name = "home_energy_consumption.json" 
+blob_name = "home_energy_consumption.json"
 
-blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+# block upload tuning: block size, and blocks in flight per blob
+BLOCK_SIZE = 8 * 1024 * 1024
+MAX_CONCURRENCY = 4
+# files uploaded at the same time
+MAX_FILES = 4
+READ_SIZE = 1024 * 1024
 
-# upload json file
-with open(json_file_path, "rb") as data:
-    blob_client.upload_blob(data, overwrite=True)
 
-print("JSON file uploaded to Azure Blob Storage")
\ No newline at end of file
+class GzipStream(io.RawIOBase):
+    """
+    Gzip-compresses a file while it is read, so compressed data is produced
+    block by block for the upload instead of being written out first.
+    """
+
+    def __init__(self, f, compresslevel=6, read_size=READ_SIZE):
+        self.f = f
+        self.read_size = read_size
+        # wbits=31 writes a gzip header and trailer
+        self.compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+        self.buffer = bytearray()
+        self.done = False
+        self.bytes_out = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while not self.done and (size is None or size < 0 or len(self.buffer) < size):
+            data = self.f.read(self.read_size)
+            if data:
+                self.buffer += self.compressor.compress(data)
+            else:
+                self.buffer += self.compressor.flush()
+                self.done = True
+        if size is None or size < 0:
+            size = len(self.buffer)
+        out = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.bytes_out += len(out)
+        return out
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def collect_files(paths, pattern):
+    """Files to upload as (local path, blob name); directories are expanded with `pattern`, keeping relative paths."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(glob.glob(os.path.join(path, "**", pattern), recursive=True)):
+                if os.path.isfile(name):
+                    files.append((name, os.path.relpath(name, path).replace(os.sep, "/")))
+        else:
+            files.append((path, os.path.basename(path)))
+    return files
+
+
+def upload_file(container_client, path, name, args):
+    start = time.perf_counter()
+    size = os.path.getsize(path)
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    with open(path, "rb") as f:
+        if args.gzip:
+            name += ".gz"
+            data = GzipStream(f, args.compresslevel)
+            # compressed length isn't known up front, the sdk uploads it block by block
+            container_client.upload_blob(name, data, overwrite=args.overwrite, max_concurrency=args.max_concurrency,
+                                         content_settings=ContentSettings(content_type="application/gzip"))
+            uploaded = data.bytes_out
+        else:
+            container_client.upload_blob(name, f, length=size, overwrite=args.overwrite,
+                                         max_concurrency=args.max_concurrency,
+                                         content_settings=ContentSettings(content_type=content_type))
+            uploaded = size
+
+    seconds = time.perf_counter() - start
+    print(f"{path} -> {name}: {size / 1024 / 1024:.1f} MiB read, {uploaded / 1024 / 1024:.1f} MiB uploaded "
+          f"in {seconds:.1f}s")
+    return size, uploaded
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Upload files or directories to the pipeline's blob container")
+    parser.add_argument("paths", nargs="*", help=f"files or directories (default: {json_file_path})")
+    parser.add_argument("--container", default=container_name)
+    parser.add_argument("--prefix", default="", help="prepended to every blob name, e.g. raw/2024/")
+    parser.add_argument("--pattern", default="*.csv", help="files picked from directories")
+    parser.add_argument("--gzip", action="store_true", help="compress while uploading, blobs get a .gz suffix")
+    parser.add_argument("--compresslevel", type=int, default=6)
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="bytes per block")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY, help="blocks in flight per file")
+    parser.add_argument("--max-files", type=int, default=MAX_FILES, help="files uploaded at the same time")
+    parser.add_argument("--no-overwrite", dest="overwrite", action="store_false")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.paths:
+        files = collect_files(args.paths, args.pattern)
+    else:
+        files = [(json_file_path, blob_name)]
+
+    # blobs at or under one block go in a single put, larger ones as parallel blocks
+    blob_service_client = BlobServiceClient.from_connection_string(
+        connection_string, max_block_size=args.block_size, max_single_put_size=args.block_size)
+    container_client = blob_service_client.get_container_client(args.container)
+
+    start = time.perf_counter()
+    failed = 0
+    read_total = uploaded_total = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.max_files)) as executor:
+        futures = {executor.submit(upload_file, container_client, path, args.prefix + name, args): path
+                   for path, name in files}
+        for future, path in futures.items():
+            try:
+                size, uploaded = future.result()
+                read_total += size
+                uploaded_total += uploaded
+            except Exception as e:
+                failed += 1
+                print(f"Failed to upload {path}: {e}")
+
+    seconds = time.perf_counter() - start
+    print(f"Uploaded {len(files) - failed} of {len(files)} files to Azure Blob Storage: "
+          f"{read_total / 1024 / 1024:.1f} MiB read, {uploaded_total / 1024 / 1024:.1f} MiB sent in {seconds:.1f}s")
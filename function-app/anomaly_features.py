@@ -0,0 +1,39 @@
+# anomaly model features from daily rollup rows
+import numpy as np
+import pandas as pd
+
+FEATURE_COLS = ['total_kwh', 'unique_appliances', 'rolling_7_mean', 'dow']
+ROLLING_WINDOW = 7
+
+
+def fill_gaps(agg):
+    """
+    Reindex to one row per home per day between each home's first and last
+    Date, with 0 for the missing days. Builds the full (HomeID, Date) index
+    in one go: every home contributes (max - min + 1) consecutive days.
+    """
+    bounds = agg.groupby('HomeID', sort=True)['Date'].agg(['min', 'max'])
+    lengths = ((bounds['max'] - bounds['min']).dt.days + 1).to_numpy()
+
+    homes = np.repeat(bounds.index.to_numpy(), lengths)
+    starts = np.repeat(bounds['min'].to_numpy(), lengths)
+    # day offset of each row within its home: 0, 1, ..., length - 1
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    dates = starts + offsets.astype('timedelta64[D]')
+
+    index = pd.MultiIndex.from_arrays([homes, dates], names=['HomeID', 'Date'])
+    return agg.set_index(['HomeID', 'Date']).reindex(index, fill_value=0).reset_index()
+
+
+def build_features(agg):
+    """
+    agg: rollup rows with HomeID, Date (datetime64), total_kwh and
+    unique_appliances, at most one row per home-day. Returns the gap-filled
+    frame sorted by HomeID and Date with rolling_7_mean and dow added.
+    """
+    filled = fill_gaps(agg)
+    # filled is sorted by HomeID, so the grouped rolling result lines up row for row
+    rolling = filled.groupby('HomeID', sort=True)['total_kwh'].rolling(ROLLING_WINDOW, min_periods=1).mean()
+    filled['rolling_7_mean'] = rolling.to_numpy()
+    filled['dow'] = filled['Date'].dt.dayofweek
+    return filled
@@ -0,0 +1,222 @@
+# incremental anomaly scoring of daily rollup documents at ingest time
+import os
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import joblib
+import pandas as pd
+from azure.core.exceptions import HttpResponseError
+from anomaly_features import FEATURE_COLS, ROLLING_WINDOW, build_features
+from daily_rollup import MAX_CONFLICT_RETRIES, rollup_id
+from dates import DATE_FORMAT, iso_date
+import ru_limiter
+import telemetry
+
+script_dir = os.path.dirname(__file__)
+LOCAL_ISOFOREST = os.path.join(script_dir, "anomaly_isoforest.pkl")
+
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def load_pipeline(path=LOCAL_ISOFOREST):
+    """
+    Load the IsoForest pipeline, once per file version (a replaced file is
+    loaded again). Returns (pipeline, version), version being a hash of the file.
+    """
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _pipelines_lock:
+        if key not in _pipelines:
+            with open(path, "rb") as f:
+                version = hashlib.sha1(f.read()).hexdigest()
+            pipeline = joblib.load(path)
+            if isinstance(pipeline, dict) and "model" in pipeline:
+                pipeline = pipeline["model"]
+            _pipelines.clear()
+            _pipelines[key] = (pipeline, version)
+        return _pipelines[key]
+
+
+def score_fields(row, version):
+    return {
+        "rolling_7_mean": float(row.rolling_7_mean),
+        "dow": int(row.dow),
+        "score": float(row.score),
+        "anomaly": bool(row.anomaly),
+        "score_version": version,
+    }
+
+
+def gap_day(home_id, day, fields):
+    # an empty rollup document, so later readings for the day merge into it like any other
+    date = day.strftime(DATE_FORMAT)
+    doc = {"id": rollup_id(home_id, date), "HomeID": home_id, "Date": date, "DateISO": iso_date(date), "readings": {},
+           "total_kwh": 0.0, "unique_appliances": 0, "record_count": 0}
+    doc.update(fields)
+    return doc
+
+
+def rescore_region(updated, first, last, existing):
+    """
+    Days whose features change when `updated` days got new readings: each
+    updated day, and each day in [first, last] without a rollup document
+    yet (a gap now counted as 0 kWh), plus the ROLLING_WINDOW - 1 days
+    after it.
+    """
+    changed = set(updated)
+    day = first
+    while day <= last:
+        if day not in existing:
+            changed.add(day)
+        day += timedelta(days=1)
+
+    region = set()
+    for day in changed:
+        for offset in range(ROLLING_WINDOW):
+            if day + timedelta(days=offset) > last:
+                break
+            region.add(day + timedelta(days=offset))
+    return region
+
+
+class AnomalyScorer:
+    """
+    Keeps score, anomaly, rolling_7_mean and dow on the daily rollup
+    documents up to date. After the rollup of a blob is applied, only the
+    touched home-days and the rolling windows that include them are
+    re-scored; missing days between a home's first and last day get
+    zero-consumption rollup documents, as the features treat them as 0 kWh.
+    A home's creates and patches go out as transactional batches.
+    """
+
+    def __init__(self, container, pipeline, version, max_concurrency=4):
+        self.container = container
+        self.pipeline = pipeline
+        self.version = version
+        self.max_concurrency = max(1, max_concurrency)
+
+    def rescore(self, updated_days):
+        """
+        updated_days: {HomeID: iterable of "dd-mm-yyyy" dates}. Returns
+        (days_scored, failed_homes).
+        """
+        homes = [(home_id, list(dates)) for home_id, dates in updated_days.items() if dates]
+        if not homes:
+            return 0, []
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            gathered = list(executor.map(telemetry.propagate(lambda h: self._gather_home(*h), stage="query"), homes))
+
+        failed_homes = [home_id for (home_id, _), g in zip(homes, gathered) if g is None]
+        gathered = [g for g in gathered if g is not None and g["region"]]
+        if not gathered:
+            return 0, failed_homes
+
+        # one feature pass and one model call for every home of the blob
+        rows = [row for g in gathered for row in g["rows"]]
+        agg = pd.DataFrame(rows, columns=["HomeID", "Date", "total_kwh", "unique_appliances"])
+        with telemetry.timer("feature_build"):
+            features = build_features(agg)
+        wanted = pd.MultiIndex.from_tuples([(g["home_id"], pd.Timestamp(day)) for g in gathered for day in g["region"]])
+        features = features[pd.MultiIndex.from_frame(features[["HomeID", "Date"]]).isin(wanted)].copy()
+
+        with telemetry.timer("predict"):
+            X = features[FEATURE_COLS].fillna(0)
+            features["score"] = self.pipeline.decision_function(X)
+            # sklearn's outlier detectors predict -1 exactly where decision_function < 0, no second model pass
+            features["anomaly"] = features["score"] < 0
+
+        by_home = {home_id: group for home_id, group in features.groupby("HomeID", sort=False)}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            write = telemetry.propagate(lambda g: self._write_home(g, by_home.get(g["home_id"])), stage="write")
+            results = list(executor.map(write, gathered))
+
+        days_scored = 0
+        for g, (ok, count) in zip(gathered, results):
+            if ok:
+                days_scored += count
+            else:
+                failed_homes.append(g["home_id"])
+        return days_scored, failed_homes
+
+    def _gather_home(self, home_id, dates):
+        try:
+            stored = list(self.container.query_items(
+                query="SELECT VALUE c.Date FROM c WHERE c.HomeID = @homeid",
+                parameters=[{"name": "@homeid", "value": home_id}],
+                partition_key=home_id
+            ))
+            existing = {datetime.strptime(d, DATE_FORMAT) for d in stored}
+            updated = {datetime.strptime(d, DATE_FORMAT) for d in dates} & existing
+            if not updated:
+                return {"home_id": home_id, "region": set()}
+
+            first, last = min(existing), max(existing)
+            region = rescore_region(updated, first, last, existing)
+
+            # features of the region only depend on the ROLLING_WINDOW - 1 days before it
+            lo = max(first, min(region) - timedelta(days=ROLLING_WINDOW - 1))
+            hi = max(region)
+            docs = self._read_days(home_id, [d for d in existing if lo <= d <= hi])
+        except HttpResponseError as e:
+            logging.error(f"Anomaly scoring for HomeID {home_id} failed to read rollup ({e.status_code}): {e.message}")
+            return None
+
+        rows = [(home_id, datetime.strptime(d["Date"], DATE_FORMAT), d.get("total_kwh", 0), d.get("unique_appliances", 0))
+                for d in docs]
+        # pin both ends of the window so gap filling covers exactly [lo, hi]
+        for day in {lo, hi} - {r[1] for r in rows}:
+            rows.append((home_id, day, 0.0, 0))
+
+        return {
+            "home_id": home_id,
+            "rows": rows,
+            "region": region,
+            "stored": {datetime.strptime(d["Date"], DATE_FORMAT): d for d in docs},
+        }
+
+    def _read_days(self, home_id, days):
+        return list(self.container.query_items(
+            query=("SELECT c.id, c.Date, c.total_kwh, c.unique_appliances, c.rolling_7_mean, c.dow, "
+                   "c.score, c.anomaly, c.score_version FROM c WHERE ARRAY_CONTAINS(@dates, c.Date)"),
+            parameters=[{"name": "@dates", "value": [d.strftime(DATE_FORMAT) for d in days]}],
+            partition_key=home_id
+        ))
+
+    def _write_home(self, gathered, features):
+        if features is None:
+            return True, 0
+        home_id = gathered["home_id"]
+        for attempt in range(MAX_CONFLICT_RETRIES):
+            try:
+                if attempt:
+                    # readings for a gap day arrived meanwhile (its create got a 409): re-read, patch that day instead
+                    docs = self._read_days(home_id, gathered["region"])
+                    gathered["stored"].update({datetime.strptime(d["Date"], DATE_FORMAT): d for d in docs})
+                operations = self._operations(home_id, gathered["stored"], features)
+                ru_limiter.execute_batches(self.container, operations, home_id)
+                return True, len(operations)
+
+            except HttpResponseError as e:
+                # CosmosHttpResponseError, or CosmosBatchOperationError from the transactional batch
+                if e.status_code == 409 and attempt < MAX_CONFLICT_RETRIES - 1:
+                    continue
+                logging.error(f"Anomaly scoring for HomeID {home_id} failed to write ({e.status_code}): {e.message}")
+                return False, 0
+        return False, 0
+
+    def _operations(self, home_id, stored, features):
+        operations = []
+        for row in features.itertuples(index=False):
+            day = row.Date.to_pydatetime()
+            fields = score_fields(row, self.version)
+            doc = stored.get(day)
+            if doc is None:
+                operations.append(("create", (gap_day(home_id, day, fields),)))
+            elif any(doc.get(k) != v for k, v in fields.items()):
+                patch = [{"op": "set", "path": f"/{k}", "value": v} for k, v in fields.items()]
+                operations.append(("patch", (doc["id"], patch)))
+        return operations
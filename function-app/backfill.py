@@ -0,0 +1,140 @@
+import os
+import sys
+import argparse
+from azure.cosmos import PartitionKey
+from daily_rollup import DailyRollup, INDEXING_POLICY as ROLLUP_INDEXING_POLICY
+import seasonal_aggregate
+import cosmos_pool
+from anomaly_scoring import AnomalyScorer, load_pipeline
+from dates import iso_date, indexing_policy
+from ru_limiter import execute_batches
+
+# maintenance: rebuild derived data for documents ingested before it existed
+CONTAINER = os.getenv("COSMOSDB_CONTAINERTR")
+ROLLUP_CONTAINER = os.getenv("COSMOSDB_CONTAINER_ROLLUP", "daily_rollup")
+AGGREGATES_CONTAINER = os.getenv("COSMOSDB_CONTAINER_AGGREGATES", "aggregates")
+
+# readings collected before merging them into the rollup
+ROLLUP_FLUSH_ROWS = 50000
+# homes scored per model call
+SCORE_BATCH_HOMES = 100
+
+
+def backfill_rollup(database, container):
+    rollup_container = database.create_container_if_not_exists(
+        id=ROLLUP_CONTAINER,
+        partition_key=PartitionKey(path="/HomeID"),
+        offer_throughput=400
+    )
+    query = "SELECT c.id, c.HomeID, c.ApplianceType, c.Season, c.Date, c.EnergyConsumption FROM c"
+
+    rollup = DailyRollup()
+    pending = 0
+    total_days = 0
+    failed = 0
+    for page in container.query_items(query=query, enable_cross_partition_query=True).by_page():
+        docs = list(page)
+        rollup.add(docs)
+        pending += len(docs)
+        if pending >= ROLLUP_FLUSH_ROWS:
+            days, failed_ids = rollup.apply(rollup_container)
+            total_days += days
+            failed += len(failed_ids)
+            pending = 0
+
+    days, failed_ids = rollup.apply(rollup_container)
+    total_days += days
+    failed += len(failed_ids)
+    print(f"Rollup backfill: {total_days} home-day updates, {failed} readings failed.")
+    return failed == 0
+
+
+def backfill_seasonal(database, container):
+    # rebuild the ingest-maintained seasonal aggregate from the daily rollup (see backfill_rollup)
+    aggregates_container = database.create_container_if_not_exists(
+        id=AGGREGATES_CONTAINER,
+        partition_key=PartitionKey(path="/id"),
+        offer_throughput=400
+    )
+    groups = seasonal_aggregate.rebuild(database.get_container_client(ROLLUP_CONTAINER), aggregates_container)
+    if groups is None:
+        print("Seasonal aggregate not rebuilt: it kept changing under concurrent ingests, try again.")
+        return False
+    print(f"Seasonal aggregate rebuilt: {len(groups)} Season x ApplianceType groups.")
+    return True
+
+
+def backfill_scores(database, container):
+    # score every rollup day, e.g. after the rollup backfill or when the anomaly model changes
+    rollup_container = database.get_container_client(ROLLUP_CONTAINER)
+    pipeline, version = load_pipeline()
+    scorer = AnomalyScorer(rollup_container, pipeline, version)
+
+    homes = list(rollup_container.query_items(query="SELECT DISTINCT VALUE c.HomeID FROM c", enable_cross_partition_query=True))
+    total_days = 0
+    failed_homes = []
+    for i in range(0, len(homes), SCORE_BATCH_HOMES):
+        updated_days = {}
+        for home_id in homes[i:i + SCORE_BATCH_HOMES]:
+            updated_days[home_id] = list(rollup_container.query_items(
+                query="SELECT VALUE c.Date FROM c WHERE c.HomeID = @homeid",
+                parameters=[{"name": "@homeid", "value": home_id}],
+                partition_key=home_id
+            ))
+        days, failed = scorer.rescore(updated_days)
+        total_days += days
+        failed_homes.extend(failed)
+
+    print(f"Anomaly scores backfill: {total_days} home-days written, {len(failed_homes)} homes failed.")
+    return not failed_homes
+
+
+def add_iso_dates(container):
+    # patch DateISO onto documents written before it existed, one batch per HomeID
+    query = "SELECT c.id, c.HomeID, c.Date FROM c WHERE NOT IS_DEFINED(c.DateISO)"
+    patched = 0
+    invalid = 0
+    for page in container.query_items(query=query, enable_cross_partition_query=True).by_page():
+        by_home = {}
+        for doc in page:
+            iso = iso_date(doc.get("Date"))
+            if iso is None:
+                invalid += 1
+                continue
+            patch = [{"op": "set", "path": "/DateISO", "value": iso}]
+            by_home.setdefault(doc["HomeID"], []).append(("patch", (doc["id"], patch)))
+
+        for home_id, operations in by_home.items():
+            execute_batches(container, operations, home_id)
+            patched += len(operations)
+    return patched, invalid
+
+
+def backfill_isodate(database, container):
+    # existing containers keep their indexing policy, so apply the current one before patching
+    rollup_container = database.get_container_client(ROLLUP_CONTAINER)
+    for target, policy in ((container, indexing_policy()), (rollup_container, ROLLUP_INDEXING_POLICY)):
+        database.replace_container(target, partition_key=PartitionKey(path="/HomeID"), indexing_policy=policy)
+        patched, invalid = add_iso_dates(target)
+        print(f"{target.id}: DateISO added to {patched} documents, {invalid} with an unparseable Date.")
+    return True
+
+
+TASKS = {
+    "rollup": backfill_rollup,
+    "seasonal": backfill_seasonal,
+    "scores": backfill_scores,
+    "isodate": backfill_isodate,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill derived data in CosmosDB")
+    parser.add_argument("task", choices=sorted(TASKS))
+    args = parser.parse_args()
+
+    database = cosmos_pool.database()
+    container = cosmos_pool.container(CONTAINER)
+
+    ok = TASKS[args.task](database, container)
+    sys.exit(0 if ok else 1)
@@ -2,83 +2,449 @@
 from function_app import app
 import azure.functions as func
 import logging
-import csv
-import uuid
-from azure.cosmos import CosmosClient, PartitionKey
 import os
+import json
+import typing
+from azure.core import MatchConditions
+from csv_stream import ChunkStream, open_blob, read_csv_records
+from cosmos_bulk import BulkWriter
+from transform import iter_row_documents
+from ingest_manifest import ChangeTracker, load_manifest, row_hash, save_manifest
+from daily_rollup import DailyRollup, INDEXING_POLICY as ROLLUP_INDEXING_POLICY
+from dates import indexing_policy
+import seasonal_aggregate
+import response_cache
+import cosmos_pool
+import ru_limiter
+import telemetry
+from ru_limiter import COSMOS_PROVISIONED_RU
+from shard_ingest import (INGEST_SHARD_QUEUE, ShardCheckpoint, block_stream, event_blob_path, iter_blocks, next_phase,
+                          plan_shards, previous_rows, shard_messages, should_shard, source_blob)
 
-# cosmos credentials
-COSMOSDB_ENDPOINT = os.getenv("COSMOSDB_ENDPOINT")
-COSMOSDB_KEY = os.getenv("COSMOSDB_KEY")
-DATABASE = os.getenv("COSMOSDB_DATABASE")
+# blobs uploaded to this container are ingested (the BlobCreated event subscription filters on it too)
+INGEST_SOURCE_CONTAINER = os.getenv("INGEST_SOURCE_CONTAINER", "azetlpipelineblob")
+
+# cosmos containers
 CONTAINER = os.getenv("COSMOSDB_CONTAINERTR")
+ROLLUP_CONTAINER = os.getenv("COSMOSDB_CONTAINER_ROLLUP", "daily_rollup")
+AGGREGATES_CONTAINER = os.getenv("COSMOSDB_CONTAINER_AGGREGATES", "aggregates")
+
+# containers from the shared client; ingestion creates them if missing (once per worker)
+def raw_container():
+    return cosmos_pool.container(CONTAINER, "/HomeID", create=True,
+                                 indexing_policy=indexing_policy(), offer_throughput=COSMOS_PROVISIONED_RU)
+
+def rollup_container():
+    return cosmos_pool.container(ROLLUP_CONTAINER, "/HomeID", create=True,
+                                 indexing_policy=ROLLUP_INDEXING_POLICY, offer_throughput=COSMOS_PROVISIONED_RU)
+
+def aggregates_container():
+    return cosmos_pool.container(AGGREGATES_CONTAINER, "/id", create=True, offer_throughput=COSMOS_PROVISIONED_RU)
+
+# ingestion mode: "stream" parses the blob in chunks, "buffered" reads it whole
+INGEST_MODE = os.getenv("INGEST_MODE", "stream").lower()
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", 1024 * 1024))
+
+# transform engine: "columnar" (pandas, whole chunks at once) or "row"
+INGEST_TRANSFORM = os.getenv("INGEST_TRANSFORM", "columnar").lower()
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", 10000))
 
-# initialize cosmos client
-client = CosmosClient(COSMOSDB_ENDPOINT, COSMOSDB_KEY)
-database = client.create_database_if_not_exists(id=DATABASE)
-container = database.create_container_if_not_exists(
-    id=CONTAINER,
-    partition_key=PartitionKey(path="/HomeID"),
-    offer_throughput=400
-)
+# bulk write settings
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 100))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", 4))
+
+# score the home-days touched by a blob with the anomaly model while ingesting
+INGEST_ANOMALY_SCORING = os.getenv("INGEST_ANOMALY_SCORING", "true").lower() == "true"
 
 # target schema
 REQUIRED_COLS = ["Home ID", "Appliance Type", "Energy Consumption (kWh)", "Season", "Date", "Household Size"]
 
-@app.blob_trigger(arg_name="myblob", path="azetlpipelineblob/{name}", connection="AzureWebJobsStorage")
-def BlobToCosmos(myblob: func.InputStream):
-    logging.info(f"Processing blob: {myblob.name}, Size: {myblob.length} bytes")
+def score_updated_days(updated_days):
+    # returns (days_scored, ids of the readings of homes that could not be scored)
+    from anomaly_scoring import AnomalyScorer
+    from ml_forecast_anomaly import anomaly_model
+    try:
+        # same lazily loaded (and downloaded if missing) model as DetectAnomalies
+        pipeline, version = anomaly_model()
+    except Exception as e:
+        logging.warning(f"Anomaly model not available, updated home-days left unscored: {e}")
+        return 0, []
+    scorer = AnomalyScorer(rollup_container(), pipeline, version, max_concurrency=BULK_MAX_CONCURRENCY)
+    days_scored, failed_homes = scorer.rescore({home_id: list(days) for home_id, days in updated_days.items()})
+    failed_ids = [doc_id for home_id in failed_homes for readings in updated_days[home_id].values() for doc_id in readings]
+    return days_scored, failed_ids
+
+def document_chunks(stream, name):
+    """(documents, skipped) chunks of a csv stream with the configured engine, or None if it's empty."""
+    if INGEST_TRANSFORM == "columnar":
+        # pandas is only imported by the workers that ingest
+        from columnar_transform import iter_columnar_documents
+        return iter_columnar_documents(stream, INGEST_CHUNK_ROWS)
+
+    # read csv with normalized headers
+    normalized_fieldnames, reader = read_csv_records(stream, INGEST_MODE, INGEST_CHUNK_SIZE)
+    if not normalized_fieldnames:
+        logging.warning(f"Blob {name} is empty, nothing to ingest.")
+        return None
+    logging.info(f"Normalized headers: {normalized_fieldnames} (mode: {INGEST_MODE})")
+    return iter_row_documents(reader, INGEST_CHUNK_ROWS)
+
+def write_chunks(chunks, tracker, rollup):
+    """
+    Upsert the new or changed documents of `chunks` (per `tracker`) and
+    collect them in `rollup`. Returns (writer, transformed_count, skipped_count).
+    """
+    transformed_count = 0
+    skipped_count = 0
+
+    container = raw_container()
+    with BulkWriter(container, partition_key="HomeID", batch_size=BULK_BATCH_SIZE, max_concurrency=BULK_MAX_CONCURRENCY,
+                    operation="upsert", limiter=ru_limiter.for_container(container)) as writer:
+        chunks = iter(chunks)
+        while True:
+            # the columnar engine times its csv parsing separately; the row engine parses as it transforms
+            with telemetry.timer("transform"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            docs, skipped = chunk
+            skipped_count += skipped
+            transformed_count += len(docs)
+            with telemetry.timer("diff"):
+                changed = tracker.filter(docs)
+            with telemetry.timer("write"):
+                for item in changed:
+                    writer.add(item)
+            with telemetry.timer("rollup"):
+                rollup.add(changed)
+        with telemetry.timer("write"):
+            writer.flush()
+    return writer, transformed_count, skipped_count
+
+def update_derived(rollup, exclude, seasonal=True):
+    """
+    Bring the daily rollup, seasonal aggregate and anomaly scores in step
+    with the written rows (leaving out `exclude`, the failed writes).
+    With seasonal=False the aggregate is left to the caller (rollup.seasonal_deltas).
+    Returns (days_updated, rollup_failed_ids, days_scored, scoring_failed_ids).
+    """
+    # keep the per-home daily rollup in step with what was written
+    with telemetry.timer("rollup"):
+        days_updated, rollup_failed_ids = rollup.apply(rollup_container(), exclude=exclude,
+                                                       max_concurrency=BULK_MAX_CONCURRENCY)
+
+    # a partly applied rollup leaves the seasonal deltas unknown, drop the aggregate instead
+    if seasonal:
+        with telemetry.timer("aggregate"):
+            if rollup_failed_ids:
+                seasonal_aggregate.invalidate(aggregates_container())
+            else:
+                seasonal_aggregate.apply_deltas(aggregates_container(), rollup.seasonal_deltas, rollup_container())
+
+    # re-score the updated home-days and the rolling windows that include them
+    days_scored, scoring_failed_ids = 0, []
+    if INGEST_ANOMALY_SCORING and rollup.updated_days:
+        with telemetry.timer("score"):
+            days_scored, scoring_failed_ids = score_updated_days(rollup.updated_days)
+    return days_updated, rollup_failed_ids, days_scored, scoring_failed_ids
+
+@app.event_grid_trigger(arg_name="event")
+@app.queue_output(arg_name="shards", queue_name=INGEST_SHARD_QUEUE, connection="AzureWebJobsStorage")
+@telemetry.instrumented("BlobToCosmos")
+def BlobToCosmos(event: func.EventGridEvent, shards: func.Out[typing.List[str]]):
+    """
+    Ingests a blob of the source container on its BlobCreated event. Unlike
+    a blob trigger, the event carries no content: the blob is sized and
+    planned with ranged reads and only downloaded (in chunks) when it isn't
+    sharded.
+    """
+    blob_path = event_blob_path(event.subject)
+    if blob_path is None or blob_path.split("/", 1)[0] != INGEST_SOURCE_CONTAINER:
+        logging.info(f"Ignoring event {event.event_type} for {event.subject}.")
+        return
 
     try:
-        # read csv
-        blob_bytes = myblob.read()
-        blob_text = blob_bytes.decode("utf-8").splitlines()
-        reader = csv.DictReader(blob_text)
-
-        # normalize headers
-        normalized_fieldnames = [
-            h.strip().lower().replace(" ", "").replace("(kwh)", "").replace("(°c)", "")
-            for h in reader.fieldnames
-        ]
-        logging.info(f"Normalized headers: {normalized_fieldnames}")
-
-        # rebuild reader with normalized headers
-        reader = csv.DictReader(blob_text, fieldnames=normalized_fieldnames)
-        next(reader) 
-
-        transformed_count = 0
-        skipped_count = 0
-
-        for row in reader:
-            item = {
-                "HomeID": row.get("homeid"),
-                "ApplianceType": row.get("appliancetype"),
-                "Season": row.get("season"),
-                "Date": row.get("date"),
-                "id": str(uuid.uuid4())
-            }
-
-            # numeric conversions
-            try:
-                item["EnergyConsumption"] = float(row.get("energyconsumption", 0))
-            except (ValueError, TypeError):
-                item["EnergyConsumption"] = None
-
-            try:
-                item["HouseholdSize"] = int(row.get("householdsize", 0))
-            except (ValueError, TypeError):
-                item["HouseholdSize"] = None
-
-            # validation
-            if not item["HomeID"] or not item["ApplianceType"] or item["EnergyConsumption"] is None:
-                skipped_count += 1
-                continue
-
-            container.create_item(item)
-            transformed_count += 1
-
-        logging.info(f"Inserted {transformed_count} records into CosmosDB.")
-        logging.info(f"Skipped {skipped_count} invalid rows.")
+        blob = source_blob(blob_path)
+        properties = blob.get_blob_properties()
+        etag = properties.etag
+        logging.info(f"Processing blob: {blob_path}, Size: {properties.size} bytes")
+
+        # skip blobs whose content hasn't changed since the last successful run
+        with telemetry.timer("manifest"):
+            manifest = load_manifest(blob_path)
+        if etag and manifest.get("etag") == etag:
+            logging.info(f"Blob {blob_path} unchanged (ETag {etag}), nothing to ingest.")
+            telemetry.count("blobs_unchanged")
+            return
+
+        # large blobs fan out: one IngestShard invocation per line-aligned byte range
+        if should_shard(blob_path, properties.size):
+            with telemetry.timer("plan"):
+                header, ranges = plan_shards(blob, properties.size)
+            with telemetry.timer("manifest"):
+                ShardCheckpoint(blob_path, etag).save_plan(header, ranges)
+            shards.set(shard_messages(blob_path, etag, ranges))
+            telemetry.count("shards", len(ranges))
+            logging.info(f"Blob {blob_path} split into {len(ranges)} shards on queue {INGEST_SHARD_QUEUE}.")
+            return
+
+        with telemetry.timer("manifest"):
+            tracker = ChangeTracker({"rows": previous_rows(blob_path, manifest)})
+        rollup = DailyRollup()
+
+        # the version that was sized is the one read (a newer upload raises its own event); gzip-compressed
+        # uploads are decompressed while streaming; time spent reading the blob is the "read" stage
+        download = blob.download_blob(etag=etag, match_condition=MatchConditions.IfNotModified)
+        stream = open_blob(telemetry.TimedStream(ChunkStream(download.chunks())), blob_path)
+        chunks = document_chunks(stream, blob_path)
+        if chunks is None:
+            return
+
+        writer, transformed_count, skipped_count = write_chunks(chunks, tracker, rollup)
+        days_updated, rollup_failed_ids, days_scored, scoring_failed_ids = update_derived(rollup, writer.failed_ids)
+
+        # cached api responses are stale once new data has landed
+        if writer.items_written:
+            response_cache.bump_data_version()
+
+        with telemetry.timer("manifest"):
+            save_manifest(blob_path, tracker.manifest(etag, writer.failed_ids + rollup_failed_ids + scoring_failed_ids))
+            # the row hashes of a previously sharded upload are in the manifest now
+            if manifest.get("shards"):
+                ShardCheckpoint(blob_path, manifest["etag"]).delete()
+
+        telemetry.count("rows", transformed_count)
+        telemetry.count("rows_skipped", skipped_count)
+        telemetry.count("rows_unchanged", tracker.unchanged)
+        telemetry.count("items_written", writer.items_written)
+        telemetry.count("items_failed", writer.items_failed)
+        telemetry.count("days_updated", days_updated)
+        telemetry.count("days_scored", days_scored)
+
+        logging.info(f"Transformed {transformed_count} records, upserted {writer.items_written} new or changed into CosmosDB.")
+        logging.info(f"Skipped {skipped_count} invalid rows, {tracker.unchanged} unchanged rows.")
+        logging.info(f"Bulk write summary - {writer.summary()}")
+        if writer.limiter is not None:
+            logging.info(f"RU limiter ({CONTAINER}) - {writer.limiter.stats()}")
+        logging.info(f"Daily rollup: {days_updated} home-days updated, {len(rollup_failed_ids)} readings not rolled up.")
+        logging.info(f"Anomaly scoring: {days_scored} home-days scored, {len(scoring_failed_ids)} readings of unscored homes.")
 
     except Exception as e:
         logging.error(f"Error processing blob: {str(e)}")
+        telemetry.count("errors")
+
+def resolve_collisions(shard, checkpoint):
+    """
+    Shards number the rows sharing a key within themselves, so a key that
+    occurs in more than one shard got the same ids in each (the shards' row
+    hashes show which). The rows of those keys are read again from the
+    shards that have them, numbered across the blob as a whole-blob ingest
+    numbers them and written again, with their rollup readings (read after
+    the shards' by finalize_group) and row hashes.
+    """
+    count = shard["count"]
+    with telemetry.timer("manifest"):
+        rows = [checkpoint.load_rows(index) for index in range(count)]
+    seen, colliding = set(), set()
+    for shard_rows in rows:
+        for doc_id in shard_rows:
+            (colliding if doc_id in seen else seen).add(doc_id)
+    if not colliding:
+        return
+
+    blob = source_blob(shard["blob"])
+    involved = [index for index in range(count) if not colliding.isdisjoint(rows[index])]
+    docs_of = {}
+    for index in involved:
+        start, end = shard["ranges"][index]
+        local = ChangeTracker({"rows": {}})
+        docs_of[index] = []
+        for _, chunks in shard_documents(shard, blob, start, end, f"{shard['blob']} shard {index + 1}"):
+            with telemetry.timer("transform"):
+                for docs, _ in chunks:
+                    docs = [doc for doc in docs if doc["id"] in colliding]
+                    # the ids the shard gave these rows, replaced by the blob's numbering below
+                    for doc in local.filter([dict(doc) for doc in docs]):
+                        rows[index].pop(doc["id"], None)
+                    docs_of[index].extend(docs)
+
+    # every row of these keys is in docs_of, in blob order, so a fresh tracker numbers them as a whole-blob ingest
+    rollup = DailyRollup()
+    writer, _, _ = write_chunks(((docs_of[index], 0) for index in involved), ChangeTracker({"rows": {}}), rollup)
+    if writer.failed_ids:
+        raise RuntimeError(f"{shard['blob']}: {writer.items_failed} renumbered rows not written; the retry starts over.")
+
+    with telemetry.timer("manifest"):
+        # named after every shard's rollups, so finalize_group merges it last
+        checkpoint.save_rollup(count, 0, rollup.pending, count)
+        for index in involved:
+            rows[index].update((doc["id"], row_hash(doc)) for doc in docs_of[index])
+            checkpoint.save_rows(index, rows[index])
+    telemetry.count("rows_renumbered", writer.items_written)
+    logging.info(f"{shard['blob']}: {len(colliding)} ids in more than one shard, "
+                 f"{writer.items_written} rows renumbered across shards {[index + 1 for index in involved]}.")
+
+def finalize_group(shard, checkpoint, label):
+    """
+    Updates the rollup and anomaly scores of one group of homes with the
+    readings all shards saved for it. A home is in a single group, so groups
+    never contend for the same home's rollup. The seasonal deltas are
+    returned for finish_sharded to apply once.
+    """
+    group = shard["index"]
+    rollup = DailyRollup()
+    with telemetry.timer("manifest"):
+        for pending in checkpoint.load_rollups(group):
+            rollup.merge(pending)
+        # readings a failed attempt already rolled up no longer show in the deltas
+        retried = not checkpoint.first_attempt(f"finalize/{group:05d}")
+    days_updated, rollup_failed_ids, days_scored, scoring_failed_ids = update_derived(rollup, (), seasonal=False)
+    if days_updated:
+        response_cache.bump_data_version()
+
+    telemetry.count("days_updated", days_updated)
+    telemetry.count("days_scored", days_scored)
+    logging.info(f"{label}: {days_updated} home-days updated, {len(rollup_failed_ids)} readings not rolled up; "
+                 f"{days_scored} home-days scored, {len(scoring_failed_ids)} readings of unscored homes.")
+    return {"deltas": rollup.seasonal_deltas, "exact": not (retried or rollup_failed_ids),
+            "failed": bool(rollup_failed_ids or scoring_failed_ids)}
+
+def finish_sharded(shard, checkpoint):
+    """
+    Applies the seasonal deltas of all groups and saves the blob's manifest:
+    the etag and shard ranges, the row hashes staying with the shards.
+    """
+    groups = checkpoint.load_done("finalize")
+    with telemetry.timer("aggregate"):
+        # a retried finish may have applied the deltas already
+        if all(group["exact"] for group in groups) and checkpoint.first_attempt("aggregate"):
+            deltas = {}
+            for group in groups:
+                for key, (kwh, count) in group["deltas"].items():
+                    total, n = deltas.get(key, (0.0, 0))
+                    deltas[key] = (total + kwh, n + count)
+            seasonal_aggregate.apply_deltas(aggregates_container(), deltas, rollup_container())
+        else:
+            seasonal_aggregate.invalidate(aggregates_container())
+    response_cache.bump_data_version()
+
+    # failed rollup or scoring updates leave the etag and row hashes out so the blob is ingested again
+    failed = any(group["failed"] for group in groups)
+    with telemetry.timer("manifest"):
+        previous = load_manifest(shard["blob"])
+        if failed:
+            save_manifest(shard["blob"], {"etag": None, "rows": {}})
+        else:
+            save_manifest(shard["blob"], {"etag": shard["etag"], "rows": {}, "shards": shard["ranges"]})
+        checkpoint.clear(keep_rows=not failed)
+        if previous.get("shards") and previous["etag"] != shard["etag"]:
+            ShardCheckpoint(shard["blob"], previous["etag"]).delete()
+    logging.info(f"All {shard['count']} shards of {shard['blob']} ingested"
+                 f"{', some derived updates failed' if failed else ''}.")
+
+def shard_documents(shard, blob, start, end, label):
+    """(next_offset, chunks) for the blocks of a byte range of a sharded blob."""
+    blocks = iter_blocks(blob, start, end)
+    while True:
+        with telemetry.timer("read"):
+            block, next_offset = next(blocks, (None, None))
+        if block is None:
+            return
+        telemetry.count("bytes_read", len(block))
+        yield next_offset, document_chunks(block_stream(shard["header"], block), label) or ()
+
+def ingest_shard(shard, checkpoint, label):
+    """
+    Ingests one byte range a block at a time: the block's rows are upserted
+    and its rollup readings saved, then the next offset is checkpointed, so a
+    retried message (after an error or a timeout) resumes there. Re-running a
+    block is safe (upserts).
+    """
+    index = shard["index"]
+    start, end = shard["start"], shard["end"]
+    blob = source_blob(shard["blob"])
+    with telemetry.timer("manifest"):
+        progress = checkpoint.load_progress(index, start)
+        # only new or changed rows are written, per the previous upload's row hashes for these bytes;
+        # rows sharing a key are numbered within the shard (resolve_collisions renumbers keys other shards have too)
+        rows = previous_rows(shard["blob"], load_manifest(shard["blob"]), start, end)
+        tracker = ChangeTracker({"rows": rows})
+
+    if progress["offset"] > start:
+        logging.info(f"Resuming {label} at byte {progress['offset']} of {start}-{end}.")
+        # the rows already written go through the tracker again (not written) so later duplicates number on
+        # and their hashes are in the shard's manifest
+        for _, chunks in shard_documents(shard, blob, start, progress["offset"], label):
+            with telemetry.timer("transform"):
+                for docs, _ in chunks:
+                    tracker.filter(docs)
+
+    for next_offset, chunks in shard_documents(shard, blob, progress["offset"], end, label):
+        rollup = DailyRollup()
+        writer, transformed_count, skipped_count = write_chunks(chunks, tracker, rollup)
+        telemetry.count("rows", transformed_count)
+        telemetry.count("rows_skipped", skipped_count)
+        telemetry.count("items_written", writer.items_written)
+        if writer.items_written:
+            response_cache.bump_data_version()
+        if writer.failed_ids:
+            telemetry.count("items_failed", writer.items_failed)
+            raise RuntimeError(f"{label}: {writer.items_failed} rows not written in the block at byte "
+                               f"{progress['offset']}; the retry resumes there.")
+
+        with telemetry.timer("manifest"):
+            checkpoint.save_rollup(index, progress["offset"], rollup.pending, shard["count"])
+            progress = {"offset": next_offset, "rows": progress["rows"] + transformed_count}
+            checkpoint.save_progress(index, progress)
+
+    with telemetry.timer("manifest"):
+        checkpoint.save_rows(index, tracker.rows)
+    telemetry.count("rows_unchanged", tracker.unchanged)
+    logging.info(f"{label} ingested: {progress['rows']} rows, bytes {start}-{end}.")
+
+@app.queue_trigger(arg_name="msg", queue_name=INGEST_SHARD_QUEUE, connection="AzureWebJobsStorage")
+@app.queue_output(arg_name="fanout", queue_name=INGEST_SHARD_QUEUE, connection="AzureWebJobsStorage")
+@telemetry.instrumented("IngestShard")
+def IngestShard(msg: func.QueueMessage, fanout: func.Out[typing.List[str]]):
+    """
+    Runs one phase of a sharded blob for one shard (see shard_ingest.PHASES):
+    "ingest" writes the shard's new or changed rows, and "finalize" updates
+    the rollup and anomaly scores of one group of homes. Errors are raised
+    for the queue to retry. The last invocation of a phase to finish queues
+    the next, after resolving the keys shared by several shards for
+    "ingest"; the last group applies the seasonal deltas and saves the
+    blob's manifest.
+    """
+    shard = json.loads(msg.get_body())
+    phase, index = shard["phase"], shard["index"]
+    checkpoint = ShardCheckpoint(shard["blob"], shard["etag"])
+    with telemetry.timer("manifest"):
+        plan = checkpoint.load_plan()
+    if plan is None:
+        # the upload was superseded and its checkpoint deleted
+        logging.warning(f"No shard plan for {shard['blob']} (ETag {shard['etag']}), dropping {phase} {index + 1}.")
+        return
+    shard.update(plan, count=len(plan["ranges"]))
+    label = f"{shard['blob']} {phase} {index + 1}/{shard['count']}"
+
+    with telemetry.timer("manifest"):
+        done = checkpoint.is_done(phase, index)
+    if not done:
+        results = None
+        if phase == "ingest":
+            ingest_shard(shard, checkpoint, label)
+        else:
+            results = finalize_group(shard, checkpoint, label)
+        with telemetry.timer("manifest"):
+            checkpoint.mark_done(phase, index, results)
+
+    if checkpoint.claim(phase, shard["count"], index):
+        following = next_phase(phase)
+        if phase == "ingest":
+            resolve_collisions(shard, checkpoint)
+        if following:
+            fanout.set(shard_messages(shard["blob"], shard["etag"], shard["ranges"], following))
+            logging.info(f"{shard['blob']}: {phase} done, {following} queued.")
+        else:
+            finish_sharded(shard, checkpoint)
+        checkpoint.finish(phase, index)
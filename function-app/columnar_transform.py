@@ -0,0 +1,148 @@
+# vectorized transform: whole csv chunks to cosmos documents with pandas
+import hashlib
+import logging
+import itertools
+import numpy as np
+import pandas as pd
+from csv_stream import normalize_header
+from transform import ID_NAMESPACE
+from dates import iso_date
+import telemetry
+
+DOC_COLUMNS = ["HomeID", "ApplianceType", "Season", "Date", "DateISO", "id", "EnergyConsumption", "HouseholdSize"]
+
+# uuid5 document ids (same as transform.document_id) with vectorized formatting
+def document_ids(homes, appliances, dates, times):
+    prefix = ID_NAMESPACE.bytes
+    digests = b"".join(
+        hashlib.sha1(prefix + f"{h}|{a}|{d}|{t}".encode()).digest()[:16]
+        for h, a, d, t in zip(homes, appliances, dates, times)
+    )
+    n = len(digests) // 16
+    if n == 0:
+        return []
+
+    raw = np.frombuffer(digests, dtype=np.uint8).reshape(n, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x50   # version 5
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80   # RFC 4122 variant
+
+    hex_digits = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+    hexed = np.empty((n, 32), dtype=np.uint8)
+    hexed[:, 0::2] = hex_digits[raw >> 4]
+    hexed[:, 1::2] = hex_digits[raw & 0x0F]
+
+    # 8-4-4-4-12 layout: (source offset, target offset, width)
+    out = np.full((n, 36), ord("-"), dtype=np.uint8)
+    for src, dst, width in ((0, 0, 8), (8, 9, 4), (12, 14, 4), (16, 19, 4), (20, 24, 12)):
+        out[:, dst:dst + width] = hexed[:, src:src + width]
+    return out.view("S36").ravel().astype(str).tolist()
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _floats(values):
+    """
+    float() of each value, NaN where it fails. Object-to-float conversion
+    calls float() itself, so values parse exactly as in the row path
+    (pd.to_numeric rounds long decimals differently and rejects "1_000").
+    """
+    try:
+        return values.to_numpy(dtype=object).astype(float)
+    except (ValueError, TypeError):
+        return np.array([_float(v) for v in values], dtype=float)
+
+
+def _ints(values):
+    """int() of each value, None where it fails; like _floats, int() itself does the parsing."""
+    try:
+        return values.to_numpy(dtype=object).astype(np.int64).tolist()
+    except (ValueError, TypeError, OverflowError):
+        return [_int(v) for v in values]
+
+
+def _text(df, col, valid):
+    if col not in df:
+        return [None] * int(valid.sum())
+    values = df[col][valid]
+    return values.where(values.notna(), None).tolist()
+
+
+def transform_frame(df):
+    """
+    Columnar equivalent of transform.transform_row for a frame of raw csv
+    strings with normalized headers. Returns (documents, skipped_count).
+    """
+    n = len(df)
+    if n == 0:
+        return [], 0
+
+    home = df["homeid"] if "homeid" in df else pd.Series("", index=df.index)
+    appliance = df["appliancetype"] if "appliancetype" in df else pd.Series("", index=df.index)
+
+    # numeric conversion, bad values become nulls (missing columns default to 0 like the row path)
+    if "energyconsumption" in df:
+        energy = pd.Series(_floats(df["energyconsumption"]), index=df.index)
+    else:
+        energy = pd.Series(0.0, index=df.index)
+
+    # validation mask; nan and inf are dropped like in the row path
+    valid = (home.fillna("") != "") & (appliance.fillna("") != "") & np.isfinite(energy)
+    kept = int(valid.sum())
+    skipped = n - kept
+
+    size = _ints(df["householdsize"][valid]) if "householdsize" in df else [0] * kept
+
+    homes = home[valid].tolist()
+    appliances = appliance[valid].tolist()
+    dates = _text(df, "date", valid)
+    ids = document_ids(homes, appliances, dates, _text(df, "time", valid))
+    # a chunk only has a handful of distinct dates, convert each once
+    iso = {d: iso_date(d) for d in set(dates)}
+
+    columns = [
+        homes,
+        appliances,
+        _text(df, "season", valid),
+        dates,
+        [iso[d] for d in dates],
+        ids,
+        energy[valid].tolist(),
+        size,
+    ]
+    return [dict(zip(DOC_COLUMNS, values)) for values in zip(*columns)], skipped
+
+
+def iter_columnar_documents(stream, chunk_rows=10000):
+    """
+    Parse a csv stream in chunks of `chunk_rows` rows and yield
+    (documents, skipped_count) per chunk.
+    """
+    try:
+        # a callable usecols has the parser drop the extra fields of long rows (as csv.DictReader does)
+        # instead of failing the chunk; short rows get empty strings
+        reader = pd.read_csv(stream, chunksize=chunk_rows, dtype=str, keep_default_na=False, usecols=lambda c: True)
+    except pd.errors.EmptyDataError:
+        logging.warning("Empty csv, nothing to transform.")
+        return
+    chunks = iter(reader)
+    for i in itertools.count():
+        with telemetry.timer("parse"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        chunk.columns = [normalize_header(c) for c in chunk.columns]
+        if i == 0:
+            logging.info(f"Normalized headers: {list(chunk.columns)}")
+        yield transform_frame(chunk)
@@ -0,0 +1,117 @@
+# batched, partition-grouped writes to cosmos
+import time
+import logging
+import telemetry
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from azure.cosmos.exceptions import CosmosBatchOperationError, CosmosHttpResponseError
+
+# cosmos transactional batches are limited to 100 operations per partition key
+MAX_BATCH_OPERATIONS = 100
+
+
+class BulkWriter:
+    """
+    Buffers items per partition key and flushes them as transactional batches,
+    keeping at most `max_concurrency` batches in flight. With a `limiter`
+    (ru_limiter.RULimiter) batches are paced to the container's RU budget
+    and throttled ones are retried instead of failing.
+
+    Use as a context manager or call close() to flush what is left; the
+    counters (batches_ok, batches_failed, items_written, items_failed) and
+    the ids of items in failed batches (failed_ids) are final after that.
+    """
+
+    def __init__(self, container, partition_key="HomeID", batch_size=MAX_BATCH_OPERATIONS,
+                 max_concurrency=4, max_buffered=5000, operation="create", limiter=None):
+        self.container = container
+        self.partition_key = partition_key
+        self.batch_size = min(batch_size, MAX_BATCH_OPERATIONS)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_buffered = max_buffered
+        self.operation = operation
+        self.limiter = limiter
+
+        self.batches_ok = 0
+        self.batches_failed = 0
+        self.items_written = 0
+        self.items_failed = 0
+        self.failed_ids = []
+
+        self._buffers = {}
+        self._buffered = 0
+        self._in_flight = set()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, item):
+        pk = item[self.partition_key]
+        buf = self._buffers.setdefault(pk, [])
+        buf.append(item)
+        self._buffered += 1
+
+        if len(buf) >= self.batch_size:
+            self._submit(pk)
+        elif self._buffered >= self.max_buffered:
+            # too many small partitions pending, flush them all
+            for key in list(self._buffers):
+                self._submit(key)
+
+    def flush(self):
+        for key in list(self._buffers):
+            self._submit(key)
+        self._drain(0)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def summary(self):
+        return (f"batches ok: {self.batches_ok}, batches failed: {self.batches_failed}, "
+                f"items written: {self.items_written}, items failed: {self.items_failed}")
+
+    def _submit(self, pk):
+        items = self._buffers.pop(pk, None)
+        if not items:
+            return
+        self._buffered -= len(items)
+
+        self._drain(self.max_concurrency - 1)
+        self._in_flight.add(self._executor.submit(telemetry.propagate(self._write_batch), pk, items))
+
+    def _drain(self, limit):
+        # wait until no more than `limit` batches are in flight
+        while len(self._in_flight) > limit:
+            done, self._in_flight = wait(self._in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                ok, items = future.result()
+                if ok:
+                    self.batches_ok += 1
+                    self.items_written += len(items)
+                else:
+                    self.batches_failed += 1
+                    self.items_failed += len(items)
+                    self.failed_ids.extend(item["id"] for item in items)
+
+    def _write_batch(self, pk, items):
+        operations = [(self.operation, (item,)) for item in items]
+        start = time.perf_counter()
+        try:
+            if self.limiter is None:
+                self.container.execute_item_batch(batch_operations=operations, partition_key=pk)
+            else:
+                self.limiter.call(self.container.execute_item_batch, batch_operations=operations, partition_key=pk,
+                                  ops=len(operations))
+            telemetry.observe("write.batch_ms", round((time.perf_counter() - start) * 1000, 2))
+            return True, items
+        except CosmosBatchOperationError as e:
+            logging.error(f"Batch for partition {pk} rolled back at operation {e.error_index}: {e.message}")
+        except CosmosHttpResponseError as e:
+            logging.error(f"Batch for partition {pk} failed ({e.status_code}): {e.message}")
+        return False, items
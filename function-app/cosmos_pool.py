@@ -0,0 +1,123 @@
+# one cosmos client per worker process, shared by every function module
+import os
+import socket
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection
+from azure.core.pipeline.transport import RequestsTransport
+from azure.cosmos import CosmosClient, PartitionKey
+from lazy_init import lazy
+import telemetry
+
+# cosmos credentials
+COSMOSDB_ENDPOINT = os.getenv("COSMOSDB_ENDPOINT")
+COSMOSDB_KEY = os.getenv("COSMOSDB_KEY")
+DATABASE = os.getenv("COSMOSDB_DATABASE")
+
+# connection pool: hosts kept (gateway + regional endpoints) and connections kept per host
+COSMOS_POOL_CONNECTIONS = int(os.getenv("COSMOS_POOL_CONNECTIONS", 10))
+COSMOS_POOL_MAXSIZE = int(os.getenv("COSMOS_POOL_MAXSIZE", 32))
+# tcp keep-alive on pooled connections, so idle ones aren't silently dropped between invocations
+COSMOS_TCP_KEEPALIVE = os.getenv("COSMOS_TCP_KEEPALIVE", "true").lower() == "true"
+COSMOS_KEEPALIVE_IDLE = int(os.getenv("COSMOS_KEEPALIVE_IDLE", 60))
+COSMOS_KEEPALIVE_INTERVAL = int(os.getenv("COSMOS_KEEPALIVE_INTERVAL", 15))
+COSMOS_CONNECTION_TIMEOUT = int(os.getenv("COSMOS_CONNECTION_TIMEOUT", 10))
+
+# comma separated, e.g. "West Europe,North Europe"; empty uses the account's write region
+COSMOS_PREFERRED_REGIONS = [r.strip() for r in os.getenv("COSMOS_PREFERRED_REGIONS", "").split(",") if r.strip()]
+
+# throttling (429) retries: attempts and the longest total wait in seconds
+COSMOS_RETRY_TOTAL = int(os.getenv("COSMOS_RETRY_TOTAL", 9))
+COSMOS_RETRY_BACKOFF_MAX = int(os.getenv("COSMOS_RETRY_BACKOFF_MAX", 30))
+
+_containers = {}
+_created = set()
+_containers_lock = threading.Lock()
+
+
+def keepalive_options():
+    if not COSMOS_TCP_KEEPALIVE:
+        return []
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # idle/interval tuning is platform specific (linux, which functions run on, has both)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, COSMOS_KEEPALIVE_IDLE))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, COSMOS_KEEPALIVE_INTERVAL))
+    return options
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, socket_options=(), **kwargs):
+        self.socket_options = list(socket_options)
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options:
+            kwargs["socket_options"] = HTTPConnection.default_socket_options + self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def build_transport():
+    session = requests.Session()
+    # retries are done by the cosmos retry policies, not by urllib3
+    adapter = PooledAdapter(
+        socket_options=keepalive_options(),
+        pool_connections=COSMOS_POOL_CONNECTIONS,
+        pool_maxsize=COSMOS_POOL_MAXSIZE,
+        max_retries=Retry(total=False, redirect=False, raise_on_status=False),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return RequestsTransport(session=session, session_owner=False)
+
+
+@lazy
+def client():
+    options = {
+        "transport": build_transport(),
+        "connection_timeout": COSMOS_CONNECTION_TIMEOUT,
+        "retry_total": COSMOS_RETRY_TOTAL,
+        "retry_backoff_max": COSMOS_RETRY_BACKOFF_MAX,
+        # request charge and throttling of every response, for the invocation's metrics
+        "raw_response_hook": telemetry.cosmos_response_hook,
+    }
+    if COSMOS_PREFERRED_REGIONS:
+        options["preferred_locations"] = COSMOS_PREFERRED_REGIONS
+    logging.info(f"Cosmos client: pool {COSMOS_POOL_CONNECTIONS}x{COSMOS_POOL_MAXSIZE}, "
+                 f"regions {COSMOS_PREFERRED_REGIONS or 'default'}, retries {COSMOS_RETRY_TOTAL}/{COSMOS_RETRY_BACKOFF_MAX}s")
+    return CosmosClient(COSMOSDB_ENDPOINT, COSMOSDB_KEY, **options)
+
+
+def database(create=False):
+    """The configured database; create=True makes sure it exists (once per process)."""
+    with _containers_lock:
+        if create and ("database", DATABASE) not in _created:
+            client().create_database_if_not_exists(id=DATABASE)
+            _created.add(("database", DATABASE))
+    return client().get_database_client(DATABASE)
+
+
+def container(name, partition_key=None, create=False, **options):
+    """
+    Container client by name, shared by all callers in the process.
+    create=True runs create_container_if_not_exists (with `partition_key`,
+    a path like "/HomeID", and any other options) the first time only;
+    without it no control-plane call is made.
+    """
+    with _containers_lock:
+        if name in _containers and (not create or ("container", name) in _created):
+            return _containers[name]
+
+    db = database(create=create)
+    with _containers_lock:
+        if create and ("container", name) not in _created:
+            _containers[name] = db.create_container_if_not_exists(
+                id=name, partition_key=PartitionKey(path=partition_key), **options)
+            _created.add(("container", name))
+        elif name not in _containers:
+            _containers[name] = db.get_container_client(name)
+        return _containers[name]
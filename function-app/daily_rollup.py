@@ -0,0 +1,145 @@
+# per-home, per-day rollup documents maintained at ingest time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import HttpResponseError
+from seasonal_aggregate import add_delta
+from dates import iso_date, indexing_policy
+from ru_limiter import execute_batches
+import telemetry
+
+# a home is re-read and retried when another writer changed its rollup meanwhile
+MAX_CONFLICT_RETRIES = 3
+
+# the readings map is only ever read whole, keep it out of the index
+INDEXING_POLICY = indexing_policy("/readings/*")
+
+
+def rollup_id(home_id, date):
+    return f"{home_id}_{date}"
+
+
+def summarize(doc):
+    # totals are always recomputed from the readings map, so re-applying a reading is idempotent
+    readings = doc["readings"].values()
+    doc["total_kwh"] = sum(r[1] for r in readings)
+    doc["unique_appliances"] = len({r[0] for r in readings})
+    doc["record_count"] = len(doc["readings"])
+    # the day's share of the seasonal aggregate, summed by seasonal_aggregate.rollup_groups
+    seasonal = {}
+    for r in readings:
+        add_delta(seasonal, r[2] if len(r) > 2 else None, r[0], r[1], 1)
+    doc["seasonal"] = {key: list(value) for key, value in seasonal.items()}
+    return doc
+
+
+class DailyRollup:
+    """
+    Collects readings by HomeID and Date while a blob is ingested, then
+    merges them into one rollup document per home-day:
+
+        {"id", "HomeID", "Date", "DateISO", "total_kwh", "unique_appliances",
+         "record_count", "seasonal": {"Season|ApplianceType": [kwh, count]},
+         "readings": {doc_id: [appliance, kwh, season]}}
+
+    After apply(), seasonal_deltas holds the (kWh, count) change per
+    Season|ApplianceType that the committed updates made, for the seasonal
+    aggregate, and updated_days the {HomeID: {Date: readings}} that were
+    committed, for anomaly scoring.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.seasonal_deltas = {}
+        self.updated_days = {}
+
+    def add(self, docs):
+        for doc in docs:
+            if not doc.get("Date"):
+                continue
+            days = self.pending.setdefault(doc["HomeID"], {})
+            days.setdefault(doc["Date"], {})[doc["id"]] = [doc["ApplianceType"], doc["EnergyConsumption"], doc.get("Season")]
+
+    def merge(self, pending):
+        """Add readings collected elsewhere (a `pending` map, e.g. from another shard)."""
+        for home_id, days in pending.items():
+            for date, readings in days.items():
+                self.pending.setdefault(home_id, {}).setdefault(date, {}).update(readings)
+
+    def apply(self, container, exclude=(), max_concurrency=4):
+        """
+        Merge pending readings into `container`, leaving out ids in `exclude`
+        (e.g. rows whose write failed). Returns (days_updated, failed_ids)
+        where failed_ids are the readings of homes that could not be updated.
+        """
+        exclude = set(exclude)
+        work = []
+        for home_id, days in self.pending.items():
+            days = {date: {k: v for k, v in readings.items() if k not in exclude} for date, readings in days.items()}
+            days = {date: readings for date, readings in days.items() if readings}
+            if days:
+                work.append((home_id, days))
+        self.pending = {}
+
+        days_updated = 0
+        failed_ids = []
+        self.seasonal_deltas = {}
+        self.updated_days = {}
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            results = executor.map(telemetry.propagate(lambda w: self._apply_home(container, *w)), work)
+            for (home_id, days), (ok, count, deltas) in zip(work, results):
+                if ok:
+                    days_updated += count
+                    self.updated_days[home_id] = days
+                    for key, (kwh, n) in deltas.items():
+                        season, appliance = key.split("|", 1)
+                        add_delta(self.seasonal_deltas, season, appliance, kwh, n)
+                else:
+                    failed_ids.extend(doc_id for readings in days.values() for doc_id in readings)
+        return days_updated, failed_ids
+
+    def _apply_home(self, container, home_id, days):
+        for attempt in range(MAX_CONFLICT_RETRIES):
+            try:
+                existing = {
+                    doc["Date"]: doc for doc in container.query_items(
+                        query="SELECT * FROM c WHERE c.HomeID = @homeid AND ARRAY_CONTAINS(@dates, c.Date)",
+                        parameters=[{"name": "@homeid", "value": home_id}, {"name": "@dates", "value": list(days)}],
+                        partition_key=home_id
+                    )
+                }
+
+                operations = []
+                deltas = {}
+                for date, readings in days.items():
+                    doc = existing.get(date)
+                    if doc is None:
+                        doc = {"id": rollup_id(home_id, date), "HomeID": home_id, "Date": date,
+                               "DateISO": iso_date(date), "readings": {}}
+                        doc["readings"].update(readings)
+                        operations.append(("create", (summarize(doc),)))
+                    else:
+                        etag = doc["_etag"]
+                        doc = {k: v for k, v in doc.items() if not k.startswith("_")}
+                        doc["DateISO"] = iso_date(date)
+                        for doc_id in readings:
+                            old = doc["readings"].get(doc_id)
+                            if old:
+                                add_delta(deltas, old[2] if len(old) > 2 else None, old[0], -old[1], -1)
+                        doc["readings"].update(readings)
+                        operations.append(("replace", (doc["id"], summarize(doc)), {"if_match_etag": etag}))
+
+                for readings in days.values():
+                    for appliance, kwh, season in readings.values():
+                        add_delta(deltas, season, appliance, kwh, 1)
+
+                execute_batches(container, operations, home_id)
+                return True, len(days), deltas
+
+            except HttpResponseError as e:
+                # CosmosHttpResponseError, or CosmosBatchOperationError from the transactional batch;
+                # 409/412: a concurrent run touched the same home-days, re-read and merge again
+                if e.status_code in (409, 412) and attempt < MAX_CONFLICT_RETRIES - 1:
+                    continue
+                logging.error(f"Rollup update for HomeID {home_id} failed ({e.status_code}): {e.message}")
+                return False, 0, {}
+        return False, 0, {}
@@ -4,38 +4,102 @@ import logging
 import csv
 import uuid
 import json
-from azure.cosmos import CosmosClient, PartitionKey
 import os
-
-# cosmos credentials
-COSMOSDB_ENDPOINT = os.getenv("COSMOSDB_ENDPOINT")
-COSMOSDB_KEY = os.getenv("COSMOSDB_KEY")
-DATABASE = os.getenv("COSMOSDB_DATABASE")
+import seasonal_aggregate
+from dates import date_range_filter
+from response_cache import cached_response
+import cosmos_pool
+import telemetry
+from request_profiler import profiled
+from response_formats import json_response, negotiate_format, table_response
+
+# cosmos containers
 CONTAINER = os.getenv("COSMOSDB_CONTAINERTR")
+AGGREGATES_CONTAINER = os.getenv("COSMOSDB_CONTAINER_AGGREGATES", "aggregates")
+ROLLUP_CONTAINER = os.getenv("COSMOSDB_CONTAINER_ROLLUP", "daily_rollup")
+
+# containers from the shared client; the read-only endpoints don't create
+# anything, ingestion (BlobToCosmos) creates the database and containers
+def container():
+    return cosmos_pool.container(CONTAINER)
+
+def aggregates_container():
+    return cosmos_pool.container(AGGREGATES_CONTAINER)
+
+def rollup_container():
+    return cosmos_pool.container(ROLLUP_CONTAINER)
+
+# largest page a client can ask for in one call
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 5000))
 
-# initialize cosmos client
-client = CosmosClient(COSMOSDB_ENDPOINT, COSMOSDB_KEY)
-database = client.create_database_if_not_exists(id=DATABASE)
-container = database.create_container_if_not_exists(
-    id=CONTAINER,
-    partition_key=PartitionKey(path="/HomeID"),
-    offer_throughput=400
-)
+# start/end query params as cosmos WHERE clauses on DateISO; ValueError on a bad date
+def date_filter(req):
+    return date_range_filter(req.params.get("start"), req.params.get("end"))
 
 @app.route(route="GetAllEnergyData", auth_level=func.AuthLevel.FUNCTION)
+@telemetry.instrumented("GetAllEnergyData")
+@profiled("GetAllEnergyData")
+@cached_response("GetAllEnergyData")
 def GetAllEnergy(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Query params:
+      - pageSize (int, optional) -> return one page of at most pageSize records
+      - continuationToken (optional, or x-ms-continuation header) -> page to resume from
+      - format (optional, or the Accept header) -> "json" (default, array of records),
+        "columns" ({column: [values]}), "arrow" (Arrow IPC stream), "parquet", or "ndjson"
+        (one record per line; always paged, MAX_PAGE_SIZE records unless pageSize says
+        otherwise, so a client streams the data by following the continuation token)
+      - start, end (optional, YYYY-MM-DD, inclusive) -> date range, applied in the Cosmos query
+    Paged responses carry the next token in the x-ms-continuation header (and in the
+    json body as {"items": [...], "continuationToken": ...}); it is absent on the last page.
+    Bodies are gzip or brotli encoded when the client's Accept-Encoding allows.
+    """
     logging.info("HttP trigger - Fetching all energy data from CosmosDB")
 
+    page_size = req.params.get("pageSize")
+    token = req.params.get("continuationToken") or req.headers.get("x-ms-continuation")
+
+    try:
+        page_size = min(int(page_size), MAX_PAGE_SIZE) if page_size else None
+        if page_size is not None and page_size < 1:
+            raise ValueError
+    except ValueError:
+        return func.HttpResponse("pageSize must be a positive integer", status_code=400)
+
+    try:
+        where, parameters = date_filter(req)
+        fmt = negotiate_format(req)
+    except ValueError as e:
+        return func.HttpResponse(str(e), status_code=400)
+
     try:
         query = "SELECT c.HomeID, c.ApplianceType, c.EnergyConsumption, c.Season, c.Date FROM c"
-        items = list(container.query_items(query=query, enable_cross_partition_query=True))
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        pager = container().query_items(
+            query=query,
+            parameters=parameters or None,
+            enable_cross_partition_query=True,
+            max_item_count=page_size or MAX_PAGE_SIZE
+        ).by_page(token)
+
+        if page_size or token or fmt == "ndjson":
+            # single page, client follows the continuation token
+            with telemetry.timer("query"):
+                page = list(next(pager, []))
+            next_token = pager.continuation_token
+            headers = {"x-ms-continuation": next_token} if next_token else {}
+            telemetry.count("rows", len(page))
+            if fmt == "json":
+                return json_response(req, {"items": page, "continuationToken": next_token}, headers=headers)
+            return table_response(req, page, fmt=fmt, headers=headers)
+
+        with telemetry.timer("query"):
+            items = [item for page in pager for item in page]
+        telemetry.count("rows", len(items))
 
         # convert decimal/float serialization 
-        return func.HttpResponse(
-            body=json.dumps(items, default=str),
-            mimetype="application/json",
-            status_code=200
-        )
+        return table_response(req, items, fmt=fmt)
 
     except Exception as e:
         logging.error(f"Error querying CosmosDB: {e}")
@@ -45,6 +109,9 @@ def GetAllEnergy(req: func.HttpRequest) -> func.HttpResponse:
         )
 
 @app.route(route="GetEnergyByHomeID", auth_level=func.AuthLevel.FUNCTION)
+@telemetry.instrumented("GetEnergyByHomeID")
+@profiled("GetEnergyByHomeID")
+@cached_response("GetEnergyByHomeID")
 def GetEnergyByHomeID(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("HTTP Trigger - Fetching energy by HomeID")
 
@@ -64,14 +131,20 @@ def GetEnergyByHomeID(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     try:
-        query = f"SELECT c.HomeID, c.ApplianceType, c.EnergyConsumption, c.Season, c.Date FROM c WHERE c.HomeID = '{home_id}'"
-        items = list(container.query_items(query=query, enable_cross_partition_query=True))
+        where, parameters = date_filter(req)
+    except ValueError as e:
+        return func.HttpResponse(str(e), status_code=400)
 
-        return func.HttpResponse(
-            body=json.dumps(items, default=str),
-            mimetype="application/json",
-            status_code=200
-        )
+    try:
+        # single-partition query, optionally narrowed to a date range
+        query = "SELECT c.HomeID, c.ApplianceType, c.EnergyConsumption, c.Season, c.Date FROM c WHERE " + \
+            " AND ".join(["c.HomeID = @homeid"] + where)
+        parameters = [{"name": "@homeid", "value": home_id}] + parameters
+        with telemetry.timer("query"):
+            items = list(container().query_items(query=query, parameters=parameters, partition_key=home_id))
+        telemetry.count("rows", len(items))
+
+        return table_response(req, items)
 
     except Exception as e:
         logging.error(f"Error querying CosmosDB: {e}")
@@ -81,18 +154,40 @@ def GetEnergyByHomeID(req: func.HttpRequest) -> func.HttpResponse:
         )
 
 @app.route(route="GetSeasonalConsumption", auth_level=func.AuthLevel.FUNCTION)
+@telemetry.instrumented("GetSeasonalConsumption")
+@profiled("GetSeasonalConsumption")
+@cached_response("GetSeasonalConsumption")
 def GetSeasonalConsumption(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Returns total, count and mean EnergyConsumption per Season x ApplianceType:
+      {"source": "ingest-aggregate" | "rollup-aggregate", "results": [...]}
+    The ingest-maintained aggregate is used when present, otherwise the sums are
+    computed from the daily rollup. Query params:
+      - source (optional) -> "query" skips the ingest-maintained aggregate
+      - start, end (optional, YYYY-MM-DD, inclusive) -> only readings in the date range;
+        the ingest aggregate covers all dates, so the home-days in the range are summed
+    """
     logging.info("HTTP Trigger - Fetching seasonal consumption")
 
     try:
-        query = "SELECT c.Season, c.ApplianceType, c.EnergyConsumption FROM c"
-        items = list(container.query_items(query=query, enable_cross_partition_query=True))
+        where, parameters = date_filter(req)
+    except ValueError as e:
+        return func.HttpResponse(str(e), status_code=400)
 
-        return func.HttpResponse(
-            body=json.dumps(items, default=str),
-            mimetype="application/json",
-            status_code=200
-        )
+    try:
+        with telemetry.timer("query"):
+            doc = None
+            if (req.params.get("source") or "").lower() != "query" and not where:
+                doc = seasonal_aggregate.read_aggregate(aggregates_container())
+
+            if doc is not None:
+                source = "ingest-aggregate"
+                groups = doc.get("groups", {})
+            else:
+                source = "rollup-aggregate"
+                groups = seasonal_aggregate.rollup_groups(rollup_container(), where, parameters)
+
+        return json_response(req, {"source": source, "results": seasonal_aggregate.to_results(groups)})
 
     except Exception as e:
         logging.error(f"Error querying CosmosDB for seasonal consumption: {e}")
@@ -0,0 +1,59 @@
+# reading dates: stored as dd-mm-YYYY strings, plus a sortable ISO copy for range queries
+import functools
+from datetime import datetime
+
+DATE_FORMAT = "%d-%m-%Y"
+ISO_FORMAT = "%Y-%m-%d"
+
+# formats accepted for start/end query params
+PARAM_FORMATS = [ISO_FORMAT, DATE_FORMAT]
+
+
+@functools.lru_cache(maxsize=4096)
+def iso_date(date):
+    """dd-mm-YYYY -> YYYY-MM-DD, None if the date doesn't parse."""
+    try:
+        return datetime.strptime(date, DATE_FORMAT).strftime(ISO_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_date_param(value):
+    """Date from a query param (YYYY-MM-DD, an ISO timestamp or dd-mm-YYYY) as YYYY-MM-DD; ValueError if invalid."""
+    value = value.strip()
+    for fmt in PARAM_FORMATS:
+        try:
+            return datetime.strptime(value[:10], fmt).strftime(ISO_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(f"invalid date '{value}', expected YYYY-MM-DD")
+
+
+def date_range_filter(start, end, field="c.DateISO"):
+    """
+    WHERE clauses and query parameters for an inclusive date range on the
+    ISO field. start/end are raw query params (either may be empty).
+    """
+    clauses = []
+    parameters = []
+    if start:
+        clauses.append(f"{field} >= @start")
+        parameters.append({"name": "@start", "value": parse_date_param(start)})
+    if end:
+        clauses.append(f"{field} <= @end")
+        parameters.append({"name": "@end", "value": parse_date_param(end)})
+    return clauses, parameters
+
+
+def indexing_policy(*excluded_paths):
+    # range index on every path (DateISO included), with HomeID + DateISO for per-home ordered scans
+    return {
+        "indexingMode": "consistent",
+        "automatic": True,
+        "includedPaths": [{"path": "/*"}],
+        "excludedPaths": [{"path": '/"_etag"/?'}] + [{"path": p} for p in excluded_paths],
+        "compositeIndexes": [[
+            {"path": "/HomeID", "order": "ascending"},
+            {"path": "/DateISO", "order": "ascending"},
+        ]],
+    }
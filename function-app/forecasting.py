@@ -0,0 +1,29 @@
+# prophet prediction helpers shared by the Forecast endpoint and its benchmark
+
+
+def predict_horizon(model, days, mode="fast", uncertainty_samples=None):
+    """
+    Forecast the `days` dates after the model's history.
+
+    mode="full" predicts over the whole training history plus the horizon
+    (Prophet's usual make_future_dataframe + predict) and keeps the tail;
+    mode="fast" builds and predicts only the future dates, which gives the
+    same yhat for those dates.
+
+    uncertainty_samples overrides the model's setting for this call; 0
+    skips interval sampling and the result has no yhat_lower/yhat_upper.
+    """
+    future = model.make_future_dataframe(periods=days, include_history=(mode == "full"))
+
+    default_samples = model.uncertainty_samples
+    if uncertainty_samples is not None:
+        model.uncertainty_samples = uncertainty_samples
+    try:
+        forecast = model.predict(future)
+    finally:
+        model.uncertainty_samples = default_samples
+
+    cols = ['ds', 'yhat']
+    if 'yhat_lower' in forecast:
+        cols += ['yhat_lower', 'yhat_upper']
+    return forecast[cols].tail(days)
@@ -1,8 +1,19 @@
 # global import for funcs file
+import time
+import logging
+import importlib
 
 import azure.functions as func
 app = func.FunctionApp()
 
-import blobToCosmos
-import data_analytics_api
-import ml_forecast_anomaly
\ No newline at end of file
+# each module registers its functions on import; clients, heavy libraries
+# and models are deferred to the first invocation that needs them
+FUNCTION_MODULES = ["blobToCosmos", "data_analytics_api", "ml_forecast_anomaly"]
+
+startup_timings = {}
+for module_name in FUNCTION_MODULES:
+    start = time.perf_counter()
+    importlib.import_module(module_name)
+    startup_timings[module_name] = time.perf_counter() - start
+
+logging.info("Startup timings: " + ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in startup_timings.items()))
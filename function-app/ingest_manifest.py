@@ -0,0 +1,91 @@
+# per-blob manifest of etag + row hashes, for change-only ingestion
+import os
+import gzip
+import json
+import uuid
+import hashlib
+import logging
+from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceNotFoundError, ResourceExistsError
+from transform import ID_NAMESPACE
+
+MANIFEST_CONNECTION_STRING = os.getenv("AzureWebJobsStorage")
+MANIFEST_CONTAINER = os.getenv("INGEST_MANIFEST_CONTAINER", "ingest-manifests")
+
+# fields that make up a row's content (id is derived from the key fields)
+HASHED_FIELDS = ["HomeID", "ApplianceType", "Season", "Date", "EnergyConsumption", "HouseholdSize"]
+
+
+def _manifest_blob(blob_name):
+    service = BlobServiceClient.from_connection_string(MANIFEST_CONNECTION_STRING)
+    return service.get_blob_client(container=MANIFEST_CONTAINER, blob=f"{blob_name}.json.gz")
+
+
+def load_manifest(blob_name):
+    empty = {"etag": None, "rows": {}}
+    if not MANIFEST_CONNECTION_STRING:
+        return empty
+    try:
+        data = _manifest_blob(blob_name).download_blob().readall()
+        return json.loads(gzip.decompress(data))
+    except ResourceNotFoundError:
+        return empty
+    except Exception as e:
+        logging.warning(f"Could not read manifest for {blob_name}, ingesting all rows: {e}")
+        return empty
+
+
+def save_manifest(blob_name, manifest):
+    if not MANIFEST_CONNECTION_STRING:
+        return
+    blob = _manifest_blob(blob_name)
+    try:
+        blob.get_container_client().create_container()
+    except ResourceExistsError:
+        pass
+    blob.upload_blob(gzip.compress(json.dumps(manifest, separators=(",", ":")).encode()), overwrite=True)
+
+
+def row_hash(doc):
+    payload = json.dumps([doc.get(f) for f in HASHED_FIELDS], default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+class ChangeTracker:
+    """
+    Compares transformed documents with the previous manifest of a blob.
+
+    filter() returns only new or changed documents and records every row hash
+    for the next manifest. Rows that share the same key within a blob get an
+    ordinal suffix on their id so they don't overwrite each other, numbered
+    in the order the rows appear.
+    """
+
+    def __init__(self, manifest):
+        self.previous = manifest.get("rows", {})
+        self.rows = {}
+        self.unchanged = 0
+        self._duplicates = {}
+
+    def filter(self, docs):
+        changed = []
+        for doc in docs:
+            if doc["id"] in self.rows:
+                n = self._duplicates.get(doc["id"], 0) + 1
+                self._duplicates[doc["id"]] = n
+                doc["id"] = str(uuid.uuid5(ID_NAMESPACE, f"{doc['id']}#{n}"))
+
+            h = row_hash(doc)
+            self.rows[doc["id"]] = h
+            if self.previous.get(doc["id"]) == h:
+                self.unchanged += 1
+            else:
+                changed.append(doc)
+        return changed
+
+    def manifest(self, etag, failed_ids=()):
+        # failed rows are left out so the next run writes them again
+        rows = dict(self.rows)
+        for doc_id in failed_ids:
+            rows.pop(doc_id, None)
+        return {"etag": None if failed_ids else etag, "rows": rows}
@@ -0,0 +1,41 @@
+# deferred initialization: clients and models are built on first use, not at import
+import time
+import logging
+import threading
+import functools
+
+# first-use initialization times, "module.name" -> seconds
+init_timings = {}
+
+
+def lazy(factory):
+    """
+    Decorator for a no-argument factory. The first call builds the value
+    (once, even with concurrent callers) and records how long it took;
+    later calls return the same value. A factory that raises is retried on
+    the next call.
+    """
+    lock = threading.Lock()
+    state = {}
+
+    @functools.wraps(factory)
+    def get():
+        if "value" in state:
+            return state["value"]
+        with lock:
+            if "value" not in state:
+                start = time.perf_counter()
+                value = factory()
+                elapsed = time.perf_counter() - start
+                name = f"{factory.__module__}.{factory.__name__}"
+                init_timings[name] = elapsed
+                logging.info(f"Initialized {name} in {elapsed * 1000:.0f} ms")
+                state["value"] = value
+        return state["value"]
+
+    def reset():
+        with lock:
+            state.clear()
+
+    get.reset = reset
+    return get
@@ -2,20 +2,23 @@ from function_app import app
 import azure.functions as func
 import logging
 import os
-import json
-import joblib
-import pandas as pd
-from azure.storage.blob import BlobClient
-from azure.cosmos import CosmosClient
-from prophet.serialize import model_from_json
-import pickle
-import json
-
-# cosmos credentials
-COSMOSDB_ENDPOINT = os.getenv("COSMOSDB_ENDPOINT")
-COSMOSDB_KEY = os.getenv("COSMOSDB_KEY")
-DATABASE = os.getenv("COSMOSDB_DATABASE")
+import hashlib
+import threading
+from collections import OrderedDict
+from response_cache import cached_response
+from forecasting import predict_horizon
+from model_registry import ModelRegistry
+from dates import date_range_filter
+from lazy_init import lazy
+from model_artifacts import ArtifactCache, AzureBlobSource, HotModel
+import cosmos_pool
+import telemetry
+from request_profiler import profiled
+from response_formats import table_response
+
+# cosmos containers
 CONTAINER = os.getenv("COSMOSDB_CONTAINERTR")
+ROLLUP_CONTAINER = os.getenv("COSMOSDB_CONTAINER_ROLLUP", "daily_rollup")
 
 # blob container
 STORAGE_ACC_CONNECTION_STRING = os.getenv("STORAGE_ACC_CONNECTION_STRING")
@@ -23,63 +26,71 @@ MODEL_CONTAINER = os.getenv("MODEL_CONTAINER")
 PROPHET_BLOB = os.getenv("PROPHET_BLOB")
 ISOFOREST_BLOB = os.getenv("ISOFOREST_BLOB")
 
-prophet_model = None
-anomaly_pipeline = None
-
-# local file paths 
+# a forecast is computed once per model version for the longest horizon and sliced per request
+MAX_FORECAST_DAYS = int(os.getenv("MAX_FORECAST_DAYS", 90))
+# "fast" predicts only the future dates, "full" also re-predicts the training history
+FORECAST_MODE = os.getenv("FORECAST_MODE", "fast").lower()
+# interval samples when intervals are requested (Prophet's own default is 1000)
+FORECAST_UNCERTAINTY_SAMPLES = int(os.getenv("FORECAST_UNCERTAINTY_SAMPLES", 1000))
+# largest uncertainty_samples a request may ask for: sampling runs under the forecast lock, and each value is cached apart
+FORECAST_MAX_UNCERTAINTY_SAMPLES = int(os.getenv("FORECAST_MAX_UNCERTAINTY_SAMPLES", max(1000, FORECAST_UNCERTAINTY_SAMPLES)))
+FORECAST_CACHE_ENTRIES = int(os.getenv("FORECAST_CACHE_ENTRIES", 256))
+forecast_cache = OrderedDict()
+forecast_lock = threading.Lock()
+
+# per-home / per-cluster models, loaded from MODEL_CONTAINER on first request
+model_registry = ModelRegistry()
+
+# packaged model files, used when no storage account is configured
 script_dir = os.path.dirname(__file__)
 LOCAL_PROPHET = os.path.join(script_dir, "prophet_model.json")
 LOCAL_ISOFOREST = os.path.join(script_dir, "anomaly_isoforest.pkl")
 
-logging.info(f"Checking for Prophet model at: {LOCAL_PROPHET}")
-logging.info(f"Checking for IsoForest model at: {LOCAL_ISOFOREST}")
-
-# initialize cosmos client
-cosmos_client = CosmosClient(COSMOSDB_ENDPOINT, COSMOSDB_KEY)
-database = cosmos_client.get_database_client(DATABASE)
-container = database.get_container_client(CONTAINER)
-
-# download model from blob to local path
-def download_blob_if_missing(blob_conn, container_name, blob_name, target_path):
-    if os.path.exists(target_path):
-        return
-    blob = BlobClient.from_connection_string(blob_conn, container_name, blob_name)
-    logging.info(f"Downloading {blob_name} -> {target_path}")
-    with open(target_path, "wb") as f:
-        f.write(blob.download_blob().readall())
-
-# load models at cold start
-try:
-    if STORAGE_ACC_CONNECTION_STRING:
-        download_blob_if_missing(STORAGE_ACC_CONNECTION_STRING, MODEL_CONTAINER, PROPHET_BLOB, LOCAL_PROPHET)
-        download_blob_if_missing(STORAGE_ACC_CONNECTION_STRING, MODEL_CONTAINER, ISOFOREST_BLOB, LOCAL_ISOFOREST)
-    else:
-        logging.warning("STORAGE_ACC_CONNECTION_STRING not set — expecting local model files packaged with function.")
+# rollup container from the shared client
+def rollup_container():
+    return cosmos_pool.container(ROLLUP_CONTAINER)
 
-    try:
-        with open(LOCAL_PROPHET, 'r') as f:
-            json_str = f.read()
-            prophet_model = model_from_json(json_str)
-        logging.info("Prophet model loaded successfully.")
-
-        # with open(LOCAL_ISOFOREST, 'rb') as f:
-        # joblib.dump(LOCAL_ISOFOREST)
-        anomaly_pipeline = joblib.load(LOCAL_ISOFOREST)
-        if isinstance(anomaly_pipeline, dict) and "model" in anomaly_pipeline:
-            anomaly_pipeline = anomaly_pipeline["model"]
-        # anomaly_pipeline = joblib.load(LOCAL_ISOFOREST)
-        print("IsoForest model loaded successfully.")
-
-    except FileNotFoundError as e:
-        print(f"Error loading model: {e}")
-        # Consider logging the full path to aid debugging
-        print(f"Prophet path checked: {LOCAL_PROPHET}")
-        print(f"IsoForest path checked: {LOCAL_ISOFOREST}")
-
-except Exception as e:
-    logging.error(f"Error loading models at startup: {e}")
-    prophet_model = None
-    anomaly_pipeline = None
+# model files are cached by blob ETag and revalidated every MODEL_REVALIDATE_SECONDS,
+# a retrained model is picked up by running workers without a restart
+@lazy
+def artifacts():
+    if not STORAGE_ACC_CONNECTION_STRING:
+        logging.warning("STORAGE_ACC_CONNECTION_STRING not set — expecting local model files packaged with function.")
+        return None
+    cache = ArtifactCache(AzureBlobSource(STORAGE_ACC_CONNECTION_STRING, MODEL_CONTAINER))
+    # fetch both models at once on first use
+    cache.refresh([PROPHET_BLOB, ISOFOREST_BLOB])
+    return cache
+
+def load_prophet(path):
+    from prophet.serialize import model_from_json
+    with open(path, 'r') as f:
+        json_str = f.read()
+    model = model_from_json(json_str)
+    logging.info("Prophet model loaded successfully.")
+    return model, hashlib.sha1(json_str.encode()).hexdigest()
+
+def load_isoforest(path):
+    # shared with ingest-time scoring, which stores scores tagged with this version
+    from anomaly_scoring import load_pipeline
+    pipeline, version = load_pipeline(path)
+    logging.info("IsoForest model loaded successfully.")
+    return pipeline, version
+
+@lazy
+def prophet_handle():
+    return HotModel(PROPHET_BLOB, load_prophet, cache=artifacts(), fallback_path=LOCAL_PROPHET)
+
+@lazy
+def isoforest_handle():
+    return HotModel(ISOFOREST_BLOB, load_isoforest, cache=artifacts(), fallback_path=LOCAL_ISOFOREST)
+
+# models are loaded by the first request that needs them: (model, version)
+def prophet_model():
+    return prophet_handle().get()
+
+def anomaly_model():
+    return isoforest_handle().get()
 
 # parse query params  
 def get_param(req, name, default=None):
@@ -92,51 +103,90 @@ def get_param(req, name, default=None):
             val = default
     return val if val is not None else default
 
+# the model a forecast for `homeid` uses: (model, version, kind), kind "home", "cluster" or "global"
+def forecast_model(homeid):
+    if homeid and STORAGE_ACC_CONNECTION_STRING:
+        model, version, kind = model_registry.get(homeid)
+        if model is not None:
+            return model, version, kind
+    # the global model is only loaded when a home has none of its own
+    with telemetry.timer("model_load"):
+        model, version = prophet_model()
+    return model, version, "global"
+
+# cached responses are keyed by the serving model's version too, so a hot-swapped model isn't
+# answered with the old model's forecast; a model that fails to load is reported by the function
+def forecast_model_version(req):
+    try:
+        return forecast_model(get_param(req, "HomeID", None))[1]
+    except Exception:
+        return None
+
+def anomaly_model_version(req):
+    try:
+        return anomaly_model()[1]
+    except Exception:
+        return None
+
+# forecast rows for the next MAX_FORECAST_DAYS days, cached per model version and settings (LRU)
+def cached_forecast(model, version, mode, uncertainty_samples):
+    key = (version, mode, uncertainty_samples)
+    with forecast_lock:
+        rows = forecast_cache.get(key)
+        if rows is not None:
+            forecast_cache.move_to_end(key)
+            return rows
+        forecast = predict_horizon(model, MAX_FORECAST_DAYS, mode, uncertainty_samples)
+        rows = forecast.to_dict(orient='records')
+        forecast_cache[key] = rows
+        while len(forecast_cache) > FORECAST_CACHE_ENTRIES:
+            forecast_cache.popitem(last=False)
+        return rows
+
 # Forecasting (with prophet)
 @app.route(route="Forecast", auth_level=func.AuthLevel.FUNCTION)
+@telemetry.instrumented("Forecast")
+@profiled("Forecast")
+@cached_response("Forecast", version=forecast_model_version)
 def Forecast(req: func.HttpRequest) -> func.HttpResponse:
     """
     Query params:
-      - days (int, optional, default 7)
-      - HomeID (optional) -> if provided, you will get per-home aggregated series (but forecast uses the pre-trained global Prophet model)
+      - days (int, optional, default 7, at most MAX_FORECAST_DAYS)
+      - HomeID (optional) -> uses the home's own model (or its cluster's) when one exists in MODEL_CONTAINER
+      - mode (optional, "fast" | "full", default FORECAST_MODE) -> fast predicts only the future dates
+      - intervals (optional, default true) -> false skips uncertainty sampling and omits yhat_lower/yhat_upper
+      - uncertainty_samples (int, optional, at most FORECAST_MAX_UNCERTAINTY_SAMPLES) -> samples used for
+        the intervals (lower is faster)
+    Homes without a model of their own fall back to the global model; the X-Forecast-Model
+    header says which one was used. No data access: each model's forecast is computed
+    once per model version and the first `days` rows are returned; cached responses are
+    keyed by the model version too. The format param or
+    Accept header picks json, columns, arrow or parquet (see response_formats).
     """
-    if prophet_model is None:
-        return func.HttpResponse("Prophet model not loaded.", status_code=500)
-
     try:
         days = int(get_param(req, "days", 7))
-        homeid = get_param(req, "HomeID", None)
-
-        if homeid:
-            query = "SELECT c.Date, c.EnergyConsumption FROM c WHERE c.HomeID = @homeid"
-            parameters = [{"name":"@homeid","value": homeid}]
-            items = list(container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True))
-        else:
-            query = "SELECT c.Date, c.EnergyConsumption FROM c"
-            items = list(container.query_items(query=query, enable_cross_partition_query=True))
-
-        if not items:
-            return func.HttpResponse(json.dumps([]), mimetype="application/json", status_code=200)
+        if not 1 <= days <= MAX_FORECAST_DAYS:
+            return func.HttpResponse(f"days must be between 1 and {MAX_FORECAST_DAYS}", status_code=400)
 
-        df = pd.DataFrame(items)
-        # normalize
-        df['Date'] = pd.to_datetime(df['Date'])
-        # aggregate to daily
-        df['Date'] = pd.to_datetime(df['Date'], format="%d-%m-%Y")
-        daily = df.groupby('Date')['EnergyConsumption'].sum()
+        mode = str(get_param(req, "mode", FORECAST_MODE)).lower()
+        if mode not in ("fast", "full"):
+            return func.HttpResponse("mode must be fast or full", status_code=400)
 
-        # Fill missing dates
-        full_range = pd.date_range(start=daily.index.min(), end=daily.index.max(), freq='D')
-        daily = daily.reindex(full_range, fill_value=0).reset_index()
-        daily.columns = ['ds', 'y']
+        intervals = str(get_param(req, "intervals", "true")).lower() != "false"
+        samples = int(get_param(req, "uncertainty_samples", FORECAST_UNCERTAINTY_SAMPLES)) if intervals else 0
+        if intervals and not 1 <= samples <= FORECAST_MAX_UNCERTAINTY_SAMPLES:
+            return func.HttpResponse(f"uncertainty_samples must be between 1 and {FORECAST_MAX_UNCERTAINTY_SAMPLES} "
+                                     "when intervals are requested", status_code=400)
 
-        future = prophet_model.make_future_dataframe(periods=days)
-        forecast = prophet_model.predict(future)
+        try:
+            model, version, kind = forecast_model(get_param(req, "HomeID", None))
+        except Exception as e:
+            logging.error(f"Error loading Prophet model: {e}")
+            return func.HttpResponse("Prophet model not loaded.", status_code=500)
 
-        # return last `days` forecasts
-        forecast_slice = forecast[['ds','yhat','yhat_lower','yhat_upper']].tail(days)
-        results = forecast_slice.to_dict(orient='records')
-        return func.HttpResponse(body=json.dumps(results, default=str), mimetype="application/json", status_code=200)
+        with telemetry.timer("predict"):
+            results = cached_forecast(model, version, mode, samples)[:days]
+        return table_response(req, results, headers={"X-Forecast-Model": kind})
 
     except Exception as e:
         logging.exception("Forecast error")
@@ -144,18 +194,38 @@ def Forecast(req: func.HttpRequest) -> func.HttpResponse:
 
 # Detect Anomaly (with IsoForest)
 @app.route(route="DetectAnomalies", auth_level=func.AuthLevel.FUNCTION, methods=["POST", "GET"])
+@telemetry.instrumented("DetectAnomalies")
+@profiled("DetectAnomalies")
+@cached_response("DetectAnomalies", version=anomaly_model_version)
 def DetectAnomalies(req: func.HttpRequest) -> func.HttpResponse:
-    if anomaly_pipeline is None:
+    """
+    Query params: HomeID, start, end (optional, YYYY-MM-DD, applied in the Cosmos query),
+    debug, recompute (optional, default false).
+    Scores are normally computed at ingest time and stored on the daily rollup, so this is
+    a lookup; if any returned day is unscored or was scored by another model version (or
+    recompute=true) the features and scores are computed here instead. The format param or
+    Accept header picks json, columns, arrow or parquet (see response_formats).
+    """
+    try:
+        with telemetry.timer("model_load"):
+            anomaly_pipeline, anomaly_version = anomaly_model()
+    except Exception as e:
+        logging.error(f"Error loading IsoForest model: {e}")
         return func.HttpResponse("Anomaly model not loaded.", status_code=500)
 
+    import pandas as pd
+    from anomaly_features import FEATURE_COLS, build_features
+
     try:
         homeid = get_param(req, "HomeID", None)
         start = get_param(req, "start", None)
         end = get_param(req, "end", None)
         debug = get_param(req, "debug", "false").lower() == "true"
+        recompute = str(get_param(req, "recompute", "false")).lower() == "true"
 
-        # build query 
-        sql = "SELECT c.HomeID, c.Date, c.EnergyConsumption, c.ApplianceType FROM c"
+        # build query against the daily rollup (already aggregated per home per day)
+        sql = ("SELECT c.HomeID, c.Date, c.total_kwh, c.unique_appliances, c.rolling_7_mean, c.dow, "
+               "c.score, c.anomaly, c.score_version FROM c")
         where = []
         parameters = []
 
@@ -163,75 +233,60 @@ def DetectAnomalies(req: func.HttpRequest) -> func.HttpResponse:
             where.append("c.HomeID = @homeid")
             parameters.append({"name": "@homeid", "value": homeid})
 
+        try:
+            date_where, date_parameters = date_range_filter(start, end)
+        except ValueError as e:
+            return func.HttpResponse(str(e), status_code=400)
+        where += date_where
+        parameters += date_parameters
+
         if where:
             sql += " WHERE " + " AND ".join(where)
 
-        items = list(container.query_items(
-            query=sql,
-            parameters=parameters if parameters else None,
-            enable_cross_partition_query=True
-        ))
+        with telemetry.timer("query"):
+            items = list(rollup_container().query_items(
+                query=sql,
+                parameters=parameters if parameters else None,
+                enable_cross_partition_query=True
+            ))
+        telemetry.count("rows", len(items))
 
         if not items:
-            return func.HttpResponse(json.dumps([]), mimetype="application/json", status_code=200)
-
-        df = pd.DataFrame(items)
-        df['Date'] = pd.to_datetime(df['Date'], format="%d-%m-%Y")
-
-        # manual date filtering
-        if start:
-            start_dt = pd.to_datetime(start)
-            df = df[df['Date'] >= start_dt]
-        if end:
-            end_dt = pd.to_datetime(end)
-            df = df[df['Date'] <= end_dt]
-
-        if df.empty:
-            return func.HttpResponse(json.dumps([]), mimetype="application/json", status_code=200)
-
-        # aggregate per home per day
-        agg = df.groupby(['HomeID', 'Date']).agg(
-            total_kwh=('EnergyConsumption', 'sum'),
-            unique_appliances=('ApplianceType', 'nunique')
-        ).reset_index()
-
-        # fill missing dates per HomeID
-        filled = []
-        for home in agg['HomeID'].unique():
-            sub = agg[agg['HomeID'] == home].set_index('Date')
-            full_range = pd.date_range(start=sub.index.min(), end=sub.index.max(), freq='D')
-            sub = sub.reindex(full_range, fill_value=0)
-            sub['HomeID'] = home
-            sub = sub.reset_index().rename(columns={'index': 'Date'})
-            filled.append(sub)
-
-        agg = pd.concat(filled).sort_values(['HomeID', 'Date'])
-
-        # feature engineering
-        agg['rolling_7_mean'] = agg.groupby('HomeID')['total_kwh'].transform(lambda x: x.rolling(7, min_periods=1).mean())
-        agg['dow'] = agg['Date'].dt.dayofweek
-
-        feature_cols = ['total_kwh', 'unique_appliances', 'rolling_7_mean', 'dow']
-        X = agg[feature_cols].fillna(0)
-
-        # apply model
-        preds = anomaly_pipeline.predict(X)              # -1 = anomaly, 1 = normal
-        scores = anomaly_pipeline.decision_function(X)   # higher = more normal
-
-        agg['anomaly'] = preds == -1
-        agg['score'] = scores
+            return table_response(req, [])
+
+        agg = pd.DataFrame(items)
+        agg['Date'] = pd.to_datetime(agg['Date'], format="%d-%m-%Y")
+
+        out_cols = ['HomeID', 'Date', 'total_kwh', 'unique_appliances', 'rolling_7_mean', 'dow', 'score', 'anomaly']
+        stored = not recompute and 'score_version' in agg and (agg['score_version'] == anomaly_version).all()
+        if stored:
+            agg = agg.sort_values(['HomeID', 'Date'])
+            agg['dow'] = agg['dow'].astype(int)
+            agg['anomaly'] = agg['anomaly'].astype(bool)
+        else:
+            # fill missing dates per HomeID and add rolling/day-of-week features in one pass
+            with telemetry.timer("feature_build"):
+                agg = build_features(agg[['HomeID', 'Date', 'total_kwh', 'unique_appliances']])
+
+            X = agg[FEATURE_COLS].fillna(0)
+
+            # apply model
+            with telemetry.timer("predict"):
+                preds = anomaly_pipeline.predict(X)              # -1 = anomaly, 1 = normal
+                scores = anomaly_pipeline.decision_function(X)   # higher = more normal
+
+            agg['anomaly'] = preds == -1
+            agg['score'] = scores
 
         if debug:
-            logging.info(f"Total records analyzed: {len(agg)}")
+            logging.info(f"Scores {'read from the rollup' if stored else 'computed'} for {len(agg)} records.")
             logging.info(f"Anomalies detected: {agg['anomaly'].sum()}")
             logging.info(f"Top anomaly:\n{agg[agg['anomaly'] == True].head()}")
-            logging.info(f"Feature matrix:\n{X.head()}")
-            logging.info(f"Scores:\n{scores[:5]}")
+            logging.info(f"Features and scores:\n{agg[FEATURE_COLS + ['score']].head()}")
 
         # results
-        out = agg[['HomeID', 'Date', 'total_kwh', 'unique_appliances', 'rolling_7_mean', 'dow', 'score', 'anomaly']]
-        return func.HttpResponse(body=json.dumps(out.to_dict(orient='records'), default=str),
-                                 mimetype="application/json", status_code=200)
+        out = agg[out_cols]
+        return table_response(req, frame=out, headers={"X-Anomaly-Source": "stored" if stored else "computed"})
 
     except Exception as e:
         logging.exception("DetectAnomalies error")
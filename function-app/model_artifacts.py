@@ -0,0 +1,175 @@
+# model files cached on local disk by blob ETag, revalidated and hot-swapped while the worker runs
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotModifiedError
+
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "model-artifacts"))
+# how often a loaded model checks its blob for a new version (a conditional request, 304 when unchanged)
+MODEL_REVALIDATE_SECONDS = int(os.getenv("MODEL_REVALIDATE_SECONDS", 300))
+# parallel ranged requests per download, and the size of each
+MODEL_DOWNLOAD_CONCURRENCY = int(os.getenv("MODEL_DOWNLOAD_CONCURRENCY", 4))
+MODEL_DOWNLOAD_CHUNK_SIZE = int(os.getenv("MODEL_DOWNLOAD_CHUNK_SIZE", 4 * 1024 * 1024))
+
+
+class AzureBlobSource:
+    """Model blobs in an Azure storage container."""
+
+    def __init__(self, conn_str, container, max_concurrency=MODEL_DOWNLOAD_CONCURRENCY,
+                 chunk_size=MODEL_DOWNLOAD_CHUNK_SIZE):
+        from azure.storage.blob import BlobServiceClient
+        self.container = BlobServiceClient.from_connection_string(
+            conn_str, max_chunk_get_size=chunk_size, max_single_get_size=chunk_size
+        ).get_container_client(container)
+        self.max_concurrency = max_concurrency
+
+    def download(self, name, etag, f):
+        """
+        Stream blob `name` into file `f` unless its ETag is still `etag`.
+        Returns the new ETag, or None when not modified.
+        """
+        options = {"etag": etag, "match_condition": MatchConditions.IfModified} if etag else {}
+        try:
+            downloader = self.container.get_blob_client(name).download_blob(max_concurrency=self.max_concurrency, **options)
+        except ResourceNotModifiedError:
+            return None
+        downloader.readinto(f)
+        return downloader.properties.etag
+
+
+class LocalBlobSource:
+    """
+    Stand-in for a blob container backed by a local directory, for tests and
+    local runs. The ETag is derived from the file's size and mtime.
+    """
+
+    def __init__(self, directory, chunk_size=MODEL_DOWNLOAD_CHUNK_SIZE):
+        self.directory = directory
+        self.chunk_size = chunk_size
+
+    def etag(self, name):
+        st = os.stat(os.path.join(self.directory, name))
+        return '"' + hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest() + '"'
+
+    def download(self, name, etag, f):
+        current = self.etag(name)
+        if etag == current:
+            return None
+        with open(os.path.join(self.directory, name), "rb") as src:
+            shutil.copyfileobj(src, f, self.chunk_size)
+        return current
+
+
+class ArtifactCache:
+    """
+    Local copies of model blobs. Each file sits next to a .etag sidecar, so a
+    new worker on the same instance only revalidates. Downloads go to a
+    temp file that replaces the cached one when complete; readers never see
+    a partial file.
+    """
+
+    def __init__(self, source, directory=MODEL_CACHE_DIR, max_workers=MODEL_DOWNLOAD_CONCURRENCY):
+        self.source = source
+        self.directory = directory
+        self.max_workers = max(1, max_workers)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name.replace("/", "__"))
+
+    def etag(self, name):
+        try:
+            with open(self.path(name) + ".etag", "r") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def refresh(self, names):
+        """Revalidate (and fetch as needed) several artifacts in parallel. Returns {name: etag}."""
+        names = list(names)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(names)) or 1) as executor:
+            return dict(zip(names, executor.map(self.refresh_one, names)))
+
+    def refresh_one(self, name):
+        path = self.path(name)
+        cached = self.etag(name) if os.path.exists(path) else None
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            start = time.perf_counter()
+            with os.fdopen(fd, "wb") as f:
+                etag = self.source.download(name, cached, f)
+                f.flush()
+                os.fsync(f.fileno())
+            if etag is None:
+                return cached
+            os.replace(tmp, path)
+            with open(path + ".etag", "w") as f:
+                f.write(etag)
+            logging.info(f"Downloaded model {name} ({os.path.getsize(path)} bytes, ETag {etag}) "
+                         f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+            return etag
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+class HotModel:
+    """
+    A deserialized model backed by a cached artifact. get() returns what
+    `loader(path)` produced; at most every `revalidate_seconds` one caller
+    revalidates the blob and, if it changed, loads the new file and swaps it
+    in. Other requests keep using the current model meanwhile. Without a
+    cache the model is loaded once from `fallback_path` (packaged files).
+    """
+
+    def __init__(self, name, loader, cache=None, fallback_path=None, revalidate_seconds=MODEL_REVALIDATE_SECONDS):
+        self.name = name
+        self.loader = loader
+        self.cache = cache
+        self.fallback_path = fallback_path
+        self.revalidate_seconds = revalidate_seconds
+
+        self._value = None
+        self._etag = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._value is not None and (self.cache is None or time.time() - self._checked < self.revalidate_seconds):
+            return self._value
+
+        # the first load blocks everyone; later revalidations are done by one caller only
+        if self._value is None:
+            self._lock.acquire()
+        elif not self._lock.acquire(blocking=False):
+            return self._value
+        try:
+            if self.cache is None:
+                if self._value is None:
+                    self._value = self.loader(self.fallback_path)
+                return self._value
+
+            if self._value is None or time.time() - self._checked >= self.revalidate_seconds:
+                self._checked = time.time()
+                etag = self.cache.refresh_one(self.name)
+                if etag != self._etag or self._value is None:
+                    value = self.loader(self.cache.path(self.name))
+                    if self._value is not None:
+                        logging.info(f"Model {self.name} updated to ETag {etag}, swapped in.")
+                    self._value, self._etag = value, etag
+            return self._value
+        except Exception:
+            # keep serving the loaded model if revalidation fails
+            if self._value is None:
+                raise
+            logging.exception(f"Revalidating model {self.name} failed, keeping the loaded version.")
+            return self._value
+        finally:
+            self._lock.release()
@@ -0,0 +1,191 @@
+# lazily loaded per-home prophet models with a memory-bounded LRU
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from azure.core import MatchConditions
+from azure.storage.blob import BlobClient
+from azure.core.exceptions import ResourceNotFoundError, ResourceNotModifiedError
+from model_artifacts import MODEL_REVALIDATE_SECONDS
+
+STORAGE_ACC_CONNECTION_STRING = os.getenv("STORAGE_ACC_CONNECTION_STRING")
+MODEL_CONTAINER = os.getenv("MODEL_CONTAINER")
+
+# per-home model blobs, and an optional {HomeID: cluster} map for per-cluster models
+PROPHET_HOME_BLOB_TEMPLATE = os.getenv("PROPHET_HOME_BLOB_TEMPLATE", "prophet/home_{home_id}.json")
+PROPHET_CLUSTER_BLOB_TEMPLATE = os.getenv("PROPHET_CLUSTER_BLOB_TEMPLATE", "prophet/cluster_{cluster}.json")
+PROPHET_CLUSTER_MAP_BLOB = os.getenv("PROPHET_CLUSTER_MAP_BLOB")
+
+MODEL_REGISTRY_MAX_BYTES = int(os.getenv("MODEL_REGISTRY_MAX_BYTES", 256 * 1024 * 1024))
+MODEL_REGISTRY_MAX_MODELS = int(os.getenv("MODEL_REGISTRY_MAX_MODELS", 200))
+# how long "this home has no model" is remembered before looking again
+MODEL_REGISTRY_MISS_TTL = int(os.getenv("MODEL_REGISTRY_MISS_TTL", 600))
+
+# deserialized prophet models take a few times their json size in memory
+MEMORY_PER_JSON_BYTE = 3
+
+# concurrent loads of the same blob share a lock; blobs hash onto a fixed set of them
+LOAD_LOCKS = 64
+
+
+def download_text(blob_name, etag=None):
+    """(text, etag) of a blob; (None, etag) when it still has ETag `etag`."""
+    blob = BlobClient.from_connection_string(STORAGE_ACC_CONNECTION_STRING, MODEL_CONTAINER, blob_name)
+    options = {"etag": etag, "match_condition": MatchConditions.IfModified} if etag else {}
+    try:
+        downloader = blob.download_blob(encoding="utf-8", **options)
+    except ResourceNotModifiedError:
+        return None, etag
+    return downloader.readall(), downloader.properties.etag
+
+
+class ModelRegistry:
+    """
+    Resolves a HomeID to its own Prophet model, its cluster's model, or None
+    (callers fall back to the global model). Models are downloaded and
+    deserialized on first use and kept in an LRU bounded by model count and
+    estimated memory. Like model_artifacts.HotModel, a cached model checks
+    its blob's ETag at most every `revalidate_seconds` (one caller does, the
+    others keep using the loaded model) and a changed blob is swapped in.
+    """
+
+    def __init__(self, loader=download_text, max_bytes=MODEL_REGISTRY_MAX_BYTES,
+                 max_models=MODEL_REGISTRY_MAX_MODELS, miss_ttl=MODEL_REGISTRY_MISS_TTL,
+                 revalidate_seconds=MODEL_REVALIDATE_SECONDS):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.max_models = max_models
+        self.miss_ttl = miss_ttl
+        self.revalidate_seconds = revalidate_seconds
+
+        self._models = OrderedDict()   # blob name -> (model, version, size, etag, checked)
+        self._misses = {}              # blob name -> time of the failed lookup
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks = [threading.Lock() for _ in range(LOAD_LOCKS)]
+        self._cluster_map = None
+
+    def get(self, home_id):
+        """Return (model, version, kind) with kind "home" or "cluster", or (None, None, "global")."""
+        candidates = [("home", PROPHET_HOME_BLOB_TEMPLATE.format(home_id=home_id))]
+        cluster = self._cluster_of(home_id)
+        if cluster is not None:
+            candidates.append(("cluster", PROPHET_CLUSTER_BLOB_TEMPLATE.format(cluster=cluster)))
+
+        for kind, blob_name in candidates:
+            entry = self._load(blob_name)
+            if entry is not None:
+                model, version = entry
+                return model, version, kind
+        return None, None, "global"
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._misses.clear()
+            self._bytes = 0
+            self._cluster_map = None
+
+    def _cluster_of(self, home_id):
+        if not PROPHET_CLUSTER_MAP_BLOB:
+            return None
+        if self._cluster_map is None:
+            try:
+                text, _ = self.loader(PROPHET_CLUSTER_MAP_BLOB)
+                self._cluster_map = {str(k): v for k, v in json.loads(text).items()}
+            except Exception as e:
+                logging.warning(f"Could not load cluster map {PROPHET_CLUSTER_MAP_BLOB}: {e}")
+                self._cluster_map = {}
+        return self._cluster_map.get(str(home_id))
+
+    def _cached(self, blob_name):
+        """(entry, missed): the cached entry (or None), and whether the blob recently wasn't there."""
+        with self._lock:
+            entry = self._models.get(blob_name)
+            if entry is not None:
+                self._models.move_to_end(blob_name)
+                return entry, False
+            missed_at = self._misses.get(blob_name)
+            return None, missed_at is not None and time.time() - missed_at < self.miss_ttl
+
+    def _fresh(self, entry):
+        return time.time() - entry[4] < self.revalidate_seconds
+
+    def _load(self, blob_name):
+        entry, missed = self._cached(blob_name)
+        if entry is not None and self._fresh(entry):
+            return entry[0], entry[1]
+        if missed:
+            return None
+
+        # one download per blob even when many requests ask for it at once; while
+        # a loaded model is revalidated, other requests keep using it
+        load_lock = self._load_locks[hash(blob_name) % LOAD_LOCKS]
+        if not load_lock.acquire(blocking=entry is None):
+            return entry[0], entry[1]
+        try:
+            entry, missed = self._cached(blob_name)
+            if entry is not None and self._fresh(entry):
+                return entry[0], entry[1]
+            if missed:
+                return None
+            return self._fetch(blob_name, entry)
+        finally:
+            load_lock.release()
+
+    def _fetch(self, blob_name, entry):
+        # prophet is only imported once a per-home model is actually requested
+        from prophet.serialize import model_from_json
+        try:
+            text, etag = self.loader(blob_name, entry[3] if entry else None)
+            if text is None:
+                # unchanged since it was loaded
+                with self._lock:
+                    if blob_name in self._models:
+                        self._models[blob_name] = entry[:4] + (time.time(),)
+                return entry[0], entry[1]
+            model = model_from_json(text)
+        except ResourceNotFoundError:
+            # deleted: the home falls back to its cluster's or the global model
+            self._forget(blob_name)
+            return None
+        except Exception as e:
+            if entry is not None:
+                logging.exception(f"Revalidating model {blob_name} failed, keeping the loaded version.")
+                with self._lock:
+                    if blob_name in self._models:
+                        self._models[blob_name] = entry[:4] + (time.time(),)
+                return entry[0], entry[1]
+            logging.error(f"Failed to load model {blob_name}: {e}")
+            self._forget(blob_name)
+            return None
+
+        # the blob name is part of the version, artifacts of different blobs never share one
+        version = f"{blob_name}@{etag}" if etag else blob_name
+        size = len(text) * MEMORY_PER_JSON_BYTE
+        with self._lock:
+            old = self._models.pop(blob_name, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._models[blob_name] = (model, version, size, etag, time.time())
+            self._bytes += size
+            self._misses.pop(blob_name, None)
+            while len(self._models) > 1 and (len(self._models) > self.max_models or self._bytes > self.max_bytes):
+                _, (_, _, evicted, _, _) = self._models.popitem(last=False)
+                self._bytes -= evicted
+        if entry is not None:
+            logging.info(f"Model {blob_name} updated to ETag {etag}, swapped in.")
+        logging.info(f"Loaded model {blob_name} ({len(self._models)} cached, ~{self._bytes // 1024} KiB)")
+        return model, version
+
+    def _forget(self, blob_name):
+        now = time.time()
+        with self._lock:
+            old = self._models.pop(blob_name, None)
+            if old is not None:
+                self._bytes -= old[2]
+            # expired misses are dropped as new ones come in, so homes without a model don't pile up
+            self._misses = {name: t for name, t in self._misses.items() if now - t < self.miss_ttl}
+            self._misses[blob_name] = now
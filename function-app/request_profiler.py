@@ -0,0 +1,251 @@
+# on-demand profiling of single http invocations, enabled per request with a secret token
+import os
+import sys
+import json
+import time
+import uuid
+import hmac
+import pstats
+import marshal
+import cProfile
+import logging
+import threading
+import functools
+import contextlib
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+import azure.functions as func
+from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceExistsError
+import telemetry
+
+# profiling is off unless a token is configured; requests send it as X-Profile-Token (or ?profile_token=)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile").lower()       # cprofile | sample
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "inline").lower()     # inline | blob
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", 30))
+PROFILE_MEMORY_FRAMES = int(os.getenv("PROFILE_MEMORY_FRAMES", 1))
+
+# blob output
+PROFILE_CONNECTION_STRING = os.getenv("AzureWebJobsStorage")
+PROFILE_CONTAINER = os.getenv("PROFILE_CONTAINER", "profiles")
+
+# cProfile and tracemalloc are process-wide, one profiled request at a time per worker
+_lock = threading.Lock()
+
+
+def _option(req, name, default=None):
+    # X-Profile-<Name> header or profile_<name> query param
+    return req.headers.get(f"x-profile-{name}") or req.params.get(f"profile_{name}") or default
+
+
+class Sampler:
+    """
+    Samples the stacks of the request thread and of the threads it starts
+    (e.g. thread pools) every `interval` seconds, as collapsed stacks:
+    "thread;outer (file:line);...;inner (file:line)" -> samples.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._skip = {t.ident for t in threading.enumerate() if t is not threading.current_thread()}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or ident in self._skip:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def summary(self, top=PROFILE_TOP):
+        # leaf functions by samples, the flat view of the collapsed stacks
+        leaves = Counter()
+        for stack, n in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += n
+        total = max(1, sum(leaves.values()))
+        return [{"function": f, "samples": n, "percent": round(100 * n / total, 1)} for f, n in leaves.most_common(top)]
+
+
+def cprofile_summary(stats, top=PROFILE_TOP):
+    rows = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:top]
+    return [{"function": f"{os.path.basename(file)}:{line}({name})", "calls": nc,
+             "tottime_ms": round(tt * 1000, 2), "cumtime_ms": round(ct * 1000, 2)}
+            for (file, line, name), (cc, nc, tt, ct, callers) in rows]
+
+
+class MemoryDelta:
+    """Allocations made during the block (net of frees) by source line, and the peak traced memory."""
+
+    def __enter__(self):
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start(PROFILE_MEMORY_FRAMES)
+        tracemalloc.reset_peak()
+        self.before = tracemalloc.take_snapshot()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.after = tracemalloc.take_snapshot()
+        self.current, self.peak = tracemalloc.get_traced_memory()
+        if self.started:
+            tracemalloc.stop()
+
+    def summary(self, top=PROFILE_TOP):
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        diff = self.after.filter_traces(ignore).compare_to(self.before.filter_traces(ignore), "lineno")
+        return {
+            "peak_bytes": self.peak,
+            "net_bytes": sum(d.size_diff for d in diff),
+            "top": [{"line": f"{os.path.basename(d.traceback[0].filename)}:{d.traceback[0].lineno}",
+                     "size_diff": d.size_diff, "count_diff": d.count_diff} for d in diff[:top]],
+        }
+
+
+def upload_artifacts(blob_prefix, artifacts):
+    service = BlobServiceClient.from_connection_string(PROFILE_CONNECTION_STRING)
+    container = service.get_container_client(PROFILE_CONTAINER)
+    try:
+        container.create_container()
+    except ResourceExistsError:
+        pass
+    names = []
+    for suffix, data in artifacts.items():
+        name = f"{blob_prefix}{suffix}"
+        container.upload_blob(name, data, overwrite=True)
+        names.append(f"{PROFILE_CONTAINER}/{name}")
+    return names
+
+
+def run_profiled(name, fn, req, mode, output, memory):
+    profile_id = uuid.uuid4().hex[:12]
+    metrics = telemetry.current()
+    if metrics is not None:
+        metrics.attributes["profile_id"] = profile_id
+
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    sampler = Sampler(PROFILE_SAMPLE_INTERVAL_MS / 1000) if mode == "sample" else None
+    mem = MemoryDelta() if memory else None
+
+    start = time.perf_counter()
+    with mem or contextlib.nullcontext():
+        if profiler:
+            profiler.enable()
+            try:
+                resp = fn(req)
+            finally:
+                profiler.disable()
+        else:
+            with sampler:
+                resp = fn(req)
+    duration = time.perf_counter() - start
+
+    report = {
+        "function": name,
+        "profile_id": profile_id,
+        "mode": mode,
+        "status_code": resp.status_code,
+        "response_bytes": len(resp.get_body() or b""),
+        "duration_ms": round(duration * 1000, 2),
+    }
+    artifacts = {}
+    if profiler:
+        stats = pstats.Stats(profiler)
+        report["functions"] = cprofile_summary(stats)
+        # same format as pstats.Stats.dump_stats, load with pstats.Stats(path) or snakeviz
+        artifacts[".pstats"] = marshal.dumps(stats.stats)
+    else:
+        report["samples"] = sampler.samples
+        report["functions"] = sampler.summary()
+        # flamegraph.pl / speedscope input
+        artifacts[".collapsed"] = sampler.collapsed().encode()
+    if mem:
+        report["memory"] = mem.summary()
+
+    logging.info(f"Profiled {name} ({mode}, id {profile_id}) in {report['duration_ms']} ms")
+
+    if output == "blob" and PROFILE_CONNECTION_STRING:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        artifacts[".json"] = json.dumps(report, default=str).encode()
+        try:
+            names = upload_artifacts(f"{name}/{stamp}_{profile_id}", artifacts)
+        except Exception as e:
+            logging.error(f"Could not upload profile {profile_id}, returning it inline: {e}")
+            report["upload_error"] = str(e)
+        else:
+            headers = dict(resp.headers)
+            headers.pop("Content-Type", None)
+            headers.update({"X-Profile-Id": profile_id, "X-Profile-Artifacts": ",".join(names)})
+            return func.HttpResponse(body=resp.get_body(), mimetype=resp.mimetype, headers=headers,
+                                     status_code=resp.status_code)
+
+    if not profiler:
+        report["collapsed"] = artifacts[".collapsed"].decode()
+    return func.HttpResponse(body=json.dumps(report, default=str), mimetype="application/json",
+                             headers={"X-Profile-Id": profile_id}, status_code=200)
+
+
+def profiled(name):
+    """
+    Decorator for http functions: a request carrying the profile token runs
+    under cProfile (or the stack sampler) with allocation tracking and gets
+    the profile back instead of the response, or, with output=blob, the
+    normal response with the artifacts written to PROFILE_CONTAINER.
+    Options as X-Profile-<Option> headers or profile_<option> params:
+    mode (cprofile | sample), output (inline | blob), memory (true | false).
+
+    Profiled requests call the function under the decorators below this
+    one (fn.__wrapped__, e.g. past cached_response), so the cache neither
+    answers nor stores them.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(req: func.HttpRequest) -> func.HttpResponse:
+            token = _option(req, "token")
+            if not PROFILE_TOKEN or not token:
+                return fn(req)
+            if not hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()):
+                return func.HttpResponse("Invalid profile token", status_code=403)
+
+            mode = _option(req, "mode", PROFILE_MODE).lower()
+            output = _option(req, "output", PROFILE_OUTPUT).lower()
+            if mode not in ("cprofile", "sample") or output not in ("inline", "blob"):
+                return func.HttpResponse("profile mode must be cprofile or sample, output inline or blob",
+                                         status_code=400)
+            memory = _option(req, "memory", "true").lower() != "false"
+
+            if not _lock.acquire(blocking=False):
+                resp = fn(req)
+                resp.headers["X-Profile-Status"] = "busy"
+                return resp
+            try:
+                return run_profiled(name, getattr(fn, "__wrapped__", fn), req, mode, output, memory)
+            finally:
+                _lock.release()
+        return wrapper
+    return decorator
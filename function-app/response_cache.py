@@ -0,0 +1,239 @@
+# response cache for the http endpoints, invalidated by ingestion
+import os
+import json
+import time
+import uuid
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+import functools
+from collections import OrderedDict
+import azure.functions as func
+import telemetry
+
+# cache settings: memory | file | none
+# memory is per worker process: an ingest only invalidates the process that ran it, the others serve
+# stale entries until RESPONSE_CACHE_TTL. file is shared by every process that shares RESPONSE_CACHE_DIR,
+# i.e. the workers of one instance (the default when the host runs several), or all instances on a
+# mounted share; instances that don't share it keep the same TTL-bounded staleness.
+FUNCTIONS_WORKER_PROCESS_COUNT = int(os.getenv("FUNCTIONS_WORKER_PROCESS_COUNT", 1))
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "file" if FUNCTIONS_WORKER_PROCESS_COUNT > 1 else "memory").lower()
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 300))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 256))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "response-cache"))
+
+DATA_VERSION_KEY = "__data_version__"
+
+# request headers that change the response body
+VARY_HEADERS = ["accept", "accept-encoding", "x-ms-continuation"]
+
+
+class MemoryBackend:
+    """
+    In-process LRU with per-entry TTL, bounded by entry count and total body
+    bytes. The data version lives here too, so bump_data_version() only
+    reaches this process (see RESPONSE_CACHE_BACKEND).
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value, size = entry
+            if expires is not None and expires < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = len(value.get("body", b"")) if isinstance(value, dict) else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + ttl if ttl else None, value, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+class FileBackend:
+    """
+    Entries as files in a directory, so workers that share the directory
+    (e.g. a mounted /home share) share the cache and the data version.
+    Eviction is least-recently-used by file mtime.
+    """
+
+    def __init__(self, directory=RESPONSE_CACHE_DIR, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires"] is not None and entry["expires"] < time.time():
+            self._unlink(path)
+            return None
+        os.utime(path)
+        value = entry["value"]
+        if isinstance(value, dict) and "body" in value:
+            value = dict(value, body=base64.b64decode(value["body"]))
+        return value
+
+    def set(self, key, value, ttl=None):
+        if isinstance(value, dict) and "body" in value:
+            value = dict(value, body=base64.b64encode(value["body"]).decode("ascii"))
+        entry = {"expires": time.time() + ttl if ttl else None, "value": value}
+
+        # write then rename, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            self._unlink(os.path.join(self.directory, name))
+
+    def _evict(self):
+        paths = [os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith(".json")]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            if path != self._path(DATA_VERSION_KEY):
+                self._unlink(path)
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _default_backend():
+    if RESPONSE_CACHE_BACKEND == "none":
+        return None
+    if RESPONSE_CACHE_BACKEND == "file":
+        return FileBackend()
+    return MemoryBackend()
+
+
+backend = _default_backend()
+
+
+def set_backend(new_backend):
+    global backend
+    backend = new_backend
+
+
+def get_data_version():
+    if backend is None:
+        return None
+    version = backend.get(DATA_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        backend.set(DATA_VERSION_KEY, version)
+    return version
+
+
+def bump_data_version():
+    # called after ingestion writes data; every cached response becomes stale
+    if backend is None:
+        return
+    backend.set(DATA_VERSION_KEY, uuid.uuid4().hex)
+    logging.info("Response cache invalidated (data version bumped).")
+
+
+def cache_key(endpoint, req, version):
+    params = sorted((k, v) for k, v in req.params.items())
+    headers = [(h, req.headers.get(h)) for h in VARY_HEADERS if req.headers.get(h)]
+    body = hashlib.sha1(req.get_body() or b"").hexdigest()
+    return json.dumps([endpoint, version, params, headers, body])
+
+
+def _etag(version, body):
+    return '"' + hashlib.sha1(version.encode() + body).hexdigest() + '"'
+
+
+def _not_modified(req, etag):
+    if_none_match = req.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+
+
+def cached_response(endpoint, ttl=None, version=None):
+    """
+    Cache successful responses of an http function by endpoint, query
+    params, body and varying headers for the current data version. Every
+    response carries an ETag; a matching If-None-Match gets a 304.
+    `version`, a callable taking the request, adds what else the response
+    depends on (e.g. the model serving it) to the key and the ETag.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(req: func.HttpRequest) -> func.HttpResponse:
+            if backend is None:
+                return fn(req)
+
+            version_key = get_data_version()
+            if version is not None:
+                version_key = f"{version_key}:{version(req)}"
+            key = cache_key(endpoint, req, version_key)
+            entry = backend.get(key)
+            cache_status = "HIT"
+
+            if entry is None:
+                cache_status = "MISS"
+                resp = fn(req)
+                if resp.status_code != 200:
+                    return resp
+                body = resp.get_body()
+                entry = {
+                    "body": body,
+                    "mimetype": resp.mimetype,
+                    "headers": {k: v for k, v in resp.headers.items() if k.lower() != "content-type"},
+                    "etag": _etag(version_key, body),
+                }
+                backend.set(key, entry, ttl or RESPONSE_CACHE_TTL)
+
+            headers = dict(entry["headers"], ETag=entry["etag"])
+            headers["X-Cache"] = cache_status
+            telemetry.count(f"cache.{cache_status.lower()}")
+            if _not_modified(req, entry["etag"]):
+                return func.HttpResponse(status_code=304, headers=headers)
+            return func.HttpResponse(body=entry["body"], mimetype=entry["mimetype"], headers=headers, status_code=200)
+
+        return wrapper
+    return decorator
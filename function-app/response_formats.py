@@ -0,0 +1,188 @@
+# content negotiation for the tabular http responses: row or column json, arrow, parquet; gzip/brotli transfer encoding
+import io
+import os
+import gzip
+import json
+import azure.functions as func
+import telemetry
+
+# bodies smaller than this are sent uncompressed
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", 1024))
+# fast levels: the response is compressed on every cache miss
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", 5))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", 5))
+
+# format -> media type; "json" (an array of records) stays the default
+MIMETYPES = {
+    "json": "application/json",
+    "columns": "application/vnd.columns+json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+ACCEPT_ALIASES = {"application/x-parquet": "parquet"}
+
+# already compressed
+NO_TRANSFER_ENCODING = {"parquet"}
+
+
+def _accepted(header):
+    # [(value, q)] from an Accept or Accept-Encoding header, best first
+    accepted = []
+    for i, part in enumerate((header or "").split(",")):
+        value, *params = [p.strip() for p in part.split(";")]
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted.append((value.lower(), q, i))
+    return [(value, q) for value, q, _ in sorted(accepted, key=lambda a: (-a[1], a[2])) if q > 0]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def _brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
+def negotiate_format(req, formats=tuple(MIMETYPES)):
+    """
+    The response format from the `format` query param, else the Accept
+    header, else "json". Raises ValueError for a requested format that is
+    not offered (or whose library is missing).
+    """
+    requested = (req.params.get("format") or "").lower()
+    if requested:
+        if requested not in formats:
+            raise ValueError(f"format must be one of {', '.join(formats)}")
+        if requested in ("arrow", "parquet") and _pyarrow() is None:
+            raise ValueError(f"format {requested} is not available on this server")
+        return requested
+
+    by_mimetype = {MIMETYPES[f]: f for f in formats}
+    for value, _ in _accepted(req.headers.get("Accept")):
+        fmt = by_mimetype.get(value) or ACCEPT_ALIASES.get(value)
+        if fmt in formats and (fmt not in ("arrow", "parquet") or _pyarrow() is not None):
+            return fmt
+        if value in ("*/*", "application/*"):
+            break
+    return "json"
+
+
+def negotiate_encoding(req):
+    """"br" or "gzip" when the client accepts it (brotli only if installed), else None."""
+    for value, _ in _accepted(req.headers.get("Accept-Encoding")):
+        if value == "br" and _brotli() is not None:
+            return "br"
+        if value in ("gzip", "x-gzip"):
+            return "gzip"
+        if value == "*":
+            return "gzip"
+    return None
+
+
+def to_columns(records):
+    """{column: [values]} from a list of records; keys missing from a record are None."""
+    names = list(dict.fromkeys(k for record in records for k in record))
+    return {name: [record.get(name) for record in records] for name in names}
+
+
+def _frame_columns(frame):
+    return {str(c): frame[c].tolist() for c in frame.columns}
+
+
+def _arrow_table(records=None, frame=None):
+    pa = _pyarrow()
+    if frame is not None:
+        return pa.Table.from_pandas(frame, preserve_index=False)
+    arrays = {}
+    for name, values in to_columns(records).items():
+        try:
+            arrays[name] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # mixed types in a column: strings, like json's default=str
+            arrays[name] = pa.array([None if v is None else str(v) for v in values], pa.string())
+    return pa.table(arrays)
+
+
+def serialize(fmt, records=None, frame=None):
+    """Body bytes of `records` (a list of dicts) or `frame` (a DataFrame) in `fmt`."""
+    if fmt == "json":
+        data = records if frame is None else frame.to_dict(orient="records")
+        return json.dumps(data, default=str).encode()
+    if fmt == "columns":
+        data = to_columns(records) if frame is None else _frame_columns(frame)
+        return json.dumps(data, default=str).encode()
+    if fmt == "ndjson":
+        data = records if frame is None else frame.to_dict(orient="records")
+        return "".join(json.dumps(item, default=str) + "\n" for item in data).encode()
+
+    table = _arrow_table(records, frame)
+    sink = io.BytesIO()
+    if fmt == "arrow":
+        import pyarrow.ipc
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, sink)
+    return sink.getvalue()
+
+
+def encode(req, body, headers, compressible=True):
+    """Compress `body` for the client's Accept-Encoding; sets Content-Encoding and Vary in `headers`."""
+    headers["Vary"] = "Accept, Accept-Encoding"
+    encoding = negotiate_encoding(req) if compressible and len(body) >= RESPONSE_COMPRESS_MIN_BYTES else None
+    if encoding is None:
+        return body
+    with telemetry.timer("compress"):
+        if encoding == "br":
+            compressed = _brotli().compress(body, quality=RESPONSE_BROTLI_QUALITY)
+        else:
+            compressed = gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+    headers["Content-Encoding"] = encoding
+    return compressed
+
+
+def table_response(req, records=None, frame=None, fmt=None, headers=None, status_code=200):
+    """
+    An HttpResponse of tabular data (records or a DataFrame) in the
+    negotiated format and transfer encoding. `fmt` skips negotiation.
+    """
+    headers = dict(headers or {})
+    if fmt is None:
+        try:
+            fmt = negotiate_format(req)
+        except ValueError as e:
+            return func.HttpResponse(str(e), status_code=400)
+
+    with telemetry.timer("serialize"):
+        body = serialize(fmt, records, frame)
+    body = encode(req, body, headers, compressible=fmt not in NO_TRANSFER_ENCODING)
+    telemetry.count("response_bytes", len(body))
+    return func.HttpResponse(body=body, mimetype=MIMETYPES[fmt], headers=headers, status_code=status_code)
+
+
+def json_response(req, data, headers=None, status_code=200):
+    """A non-tabular json body, with transfer encoding."""
+    headers = dict(headers or {})
+    with telemetry.timer("serialize"):
+        body = json.dumps(data, default=str).encode()
+    body = encode(req, body, headers)
+    telemetry.count("response_bytes", len(body))
+    return func.HttpResponse(body=body, mimetype="application/json", headers=headers, status_code=status_code)
@@ -0,0 +1,197 @@
+# request-unit budget for cosmos writes: a token bucket fed at the provisioned RU/s, refunded or charged
+# with the actual request charge of each response, and an in-flight limit that backs off when throttled
+import os
+import time
+import logging
+import threading
+from azure.core.exceptions import HttpResponseError
+
+# throughput the containers are created with, per container
+COSMOS_PROVISIONED_RU = int(os.getenv("COSMOS_PROVISIONED_RU", 400))
+# share of it the writers may use, the rest is left for api reads
+COSMOS_RU_WRITE_SHARE = float(os.getenv("COSMOS_RU_WRITE_SHARE", 0.9))
+# set to "false" to write without the limiter (the sdk still retries 429s on its own)
+COSMOS_RU_LIMITER = os.getenv("COSMOS_RU_LIMITER", "true").lower() == "true"
+# 429s retried by the limiter after the sdk has given up, and concurrent requests per container
+COSMOS_THROTTLE_RETRIES = int(os.getenv("COSMOS_THROTTLE_RETRIES", 8))
+COSMOS_WRITE_MAX_CONCURRENCY = int(os.getenv("COSMOS_WRITE_MAX_CONCURRENCY", 8))
+
+# cosmos transactional batches are limited to 100 operations per partition key
+MAX_BATCH_OPERATIONS = 100
+
+REQUEST_CHARGE = "x-ms-request-charge"
+RETRY_AFTER_MS = "x-ms-retry-after-ms"
+THROTTLE_RETRY_COUNT = "x-ms-throttle-retry-count"
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RULimiter:
+    """
+    Paces requests to `ru_per_second`. Before a request, the expected charge
+    (operations x the running average charge per operation) is taken from
+    the bucket; the response's x-ms-request-charge then settles the
+    difference, so the bucket tracks what was really spent.
+
+    Concurrency is adjusted additively-increase/multiplicatively-decrease:
+    one more request in flight after each round of unthrottled responses,
+    half as many after a 429 (or a response the sdk had to retry). A 429's
+    retry-after pauses every caller, not just the one that got it.
+    """
+
+    def __init__(self, ru_per_second, burst_seconds=1.0, max_concurrency=COSMOS_WRITE_MAX_CONCURRENCY,
+                 min_concurrency=1, charge_per_op=10.0, max_retries=COSMOS_THROTTLE_RETRIES,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.ru_per_second = float(ru_per_second)
+        self.capacity = self.ru_per_second * burst_seconds
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.concurrency = self.min_concurrency
+        self.charge_per_op = charge_per_op
+        self.max_retries = max_retries
+        self.clock = clock
+        self.sleep = sleep
+
+        self.tokens = self.capacity
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.ru_charged = 0.0
+
+        self._refilled = clock()
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def call(self, fn, *args, ops=1, **kwargs):
+        """
+        Run `fn(*args, response_hook=..., **kwargs)` (a cosmos sdk call) within
+        the budget, retrying 429s after their retry-after. Other errors are
+        raised as they come; the in-flight slot is released either way.
+        """
+        for attempt in range(self.max_retries + 1):
+            estimate = max(1, ops) * self.charge_per_op
+            self._acquire(estimate)
+            headers = {}
+            charge = 0.0
+            try:
+                result = fn(*args, response_hook=lambda h, _: headers.update(h), **kwargs)
+                charge = header_float(headers, REQUEST_CHARGE)
+            except HttpResponseError as e:
+                # CosmosHttpResponseError, or CosmosBatchOperationError from a transactional batch
+                e_headers = getattr(e, "headers", None) or {}
+                if e.status_code != 429:
+                    charge = header_float(e_headers, REQUEST_CHARGE)
+                    raise
+                self._on_throttle(header_float(e_headers, RETRY_AFTER_MS) / 1000 or 1.0)
+                if attempt == self.max_retries:
+                    raise
+                continue
+            finally:
+                # the slot is given back however the call ends, or later callers wait for it forever
+                self._release(estimate, charge, ops)
+
+            if header_float(headers, THROTTLE_RETRY_COUNT):
+                # the sdk already waited out its 429s, only back off
+                self._on_throttle(0.0)
+            else:
+                self._on_success()
+            return result
+
+    def stats(self):
+        return (f"{self.requests} requests, {self.ru_charged:.0f} RU, {self.throttled} throttled, "
+                f"concurrency {self.concurrency}/{self.max_concurrency}, ~{self.charge_per_op:.1f} RU/op")
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._refilled) * self.ru_per_second)
+        self._refilled = now
+
+    def _acquire(self, estimate):
+        # a request costing more than the bucket holds waits for a full bucket
+        needed = min(estimate, self.capacity)
+        with self._cond:
+            while True:
+                now = self.clock()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.in_flight >= self.concurrency:
+                    wait = None
+                elif self.tokens >= needed:
+                    self.tokens -= estimate
+                    self.in_flight += 1
+                    return
+                else:
+                    wait = (needed - self.tokens) / self.ru_per_second
+                if wait is None:
+                    self._cond.wait()
+                else:
+                    self._cond.release()
+                    try:
+                        self.sleep(wait)
+                    finally:
+                        self._cond.acquire()
+
+    def _release(self, estimate, charge, ops):
+        with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            if charge:
+                self.tokens += estimate - charge
+                self.ru_charged += charge
+                self.charge_per_op += 0.2 * (charge / max(1, ops) - self.charge_per_op)
+            self._cond.notify_all()
+
+    def _on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def _on_throttle(self, retry_after):
+        with self._cond:
+            now = self.clock()
+            self.throttled += 1
+            self._successes = 0
+            self.tokens = min(self.tokens, 0.0)
+            self.paused_until = max(self.paused_until, now + retry_after)
+            # one decrease per burst of 429s, they usually arrive together
+            if now - self._last_decrease >= max(retry_after, 1.0):
+                self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                self._last_decrease = now
+                logging.warning(f"Cosmos throttled, write concurrency down to {self.concurrency} "
+                                f"(retry after {retry_after:.2f}s).")
+            self._cond.notify_all()
+
+
+def header_float(headers, name):
+    try:
+        return float(headers.get(name) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def for_container(container):
+    """The shared limiter for a container (throughput is provisioned per container), or None when disabled."""
+    if not COSMOS_RU_LIMITER:
+        return None
+    name = getattr(container, "id", None)
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RULimiter(COSMOS_PROVISIONED_RU * COSMOS_RU_WRITE_SHARE)
+        return _limiters[name]
+
+
+def execute_batches(container, operations, partition_key, limiter=None):
+    """Run `operations` for one partition as transactional batches of up to 100, within the container's RU budget."""
+    limiter = limiter or for_container(container)
+    for i in range(0, len(operations), MAX_BATCH_OPERATIONS):
+        batch = operations[i:i + MAX_BATCH_OPERATIONS]
+        if limiter is None:
+            container.execute_item_batch(batch_operations=batch, partition_key=partition_key)
+        else:
+            limiter.call(container.execute_item_batch, batch_operations=batch, partition_key=partition_key, ops=len(batch))
@@ -0,0 +1,146 @@
+# season x appliance consumption aggregate, kept up to date by ingestion
+import logging
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosResourceExistsError, CosmosResourceNotFoundError
+
+AGGREGATE_ID = "seasonal_consumption"
+MAX_CONFLICT_RETRIES = 5
+
+
+def add_delta(deltas, season, appliance, kwh, count):
+    key = f"{season}|{appliance}"
+    total, n = deltas.get(key, (0.0, 0))
+    deltas[key] = (total + kwh, n + count)
+
+
+def to_results(groups):
+    # groups: {"Season|ApplianceType": [total, count]}
+    results = []
+    for key, (total, count) in sorted(groups.items()):
+        season, appliance = key.split("|", 1)
+        if count <= 0:
+            continue
+        results.append({
+            "Season": season,
+            "ApplianceType": appliance,
+            "total": total,
+            "count": count,
+            "mean": total / count
+        })
+    return results
+
+
+def read_aggregate(container):
+    try:
+        return container.read_item(item=AGGREGATE_ID, partition_key=AGGREGATE_ID)
+    except CosmosResourceNotFoundError:
+        return None
+
+
+def apply_deltas(container, deltas, rollup_container=None):
+    """
+    Add `deltas` to the stored aggregate with optimistic concurrency.
+    If the aggregate doesn't exist yet (or was dropped) it is seeded from
+    `rollup_container` instead, which already holds the readings the deltas
+    came from. If the update can't be applied the aggregate is dropped, so
+    readers fall back to the rollup instead of serving drifted numbers.
+    """
+    if not deltas:
+        return True
+
+    for _ in range(MAX_CONFLICT_RETRIES):
+        doc = read_aggregate(container)
+        if doc is None:
+            return seed(rollup_container, container) if rollup_container is not None else True
+
+        groups = doc.setdefault("groups", {})
+        for key, (kwh, count) in deltas.items():
+            total, n = groups.get(key, (0.0, 0))
+            groups[key] = [total + kwh, n + count]
+
+        try:
+            container.replace_item(item=AGGREGATE_ID, body={k: v for k, v in doc.items() if not k.startswith("_")},
+                                   etag=doc["_etag"], match_condition=MatchConditions.IfNotModified)
+            return True
+        except CosmosHttpResponseError as e:
+            if e.status_code != 412:
+                logging.error(f"Seasonal aggregate update failed ({e.status_code}): {e.message}")
+                break
+
+    invalidate(container)
+    return False
+
+
+def invalidate(container):
+    try:
+        container.delete_item(item=AGGREGATE_ID, partition_key=AGGREGATE_ID)
+        logging.warning("Seasonal aggregate dropped, it is summed from the daily rollup until an ingest seeds it again.")
+    except CosmosResourceNotFoundError:
+        pass
+
+
+def _add_group(groups, key, kwh, count):
+    total, n = groups.get(key, (0.0, 0))
+    groups[key] = [total + kwh, n + count]
+
+
+def rollup_groups(rollup_container, where=(), parameters=()):
+    """
+    Season x ApplianceType [total, count] summed from the daily rollup: the
+    "seasonal" map of each home-day (see daily_rollup.summarize), or its
+    readings for days rolled up before the map existed. `where`/`parameters`
+    narrow the home-days (e.g. a DateISO range). Only projections come back
+    from the cross-partition queries, the sums are done here.
+    """
+    def values(field, condition):
+        query = f"SELECT VALUE c.{field} FROM c WHERE " + " AND ".join([condition] + list(where))
+        return rollup_container.query_items(query=query, parameters=list(parameters), enable_cross_partition_query=True)
+
+    groups = {}
+    for seasonal in values("seasonal", "IS_DEFINED(c.seasonal)"):
+        for key, (kwh, count) in seasonal.items():
+            _add_group(groups, key, kwh, count)
+    for readings in values("readings", "NOT IS_DEFINED(c.seasonal)"):
+        for r in readings.values():
+            _add_group(groups, f"{r[2] if len(r) > 2 else None}|{r[0]}", r[1], 1)
+    return groups
+
+
+def seed(rollup_container, container):
+    """
+    Create the aggregate from the daily rollup if it doesn't exist. A seed
+    racing another one may have missed or double counted the readings the
+    other writer rolled up meanwhile, so the loser drops the aggregate and a
+    later ingest seeds it again.
+    """
+    try:
+        container.create_item({"id": AGGREGATE_ID, "groups": rollup_groups(rollup_container)})
+        logging.info("Seasonal aggregate seeded from the daily rollup.")
+        return True
+    except CosmosResourceExistsError:
+        invalidate(container)
+        return False
+
+
+def rebuild(rollup_container, container):
+    """
+    Recompute the aggregate from the daily rollup. The result is created, or
+    replaced only if the aggregate is unchanged since it was read (before
+    summing), so deltas applied meanwhile aren't overwritten: the sums are
+    recomputed instead. Returns the groups, or None if it kept conflicting.
+    """
+    for _ in range(MAX_CONFLICT_RETRIES):
+        doc = read_aggregate(container)
+        groups = rollup_groups(rollup_container)
+        body = {"id": AGGREGATE_ID, "groups": groups}
+        try:
+            if doc is None:
+                container.create_item(body)
+            else:
+                container.replace_item(item=AGGREGATE_ID, body=body, etag=doc["_etag"],
+                                       match_condition=MatchConditions.IfNotModified)
+            return groups
+        except CosmosHttpResponseError as e:
+            if e.status_code not in (409, 412):
+                raise
+    return None
@@ -0,0 +1,262 @@
+# large csv blobs are split into line-aligned byte ranges, each ingested by its own queue-triggered invocation
+import io
+import os
+import re
+import gzip
+import json
+import zlib
+from azure.storage.blob import BlobClient
+from azure.core.exceptions import ResourceNotFoundError, ResourceExistsError
+
+# blobs at least this large are sharded (0 turns sharding off); gzip blobs can't be split and never are
+INGEST_SHARD_MIN_BYTES = int(os.getenv("INGEST_SHARD_MIN_BYTES", 64 * 1024 * 1024))
+INGEST_SHARD_BYTES = int(os.getenv("INGEST_SHARD_BYTES", 32 * 1024 * 1024))
+INGEST_SHARD_QUEUE = os.getenv("INGEST_SHARD_QUEUE", "ingest-shards")
+# a shard is read, written and checkpointed this many bytes at a time
+INGEST_SHARD_BLOCK_BYTES = int(os.getenv("INGEST_SHARD_BLOCK_BYTES", 4 * 1024 * 1024))
+
+# a blob that isn't sharded is downloaded this many bytes per request (the SDK's first request
+# would otherwise fetch up to 32 MB at once)
+INGEST_DOWNLOAD_CHUNK_BYTES = int(os.getenv("INGEST_DOWNLOAD_CHUNK_BYTES", 4 * 1024 * 1024))
+
+# source blobs, and checkpoints next to the ingest manifests
+SHARD_CONNECTION_STRING = os.getenv("AzureWebJobsStorage")
+SHARD_CHECKPOINT_CONTAINER = os.getenv("INGEST_MANIFEST_CONTAINER", "ingest-manifests")
+
+# bytes read past a nominal boundary to find the end of the line
+SCAN_BYTES = 64 * 1024
+
+# each phase runs once per shard (finalize: once per group of homes, as many as shards); the last
+# invocation of a phase to finish queues the next. Shards number the rows sharing a key within
+# themselves; keys that occur in several shards are renumbered across the blob before finalize.
+PHASES = ["ingest", "finalize"]
+
+
+def should_shard(blob_path, size):
+    return INGEST_SHARD_MIN_BYTES > 0 and (size or 0) >= INGEST_SHARD_MIN_BYTES and not blob_path.lower().endswith(".gz")
+
+
+def source_blob(blob_path):
+    # blob paths are "<container>/<blob>"
+    container, blob = blob_path.split("/", 1)
+    return BlobClient.from_connection_string(SHARD_CONNECTION_STRING, container, blob,
+                                             max_single_get_size=INGEST_DOWNLOAD_CHUNK_BYTES,
+                                             max_chunk_get_size=INGEST_DOWNLOAD_CHUNK_BYTES)
+
+
+def event_blob_path(subject):
+    """The "<container>/<blob>" path of a BlobCreated event's subject, or None."""
+    match = re.match(r"^/blobServices/default/containers/([^/]+)/blobs/(.+)$", subject or "")
+    return f"{match.group(1)}/{match.group(2)}" if match else None
+
+
+def _next_line_start(blob, offset, size):
+    """Offset of the first line starting at or after `offset`, or `size`."""
+    while offset < size:
+        data = blob.download_blob(offset=offset, length=min(SCAN_BYTES, size - offset)).readall()
+        newline = data.find(b"\n")
+        if newline >= 0:
+            return offset + newline + 1
+        offset += len(data)
+    return size
+
+
+def plan_shards(blob, size, shard_bytes=INGEST_SHARD_BYTES):
+    """
+    Returns (header, [(start, end), ...]): the csv header line and
+    line-aligned byte ranges covering the rows. Assumes no quoted field
+    spans lines (true of the exports this pipeline ingests).
+    """
+    data_start = _next_line_start(blob, 0, size)
+    header = blob.download_blob(offset=0, length=data_start).readall().decode("utf-8-sig")
+    ranges = []
+    start = data_start
+    while start < size:
+        end = _next_line_start(blob, start + max(1, shard_bytes) - 1, size)
+        ranges.append((start, end))
+        start = end
+    return header, ranges
+
+
+def shard_messages(blob_path, etag, ranges, phase=PHASES[0]):
+    # one message per shard (or group of homes) of the phase; the header and
+    # the whole plan are in the checkpoint, a message stays small whatever the number of shards
+    return [json.dumps({"blob": blob_path, "etag": etag, "phase": phase, "index": i, "start": start, "end": end})
+            for i, (start, end) in enumerate(ranges)]
+
+
+def next_phase(phase):
+    index = PHASES.index(phase) + 1
+    return PHASES[index] if index < len(PHASES) else None
+
+
+def bucket_of(value, count):
+    # the finalize group of a HomeID
+    return zlib.crc32(str(value).encode()) % count
+
+
+def previous_rows(blob_path, manifest, start=0, end=None):
+    """
+    Row hashes from the previous ingest of a blob for the bytes start-end:
+    all of them for a whole-blob manifest, those of the overlapping shards
+    for a sharded one (exact when the shards line up, as for an unchanged
+    or appended upload; rows that moved are just written again).
+    """
+    ranges = manifest.get("shards")
+    if not ranges:
+        return manifest.get("rows", {})
+    previous = ShardCheckpoint(blob_path, manifest["etag"])
+    rows = {}
+    for index, (shard_start, shard_end) in enumerate(ranges):
+        if shard_start < (end if end is not None else shard_end) and start < shard_end:
+            rows.update(previous.load_rows(index))
+    return rows
+
+
+def iter_blocks(blob, start, end, block_bytes=INGEST_SHARD_BLOCK_BYTES):
+    """
+    Yield (block, next_offset) for the range, each block ending on a line
+    boundary (a line longer than a block makes that block longer).
+    """
+    pos = start
+    while pos < end:
+        data = blob.download_blob(offset=pos, length=min(block_bytes, end - pos)).readall()
+        if pos + len(data) < end:
+            cut = data.rfind(b"\n") + 1
+            if cut == 0:
+                cut = _next_line_start(blob, pos + len(data), end) - pos
+                data = blob.download_blob(offset=pos, length=cut).readall()
+            data = data[:cut]
+        pos += len(data)
+        yield data, pos
+
+
+def block_stream(header, block):
+    """A csv stream of the header line followed by one block of rows."""
+    return io.BytesIO(header.encode("utf-8") + block)
+
+
+class ShardCheckpoint:
+    """
+    State of a sharded ingest, stored as small blobs under a per-blob prefix
+    keyed by the source ETag (a re-uploaded blob starts over):
+      plan                      {"header": csv header line, "ranges": [[start, end], ...]}
+      progress/{shard}          {"offset": next byte to ingest, "rows": rows written}
+      rollups/{group}/{shard}-{block}  rollup readings of a block, by group of homes
+      rows/{shard}              row hashes of a shard, the blob's manifest once it's ingested
+      {phase}/{index}.done      one per finished invocation of a phase, with its results
+      {phase}.claim             the invocation that queues the next phase
+    """
+
+    def __init__(self, blob_path, etag):
+        tag = re.sub(r"[^0-9A-Za-z]", "", etag or "") or "none"
+        self.prefix = f"shards/{blob_path}/{tag}/"
+        self._container_checked = False
+
+    def _client(self, name):
+        return BlobClient.from_connection_string(SHARD_CONNECTION_STRING, SHARD_CHECKPOINT_CONTAINER, self.prefix + name)
+
+    def _read(self, name):
+        try:
+            return json.loads(gzip.decompress(self._client(name).download_blob().readall()))
+        except ResourceNotFoundError:
+            return None
+
+    def _write(self, name, value, overwrite=True):
+        blob = self._client(name)
+        if not self._container_checked:
+            try:
+                blob.get_container_client().create_container()
+            except ResourceExistsError:
+                pass
+            self._container_checked = True
+        blob.upload_blob(gzip.compress(json.dumps(value, separators=(",", ":")).encode()), overwrite=overwrite)
+
+    def _list(self, name_prefix):
+        container = self._client("").get_container_client()
+        return [name[len(self.prefix):] for name in container.list_blob_names(name_starts_with=self.prefix + name_prefix)]
+
+    def save_plan(self, header, ranges):
+        self._write("plan", {"header": header, "ranges": ranges})
+
+    def load_plan(self):
+        return self._read("plan")
+
+    def load_progress(self, index, start):
+        return self._read(f"progress/{index:05d}") or {"offset": start, "rows": 0}
+
+    def save_progress(self, index, progress):
+        self._write(f"progress/{index:05d}", progress)
+
+    def save_rollup(self, index, block_start, pending, groups):
+        # written before the offset moves past the block, a re-run block overwrites its own readings
+        split = {}
+        for home_id, days in pending.items():
+            split.setdefault(bucket_of(home_id, groups), {})[home_id] = days
+        for group, homes in split.items():
+            self._write(f"rollups/{group:05d}/{index:05d}-{block_start:012d}", homes)
+
+    def load_rollups(self, group):
+        for name in self._list(f"rollups/{group:05d}/"):
+            yield self._read(name)
+
+    def save_rows(self, index, rows):
+        self._write(f"rows/{index:05d}", rows)
+
+    def load_rows(self, index):
+        return self._read(f"rows/{index:05d}") or {}
+
+    def first_attempt(self, name):
+        """False if `name` was started before, i.e. this is a retry."""
+        try:
+            self._write(f"{name}.started", {}, overwrite=False)
+            return True
+        except ResourceExistsError:
+            return False
+
+    def is_done(self, phase, index):
+        return self._read(f"{phase}/{index:05d}.done") is not None
+
+    def mark_done(self, phase, index, results=None):
+        self._write(f"{phase}/{index:05d}.done", results or {})
+
+    def load_done(self, phase):
+        return [self._read(name) or {} for name in self._list(f"{phase}/") if name.endswith(".done")]
+
+    def claim(self, phase, count, index):
+        """
+        True for the one invocation that moves the blob past `phase`: all
+        `count` are done and this one created the claim (or created it before
+        and is retried before finishing).
+        """
+        if sum(name.endswith(".done") for name in self._list(f"{phase}/")) < count:
+            return False
+        try:
+            self._write(f"{phase}.claim", {"owner": index, "finished": False}, overwrite=False)
+            return True
+        except ResourceExistsError:
+            current = self._read(f"{phase}.claim") or {}
+            return current.get("owner") == index and not current.get("finished")
+
+    def finish(self, phase, index):
+        self._write(f"{phase}.claim", {"owner": index, "finished": True})
+
+    def clear(self, keep_rows=True):
+        """
+        Drop the working state of a finished ingest. The row hashes are kept
+        for the next upload, the plan and phase markers so a redelivered
+        message is a no-op.
+        """
+        for name in self._list(""):
+            if name.split("/", 1)[0] in ("progress", "rollups") or (name.startswith("rows/") and not keep_rows):
+                self._delete(name)
+
+    def delete(self):
+        for name in self._list(""):
+            self._delete(name)
+
+    def _delete(self, name):
+        try:
+            self._client(name).delete_blob()
+        except ResourceNotFoundError:
+            pass
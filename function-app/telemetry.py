@@ -0,0 +1,239 @@
+# per-invocation metrics: stage timers, counters and histograms, exported as one record per invocation
+import os
+import re
+import json
+import time
+import logging
+import tempfile
+import threading
+import functools
+import contextlib
+import contextvars
+from datetime import datetime, timezone
+
+# where invocation records go, comma separated: "log" (one structured log line), "jsonl" (local file), "none"
+TELEMETRY_EXPORTERS = [e.strip() for e in os.getenv("TELEMETRY_EXPORTERS", "log").lower().split(",") if e.strip()]
+TELEMETRY_JSONL_PATH = os.getenv("TELEMETRY_JSONL_PATH", os.path.join(tempfile.gettempdir(), "telemetry.jsonl"))
+
+_current = contextvars.ContextVar("telemetry_metrics", default=None)
+_exporters = None
+_exporters_lock = threading.Lock()
+_container_name = re.compile(r"/colls/([^/?]+)")
+
+
+class Metrics:
+    """
+    Metrics of one invocation. Timers are exclusive: time spent in a nested
+    timer counts for the inner stage only, so the stages of one thread add
+    up to its wall time. Work on other threads adds its own stage time.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.now(timezone.utc)
+        self.timers = {}
+        self.counters = {}
+        self.histograms = {}
+        self.attributes = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        stack = self._local.__dict__.setdefault("stack", [])
+        frame = [time.perf_counter(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            if stack:
+                stack[-1][1] += elapsed
+            with self._lock:
+                total = self.timers.setdefault(stage, [0, 0.0])
+                total[0] += 1
+                total[1] += elapsed - frame[1]
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms.setdefault(name, []).append(value)
+
+    def record(self, duration, status):
+        timers = {stage: {"count": n, "ms": round(seconds * 1000, 2)} for stage, (n, seconds) in self.timers.items()}
+        return {
+            "function": self.name,
+            "start": self.started.isoformat(),
+            "duration_ms": round(duration * 1000, 2),
+            "status": status,
+            "timers": timers,
+            "counters": {k: round(v, 2) if isinstance(v, float) else v for k, v in self.counters.items()},
+            "histograms": {k: summarize(v) for k, v in self.histograms.items()},
+            **self.attributes,
+        }
+
+
+def summarize(values):
+    values = sorted(values)
+    n = len(values)
+    return {"count": n, "min": values[0], "p50": values[n // 2], "p95": values[min(n - 1, int(n * 0.95))],
+            "max": values[-1], "sum": round(sum(values), 2)}
+
+
+class JsonLinesExporter:
+    """Appends each invocation record as one json line to a local file."""
+
+    def __init__(self, path=TELEMETRY_JSONL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class LogExporter:
+    """One structured log line per invocation (picked up by application insights)."""
+
+    def __call__(self, record):
+        logging.info("Telemetry " + json.dumps(record, default=str))
+
+
+def exporters():
+    global _exporters
+    with _exporters_lock:
+        if _exporters is None:
+            builtin = {"log": LogExporter, "jsonl": JsonLinesExporter}
+            _exporters = [builtin[name]() for name in TELEMETRY_EXPORTERS if name in builtin]
+        return _exporters
+
+
+def set_exporters(new_exporters):
+    """Replace the exporters: callables taking one invocation record (a dict)."""
+    global _exporters
+    with _exporters_lock:
+        _exporters = list(new_exporters)
+
+
+def export(record):
+    for exporter in exporters():
+        try:
+            exporter(record)
+        except Exception:
+            logging.exception(f"Telemetry exporter {type(exporter).__name__} failed.")
+
+
+@contextlib.contextmanager
+def invocation(name):
+    """Collect metrics for the duration of the block and export them once at the end."""
+    metrics = Metrics(name)
+    token = _current.set(metrics)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield metrics
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        export(metrics.record(time.perf_counter() - start, status))
+
+
+def instrumented(name):
+    """Decorator: run a function as one telemetry invocation. Http responses record their status code."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with invocation(name) as metrics:
+                result = fn(*args, **kwargs)
+                if hasattr(result, "status_code"):
+                    metrics.attributes["status_code"] = result.status_code
+                return result
+        return wrapper
+    return decorator
+
+
+def current():
+    return _current.get()
+
+
+def timer(stage):
+    metrics = _current.get()
+    return metrics.timer(stage) if metrics is not None else contextlib.nullcontext()
+
+
+def count(name, value=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count(name, value)
+
+
+def observe(name, value):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.observe(name, value)
+
+
+def propagate(fn, stage=None):
+    """Bind `fn` to the current invocation, for work handed to a thread pool; `stage` times each call."""
+    metrics = _current.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = _current.set(metrics)
+        try:
+            if stage is None:
+                return fn(*args, **kwargs)
+            with timer(stage):
+                return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+class TimedStream:
+    """Wraps a binary stream; time spent in read() counts as the "read" stage."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.name = getattr(stream, "name", None)
+
+    def read(self, size=-1):
+        with timer("read"):
+            data = self.stream.read(size)
+        count("bytes_read", len(data))
+        return data
+
+    read1 = read
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+
+def cosmos_response_hook(pipeline_response):
+    """raw_response_hook for the cosmos client: request count, RU charge (total and per container) and 429s."""
+    metrics = _current.get()
+    if metrics is None:
+        return
+    response = pipeline_response.http_response
+    try:
+        charge = float(response.headers.get("x-ms-request-charge") or 0)
+    except ValueError:
+        charge = 0.0
+    metrics.count("cosmos.requests")
+    metrics.count("cosmos.ru", charge)
+    metrics.observe("cosmos.request_ru", charge)
+    match = _container_name.search(pipeline_response.http_request.url or "")
+    if match:
+        metrics.count(f"cosmos.ru.{match.group(1)}", charge)
+    if response.status_code == 429:
+        metrics.count("cosmos.throttled")
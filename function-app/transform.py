@@ -0,0 +1,62 @@
+# row-at-a-time transform from normalized csv rows to cosmos documents
+import math
+import uuid
+from dates import iso_date
+
+# namespace for content-derived document ids
+ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "azetlpipeline/home-energy")
+
+
+# deterministic id for a reading, so re-ingesting a row overwrites instead of duplicating
+def document_id(home_id, appliance, date, time):
+    return str(uuid.uuid5(ID_NAMESPACE, f"{home_id}|{appliance}|{date}|{time}"))
+
+
+# map a csv row (normalized headers) to a cosmos document, None if invalid
+def transform_row(row):
+    item = {
+        "HomeID": row.get("homeid"),
+        "ApplianceType": row.get("appliancetype"),
+        "Season": row.get("season"),
+        "Date": row.get("date"),
+        "DateISO": iso_date(row.get("date")),
+        "id": document_id(row.get("homeid"), row.get("appliancetype"), row.get("date"), row.get("time"))
+    }
+
+    # numeric conversions
+    try:
+        item["EnergyConsumption"] = float(row.get("energyconsumption", 0))
+    except (ValueError, TypeError):
+        item["EnergyConsumption"] = None
+    # "nan" and "inf" parse, but can't be stored in a json document
+    if item["EnergyConsumption"] is not None and not math.isfinite(item["EnergyConsumption"]):
+        item["EnergyConsumption"] = None
+
+    try:
+        item["HouseholdSize"] = int(row.get("householdsize", 0))
+    except (ValueError, TypeError):
+        item["HouseholdSize"] = None
+
+    # validation
+    if not item["HomeID"] or not item["ApplianceType"] or item["EnergyConsumption"] is None:
+        return None
+    return item
+
+
+# group transformed rows into (documents, skipped_count) chunks
+def iter_row_documents(reader, chunk_rows=10000):
+    docs = []
+    skipped = 0
+    for row in reader:
+        item = transform_row(row)
+        if item is None:
+            skipped += 1
+        else:
+            docs.append(item)
+
+        if len(docs) + skipped >= chunk_rows:
+            yield docs, skipped
+            docs, skipped = [], 0
+
+    if docs or skipped:
+        yield docs, skipped
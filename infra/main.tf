@@ -131,3 +131,27 @@ resource "azurerm_linux_function_app" "az_function_app" {
   }
 }
 
+
+# blob uploads reach BlobToCosmos as BlobCreated events (the function reads the blob itself, in ranges or chunks)
+resource "azurerm_eventgrid_system_topic" "blob_events" {
+  name                   = "${var.az_storage_account}-events"
+  resource_group_name    = azurerm_resource_group.az_etlpipeline_rg.name
+  location               = azurerm_resource_group.az_etlpipeline_rg.location
+  source_arm_resource_id = azurerm_storage_account.az_storage_account.id
+  topic_type             = "Microsoft.Storage.StorageAccounts"
+}
+
+resource "azurerm_eventgrid_system_topic_event_subscription" "blob_to_cosmos" {
+  name                = "blob-to-cosmos"
+  system_topic        = azurerm_eventgrid_system_topic.blob_events.name
+  resource_group_name = azurerm_resource_group.az_etlpipeline_rg.name
+
+  included_event_types = ["Microsoft.Storage.BlobCreated"]
+  subject_filter {
+    subject_begins_with = "/blobServices/default/containers/${var.az_blob_container}/blobs/"
+  }
+
+  azure_function_endpoint {
+    function_id = "${azurerm_linux_function_app.az_function_app.id}/functions/BlobToCosmos"
+  }
+}
@@ -1,19 +1,200 @@
-import pandas as pd
+import os
+import sys
+import gzip
 import json
+import time
+import argparse
+import textwrap
+import pandas as pd
+
+# convert the energy csv export to json / ndjson / gzip ndjson / parquet, one chunk at a time,
+# so memory stays bounded by --chunk-rows whatever the file size
+
+FORMATS = ["json", "ndjson", "ndjson.gz", "parquet"]
+DEFAULT_OUTPUT = {"json": "json_file.json", "ndjson": "energy.ndjson", "ndjson.gz": "energy.ndjson.gz",
+                  "parquet": "energy.parquet"}
+
+
+def read_chunks(path, chunk_rows):
+    # nullable dtypes keep integer columns integers when a value is missing
+    return pd.read_csv(path, chunksize=chunk_rows, dtype_backend="numpy_nullable")
+
+
+def align_dtypes(chunk, pinned):
+    """
+    Types are inferred per chunk, so a column can come back Int64 in one
+    chunk and Float64 in another; cast to the first chunk's type where the
+    values allow it, so output types stay consistent across chunks.
+    """
+    for col, dtype in pinned.items():
+        if col not in chunk or chunk[col].dtype == dtype:
+            continue
+        try:
+            chunk[col] = chunk[col].astype(dtype)
+        except (TypeError, ValueError):
+            pass
+    return chunk
+
+
+def json_records(chunk):
+    # missing values are written as "" (as the original converter did with fillna(''))
+    values = chunk.astype(object).where(chunk.notna(), "")
+    return values.to_dict(orient="records")
+
+
+class JsonArrayWriter:
+    """A single json array, written element by element."""
+
+    def __init__(self, path, indent=None):
+        self.f = open(path, "w", encoding="utf-8")
+        self.indent = indent
+        self.rows = 0
+        self.f.write("[")
+
+    def write(self, chunk):
+        for record in json_records(chunk):
+            text = json.dumps(record, indent=self.indent)
+            if self.indent is not None:
+                text = "\n" + textwrap.indent(text, " " * self.indent)
+            self.f.write(("," if self.rows else "") + text)
+            self.rows += 1
+
+    def close(self):
+        self.f.write("\n]" if self.indent is not None and self.rows else "]")
+        self.f.close()
+
+
+class NdjsonWriter:
+    """One json object per line, optionally gzip-compressed while writing."""
+
+    def __init__(self, path, compress=False, compresslevel=6):
+        if compress:
+            self.f = gzip.open(path, "wt", encoding="utf-8", compresslevel=compresslevel)
+        else:
+            self.f = open(path, "w", encoding="utf-8")
+        self.rows = 0
+
+    def write(self, chunk):
+        records = json_records(chunk)
+        self.f.write("".join(json.dumps(r) + "\n" for r in records))
+        self.rows += len(records)
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetWriter:
+    """Parquet file with one schema (from the first chunk) and bounded row groups."""
+
+    def __init__(self, path, row_group_rows, compression="snappy"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            sys.exit("parquet output needs pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.row_group_rows = row_group_rows
+        self.compression = compression
+        self.writer = None
+        self.rows = 0
+
+    def write(self, chunk):
+        table = self.pa.Table.from_pandas(chunk, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema, compression=self.compression)
+        else:
+            table = table.cast(self.writer.schema)
+        self.writer.write_table(table, row_group_size=self.row_group_rows)
+        self.rows += len(chunk)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def part_path(output, part):
+    # energy.ndjson.gz -> energy.part-0001.ndjson.gz
+    directory, name = os.path.split(output)
+    stem, dot, ext = name.partition(".")
+    return os.path.join(directory, f"{stem}.part-{part:04d}{dot}{ext}")
+
+
+def open_writer(args, path):
+    if args.format == "json":
+        return JsonArrayWriter(path, args.indent)
+    if args.format == "parquet":
+        return ParquetWriter(path, args.row_group_rows or args.chunk_rows)
+    return NdjsonWriter(path, compress=args.format == "ndjson.gz", compresslevel=args.compresslevel)
+
+
+def convert(args):
+    writer = None
+    part = 0
+    paths = []
+    pinned = None
+    total = 0
+
+    try:
+        for chunk in read_chunks(args.input, args.chunk_rows):
+            if pinned is None:
+                pinned = chunk.dtypes.to_dict()
+                if args.preview:
+                    # data testing
+                    print(chunk.head())
+                    chunk.info()
+            chunk = align_dtypes(chunk, pinned)
+
+            # split the chunk across files when --max-rows-per-file is reached
+            start = 0
+            while start < len(chunk):
+                if writer is None or (args.max_rows_per_file and writer.rows >= args.max_rows_per_file):
+                    if writer is not None:
+                        writer.close()
+                        part += 1
+                    path = part_path(args.output, part) if args.max_rows_per_file else args.output
+                    writer = open_writer(args, path)
+                    paths.append(path)
 
-# read csv
-df = pd.read_csv('home_energy_consumption_data.csv')
+                take = len(chunk) - start
+                if args.max_rows_per_file:
+                    take = min(take, args.max_rows_per_file - writer.rows)
+                writer.write(chunk.iloc[start:start + take])
+                start += take
+                total += take
+    finally:
+        if writer is not None:
+            writer.close()
 
-# data testing 
-print(df.head())
-print(df.info())
+    if writer is None:
+        # empty csv: still write an empty output
+        writer = open_writer(args, args.output)
+        writer.close()
+        paths.append(args.output)
+    return total, paths
 
-# data cleaning
-df = df.fillna('')
 
-json_records = df.to_dict(orient='records')
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the energy consumption csv to json, ndjson or parquet in chunks")
+    parser.add_argument("input", nargs="?", default="home_energy_consumption_data.csv")
+    parser.add_argument("-o", "--output", help="output file (default depends on the format)")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="json")
+    parser.add_argument("--chunk-rows", type=int, default=100000, help="csv rows read and converted at a time")
+    parser.add_argument("--max-rows-per-file", type=int, default=0, help="split the output into parts of at most this many rows")
+    parser.add_argument("--row-group-rows", type=int, default=0, help="parquet row group size (default: --chunk-rows)")
+    parser.add_argument("--indent", type=int, default=None, help="indent the json array (4 gives the old layout)")
+    parser.add_argument("--compresslevel", type=int, default=6, help="gzip level for ndjson.gz")
+    parser.add_argument("--preview", action="store_true", help="print the head and dtypes of the first chunk")
+    args = parser.parse_args(argv)
+    args.output = args.output or DEFAULT_OUTPUT[args.format]
+    return args
 
-with open('json_file.json', 'w') as f:
-    json.dump(json_records, f, indent=4)
 
-print(f"converted {len(json_records)} records to json")
+if __name__ == "__main__":
+    args = parse_args()
+    start = time.perf_counter()
+    total, paths = convert(args)
+    size = sum(os.path.getsize(p) for p in paths)
+    print(f"converted {total} records to {args.format} in {time.perf_counter() - start:.1f}s: "
+          f"{len(paths)} file(s), {size / 1024 / 1024:.1f} MiB")
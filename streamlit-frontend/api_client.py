@@ -0,0 +1,44 @@
+# api calls that return DataFrames, asking for the most compact format the api and this client both support
+import io
+import os
+import requests
+import pandas as pd
+
+API_BASE = os.getenv("ENERGY_API_URL", "http://localhost:7071/api").rstrip("/")
+
+PARQUET = "application/vnd.apache.parquet"
+ARROW = "application/vnd.apache.arrow.stream"
+COLUMNS = "application/vnd.columns+json"
+
+try:
+    import pyarrow.ipc
+    # parquet is the smallest and quick to read; column json if the api has no pyarrow.
+    # requests sends Accept-Encoding and decompresses gzip (and br with brotli installed)
+    ACCEPT = f"{PARQUET}, {ARROW};q=0.9, {COLUMNS};q=0.8, application/json;q=0.5"
+except ImportError:
+    pyarrow = None
+    ACCEPT = f"{COLUMNS}, application/json;q=0.5"
+
+
+def to_frame(resp):
+    """DataFrame from a response in any of the api's formats."""
+    content_type = resp.headers.get("Content-Type", "").split(";")[0].strip()
+    if content_type == ARROW:
+        return pyarrow.ipc.open_stream(resp.content).read_pandas()
+    if content_type in (PARQUET, "application/x-parquet"):
+        return pd.read_parquet(io.BytesIO(resp.content))
+    if content_type == "application/x-ndjson":
+        return pd.read_json(io.StringIO(resp.text), lines=True, dtype=False, convert_dates=False)
+    # {column: [values]} and [records] both load directly
+    return pd.DataFrame(resp.json())
+
+
+def get_frame(endpoint, params=None, timeout=60):
+    """
+    GET an api endpoint; returns (response, DataFrame), the DataFrame is
+    None unless the response is a 200.
+    """
+    resp = requests.get(f"{API_BASE}/{endpoint}", params=params, headers={"Accept": ACCEPT}, timeout=timeout)
+    if resp.status_code != 200:
+        return resp, None
+    return resp, to_frame(resp)
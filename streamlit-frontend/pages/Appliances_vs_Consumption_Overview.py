@@ -1,19 +1,14 @@
 import streamlit as st
-import requests
-import pandas as pd
 import plotly.express as px
 import matplotlib.pyplot as plt
+from api_client import get_frame
 
 st.header("📊 Appliance vs Energy Consumption")
 
-# GetAllEnergyData
-API_DATA_ENERGY = "http://localhost:7071/api/GetAllEnergyData"  
-
-response = requests.get(API_DATA_ENERGY)
+# GetAllEnergyData, in the most compact format the api offers
+response, df = get_frame("GetAllEnergyData")
 
 if response.status_code == 200:
-    data = response.json()
-    df = pd.DataFrame(data)
 
     energy_per_appliance = df.groupby("ApplianceType")["EnergyConsumption"].sum().reset_index()
 
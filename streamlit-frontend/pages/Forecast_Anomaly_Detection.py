@@ -1,20 +1,17 @@
 import streamlit as st
-import requests
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from api_client import get_frame
 
 st.header("Forecast Consumption and Anomaly Detection")
 
 days = st.slider("Days to forecast", 1, 30, 7)
 homeid = st.text_input("Enter HomeID", value="")
 
-API_URL = f"http://localhost:7071/api/Forecast?days={days}" + (f"&HomeID={homeid}" if homeid else "")
-
 if st.button("Get Forecast"):
-    resp = requests.get(API_URL, timeout=30)
+    resp, forecast = get_frame("Forecast", params={"days": days, **({"HomeID": homeid} if homeid else {})}, timeout=30)
     if resp.status_code == 200:
-        forecast = pd.DataFrame(resp.json())
         if forecast.empty:
             st.warning("No forecast data returned. Check if Cosmos DB has records.")
         else:
@@ -46,9 +43,8 @@ if st.button("Detect Anomalies"):
     if end:
         params['end'] = end.isoformat()
 
-    resp = requests.get("http://localhost:7071/api/DetectAnomalies", params={**params, **({'HomeID':homeid} if homeid else {})})
+    resp, anom = get_frame("DetectAnomalies", params={**params, **({'HomeID':homeid} if homeid else {})})
     if resp.status_code == 200:
-        anom = pd.DataFrame(resp.json())
         if anom.empty:
             st.info("No data for the requested range.")
 
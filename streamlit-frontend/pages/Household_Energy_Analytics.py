@@ -1,7 +1,7 @@
 import streamlit as st
-import requests
 import pandas as pd
 import plotly.express as px
+from api_client import get_frame
 
 st.header("🏠 Household Energy Analytics")
 
@@ -9,11 +9,9 @@ home_id = st.text_input("Enter HomeID (e.g. 430):")
 
 if st.button("Fetch Data"):
     if home_id:
-        API_URL = f"http://localhost:7071/api/GetEnergyByHomeID?HomeID={home_id}"
-        response = requests.get(API_URL)
+        response, df = get_frame("GetEnergyByHomeID", params={"HomeID": home_id})
 
         if response.status_code == 200:
-            df = pd.DataFrame(response.json())
 
             if not df.empty:
                 # KPIs
@@ -50,10 +48,8 @@ if st.button("Fetch Data"):
                     st.plotly_chart(fig3, use_container_width=True)
 
                 # home vs Average Household
-                API_ALL = "http://localhost:7071/api/GetAllEnergyData"
-                resp_all = requests.get(API_ALL)
+                resp_all, df_all = get_frame("GetAllEnergyData")
                 if resp_all.status_code == 200:
-                    df_all = pd.DataFrame(resp_all.json())
                     avg_all = df_all.groupby("ApplianceType")["EnergyConsumption"].mean().reset_index()
                     compare = appliance_df.merge(avg_all, on="ApplianceType", suffixes=("_Home", "_Avg"))
 
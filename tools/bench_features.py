@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# the function app's modules (and bundled models) are in function-app/, next to this directory
+app_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "function-app")
+sys.path.insert(0, app_dir)
+
+from anomaly_features import FEATURE_COLS, build_features
+
+# micro-benchmark: per-home loop vs vectorized anomaly features on synthetic rollup rows
+# the loop is quadratic in homes (it filters the whole frame per home), keep the defaults modest
+HOME_COUNTS = [10, 100, 500, 1000]
+DAYS = 365
+# share of home-days without a rollup document (gaps to fill)
+MISSING = 0.2
+REPEATS = 3
+
+
+def synthetic_rollup(homes, days=DAYS, seed=0):
+    rng = np.random.default_rng(seed)
+    home_ids = np.repeat([f"H{i:05d}" for i in range(homes)], days)
+    dates = np.tile(pd.date_range("2023-01-01", periods=days, freq="D").to_numpy(), homes)
+    agg = pd.DataFrame({
+        "HomeID": home_ids,
+        "Date": dates,
+        "total_kwh": rng.gamma(2.0, 5.0, len(home_ids)).round(2),
+        "unique_appliances": rng.integers(1, 10, len(home_ids)),
+    })
+    return agg[rng.random(len(agg)) >= MISSING].sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def loop_features(agg):
+    # the original DetectAnomalies implementation
+    filled = []
+    for home in agg['HomeID'].unique():
+        sub = agg[agg['HomeID'] == home].set_index('Date')
+        full_range = pd.date_range(start=sub.index.min(), end=sub.index.max(), freq='D')
+        sub = sub.reindex(full_range, fill_value=0)
+        sub['HomeID'] = home
+        sub = sub.reset_index().rename(columns={'index': 'Date'})
+        filled.append(sub)
+
+    agg = pd.concat(filled).sort_values(['HomeID', 'Date'])
+    agg['rolling_7_mean'] = agg.groupby('HomeID')['total_kwh'].transform(lambda x: x.rolling(7, min_periods=1).mean())
+    agg['dow'] = agg['Date'].dt.dayofweek
+    return agg
+
+
+def best_of(fn, agg):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        out = fn(agg)
+        timings.append(time.perf_counter() - start)
+    return min(timings), out
+
+
+if __name__ == "__main__":
+    counts = [int(n) for n in sys.argv[1:]] or HOME_COUNTS
+    columns = ['HomeID', 'Date'] + FEATURE_COLS
+
+    print(f"{'homes':>6} {'rows':>9}  {'loop':>10}  {'vectorized':>10}  {'speedup':>8}  identical")
+    for homes in counts:
+        agg = synthetic_rollup(homes)
+        loop_time, expected = best_of(loop_features, agg)
+        vec_time, actual = best_of(build_features, agg)
+
+        identical = expected[columns].reset_index(drop=True).equals(actual[columns])
+        print(f"{homes:>6} {len(actual):>9}  {loop_time * 1000:>8.1f}ms  {vec_time * 1000:>8.1f}ms  "
+              f"{loop_time / vec_time:>7.1f}x  {identical}")
@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+
+# the function app's modules (and bundled models) are in function-app/, next to this directory
+app_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "function-app")
+sys.path.insert(0, app_dir)
+
+from prophet.serialize import model_from_json
+from forecasting import predict_horizon
+
+# micro-benchmark: full vs fast forecast modes on the bundled prophet model
+local_prophet = os.path.join(app_dir, "prophet_model.json")
+
+HORIZONS = [7, 30, 90]
+REPEATS = 5
+
+# (label, mode, uncertainty samples; None keeps the model default)
+VARIANTS = [
+    ("full", "full", None),
+    ("fast", "fast", None),
+    ("fast, 200 samples", "fast", 200),
+    ("fast, no intervals", "fast", 0),
+]
+
+
+def time_variant(model, days, mode, samples):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        forecast = predict_horizon(model, days, mode, samples)
+        timings.append(time.perf_counter() - start)
+    return min(timings), forecast
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else local_prophet
+    with open(path, "r") as f:
+        model = model_from_json(f.read())
+
+    print(f"History rows: {len(model.history)}, default uncertainty samples: {model.uncertainty_samples}")
+    print(f"{'days':>5}  {'variant':<20} {'best of ' + str(REPEATS):>12}  {'speedup':>8}  {'max |dyhat|':>12}")
+
+    for days in HORIZONS:
+        baseline_time, baseline = time_variant(model, days, "full", None)
+        for label, mode, samples in VARIANTS:
+            elapsed, forecast = (baseline_time, baseline) if label == "full" else time_variant(model, days, mode, samples)
+            diff = abs(forecast["yhat"].to_numpy() - baseline["yhat"].to_numpy()).max()
+            print(f"{days:>5}  {label:<20} {elapsed * 1000:>10.1f}ms  {baseline_time / elapsed:>7.1f}x  {diff:>12.2e}")
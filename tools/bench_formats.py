@@ -0,0 +1,91 @@
+import os
+import sys
+import gzip
+import time
+import logging
+import requests
+
+# for testing purpose: payload size and serialize/parse time of GetAllEnergyData and DetectAnomalies
+# in each response format and transfer encoding, served from the local cosmos fakes (cache off) and
+# parsed with the streamlit client's to_frame
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+DEFAULT_CSV = os.path.join(repo_dir, "home_energy_consumption_data.csv")
+
+CASES = [("json", None), ("json", "gzip"), ("columns", None), ("columns", "gzip"), ("columns", "br"),
+         ("arrow", None), ("arrow", "gzip"), ("arrow", "br"), ("parquet", None)]
+ENDPOINTS = ["GetAllEnergyData", "DetectAnomalies"]
+REPEATS = 3
+
+
+def decode(body, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "br":
+        import brotli
+        return brotli.decompress(body)
+    return body
+
+
+def client_frame(resp):
+    # what requests hands the streamlit page: decompressed content, the server's content type
+    from api_client import to_frame
+    r = requests.models.Response()
+    r.status_code = resp.status_code
+    r.headers["Content-Type"] = resp.mimetype
+    r.encoding = "utf-8"
+    r._content = decode(resp.get_body(), resp.headers.get("Content-Encoding"))
+    return to_frame(r)
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("COSMOSDB_DATABASE", "local")
+    os.environ.setdefault("COSMOSDB_CONTAINERTR", "energy")
+    os.environ.update(INGEST_ANOMALY_SCORING="false", COSMOS_RU_LIMITER="false", RESPONSE_CACHE_BACKEND="none")
+    sys.path.insert(0, os.path.join(repo_dir, "streamlit-frontend"))
+    sys.path.insert(0, os.path.join(repo_dir, "function-app"))
+    logging.disable(logging.WARNING)
+
+    import azure.functions as func
+    import local_fakes
+    import telemetry
+    import response_formats
+    import blobToCosmos
+    import data_analytics_api
+    import ml_forecast_anomaly
+
+    records = []
+    telemetry.set_exporters([records.append])
+    local_fakes.install()
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CSV
+    with open(csv_path, "rb") as f:
+        event = local_fakes.upload_blob_event(blobToCosmos.INGEST_SOURCE_CONTAINER, "bench.csv", f)
+    blobToCosmos.BlobToCosmos.build().get_user_function()(event, local_fakes.FakeOut())
+
+    functions = {"GetAllEnergyData": data_analytics_api.GetAllEnergy.build().get_user_function(),
+                 "DetectAnomalies": ml_forecast_anomaly.DetectAnomalies.build().get_user_function()}
+    has_brotli = response_formats._brotli() is not None
+
+    print(f"{'endpoint':<18}{'format':<9}{'encoding':<10}{'bytes':>11}{'vs json':>9}{'server ms':>11}{'client ms':>11}{'rows':>8}")
+    for endpoint in ENDPOINTS:
+        baseline = None
+        for fmt, encoding in CASES:
+            if encoding == "br" and not has_brotli:
+                continue
+            headers = {"Accept-Encoding": encoding} if encoding else {}
+            best_server, best_client = None, None
+            for _ in range(REPEATS):
+                records.clear()
+                resp = functions[endpoint](func.HttpRequest("GET", f"/api/{endpoint}", params={"format": fmt},
+                                                            headers=headers, body=b""))
+                timers = records[-1]["timers"]
+                server = sum(timers.get(stage, {}).get("ms", 0) for stage in ("serialize", "compress"))
+                start = time.perf_counter()
+                frame = client_frame(resp)
+                client = (time.perf_counter() - start) * 1000
+                best_server = server if best_server is None else min(best_server, server)
+                best_client = client if best_client is None else min(best_client, client)
+            size = len(resp.get_body())
+            baseline = baseline or size
+            print(f"{endpoint:<18}{fmt:<9}{encoding or '-':<10}{size:>11}{baseline / size:>8.1f}x"
+                  f"{best_server:>11.1f}{best_client:>11.1f}{len(frame):>8}")
@@ -0,0 +1,225 @@
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+import resource
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# for testing purpose: run the real ingestion functions end to end against the local cosmos/blob fakes
+# and report rows/s, peak memory and simulated request units per case. Peak memory includes the
+# documents the fakes hold, so compare cases at the same scale.
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+DEFAULT_CSV = os.path.join(repo_dir, "home_energy_consumption_data.csv")
+SCALED_DIR = os.path.join(tempfile.gettempdir(), "bench-ingest")
+
+# targets: BlobToCosmos (on a BlobCreated event) with each transform engine, the sharded fan-out (coordinator, then the
+# shard invocations on --shard-workers threads, like queue-triggered instances), and the legacy json function
+TARGETS = ["columnar", "row", "sharded", "legacy"]
+SOURCE_CONTAINER = "azetlpipelineblob"
+# host.json queues.maxDequeueCount
+MAX_DEQUEUE_COUNT = 5
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self.first = None
+
+    def emit(self, record):
+        self.count += 1
+        self.first = self.first or record.getMessage()
+
+
+def scaled_csv(path, scale):
+    """A copy of the csv repeated `scale` times, each copy's Home IDs shifted past the previous ones."""
+    if scale == 1:
+        return path
+    os.makedirs(SCALED_DIR, exist_ok=True)
+    target = os.path.join(SCALED_DIR, f"{os.path.splitext(os.path.basename(path))[0]}_x{scale}.csv")
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+        return target
+
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    home_col = header.index("Home ID")
+    offset = max(int(r[home_col]) for r in rows if r[home_col].isdigit()) + 1
+
+    with open(target + ".tmp", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for copy in range(scale):
+            for row in rows:
+                if copy and row[home_col].isdigit():
+                    row = list(row)
+                    row[home_col] = str(int(row[home_col]) + copy * offset)
+                writer.writerow(row)
+    os.replace(target + ".tmp", target)
+    return target
+
+
+def legacy_json(path):
+    """The legacy function reads a json array; give it the documents the transform produces."""
+    from csv_stream import read_csv_records
+    from transform import iter_row_documents
+    target = os.path.join(SCALED_DIR, os.path.basename(path) + ".json")
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(path):
+        os.makedirs(SCALED_DIR, exist_ok=True)
+        with open(path, "rb") as f:
+            _, reader = read_csv_records(f)
+            docs = [doc for chunk, _ in iter_row_documents(reader, 10000) for doc in chunk]
+        with open(target, "w") as f:
+            json.dump(docs, f)
+    return target
+
+
+def peak_rss_mib():
+    # linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(args):
+    """One case in this process; prints a json result line."""
+    os.environ.setdefault("COSMOSDB_DATABASE", "local")
+    os.environ.setdefault("COSMOSDB_CONTAINERTR", "energy")
+    os.environ["INGEST_ANOMALY_SCORING"] = "true" if args.scoring else "false"
+    # writers pace themselves to the simulated throughput; unlimited means no pacing
+    if args.ru_per_second:
+        os.environ["COSMOS_PROVISIONED_RU"] = str(int(args.ru_per_second))
+    else:
+        os.environ["COSMOS_RU_LIMITER"] = "false"
+    if args.target == "sharded":
+        os.environ["INGEST_SHARD_MIN_BYTES"] = "1"
+        os.environ["INGEST_SHARD_BYTES"] = str(-(-os.path.getsize(args.csv) // args.shards))
+        os.environ["INGEST_SHARD_BLOCK_BYTES"] = str(args.block_kib * 1024)
+    sys.path.insert(0, repo_dir)
+    sys.path.insert(0, os.path.join(repo_dir, "function-app"))
+
+    import azure.functions as func
+    import local_fakes
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.target == "legacy":
+        import blob_to_cosmosdb
+        blob_path = legacy_json(args.csv)
+        function = blob_to_cosmosdb.main
+    else:
+        import blobToCosmos
+        blobToCosmos.INGEST_TRANSFORM = "columnar" if args.target == "sharded" else args.target
+        blob_path = args.csv
+        trigger = blobToCosmos.BlobToCosmos.build().get_user_function()
+        shard = blobToCosmos.IngestShard.build().get_user_function()
+
+        def deliver(message):
+            # like the queue: a failed invocation is retried (up to maxDequeueCount) and resumes from its checkpoint
+            for attempt in range(MAX_DEQUEUE_COUNT):
+                fanout = local_fakes.FakeOut()
+                try:
+                    shard(func.QueueMessage(body=message), fanout)
+                    return fanout.get() or []
+                except Exception as e:
+                    logging.warning(f"Shard attempt {attempt + 1} failed: {e}")
+            logging.error("Shard moved to the poison queue.")
+            return []
+
+        def function(event):
+            shards = local_fakes.FakeOut()
+            trigger(event, shards)
+            # the last invocation of each phase queues the next phase
+            messages = shards.get() or []
+            with ThreadPoolExecutor(max_workers=args.shard_workers) as executor:
+                while messages:
+                    messages = [queued for fanout in executor.map(deliver, messages) for queued in fanout]
+
+    client = local_fakes.install(local_fakes.FakeCosmosClient(latency=args.latency_ms / 1000,
+                                                              ru_per_second=args.ru_per_second))
+    rows = sum(1 for _ in open(args.csv, "rb")) - 1
+    name = os.path.basename(blob_path)
+    rss_before = peak_rss_mib()
+
+    timings = []
+    for i in range(args.repeat):
+        # each run is a new upload (new etag) of the same content, later runs compare rows with the previous one
+        if args.target == "legacy":
+            trigger_arg = local_fakes.FakeInputStream.from_file(blob_path, name)
+        else:
+            with open(blob_path, "rb") as f:
+                trigger_arg = local_fakes.upload_blob_event(SOURCE_CONTAINER, name, f)
+        start = time.perf_counter()
+        try:
+            function(trigger_arg)
+        finally:
+            if args.target == "legacy":
+                trigger_arg.close()
+        timings.append(time.perf_counter() - start)
+
+    documents = sum(c.count() for db in client.databases.values() for c in db.containers.values())
+    print(json.dumps({
+        "target": args.target, "rows": rows, "seconds": timings, "peak_rss_mib": peak_rss_mib(),
+        "rss_before_mib": rss_before, "ru": client.ru_charged, "requests": client.requests,
+        "throttled": client.throttled, "documents": documents, "errors": errors.count, "first_error": errors.first,
+    }))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end ingestion benchmark against local Cosmos/Blob fakes")
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--scales", default="1,4", help="comma separated copies of the csv to ingest, e.g. 1,4,16")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"comma separated, from {TARGETS}")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated latency per cosmos request")
+    parser.add_argument("--ru-per-second", type=float, default=None, help="simulated throughput per container")
+    parser.add_argument("--no-scoring", dest="scoring", action="store_false", help="skip anomaly scoring at ingest")
+    parser.add_argument("--repeat", type=int, default=1, help="ingest the same blob again (change-only path)")
+    parser.add_argument("--shards", type=int, default=8, help="byte ranges the sharded target splits the csv into")
+    parser.add_argument("--shard-workers", type=int, default=4, help="shard invocations running at once")
+    parser.add_argument("--block-kib", type=int, default=1024, help="checkpoint granularity within a shard")
+    parser.add_argument("--target", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.target:
+        run_case(args)
+        sys.exit(0)
+
+    if args.repeat > 1:
+        print(f"RU and requests cover all {args.repeat} runs; later runs take the change-only path.")
+    print(f"{'case':<18}{'rows':>9}{'seconds':>9}{'rows/s':>10}{'peak MiB':>10}{'RU':>11}{'RU/row':>8}"
+          f"{'requests':>10}{'429s':>6}{'errors':>8}")
+    for scale in [int(s) for s in args.scales.split(",")]:
+        path = scaled_csv(args.csv, scale)
+        for target in args.targets.split(","):
+            command = [sys.executable, os.path.abspath(__file__), "--target", target, "--csv", path,
+                       "--latency-ms", str(args.latency_ms), "--repeat", str(args.repeat), "--shards", str(args.shards),
+                       "--shard-workers", str(args.shard_workers), "--block-kib", str(args.block_kib)]
+            if args.ru_per_second:
+                command += ["--ru-per-second", str(args.ru_per_second)]
+            if not args.scoring:
+                command.append("--no-scoring")
+            # a process per case, so peak memory is the case's own
+            out = subprocess.run(command, cwd=script_dir, capture_output=True, text=True)
+            lines = [line for line in out.stdout.splitlines() if line.startswith("{")]
+            if out.returncode or not lines:
+                print(f"{target} x{scale} failed:\n{out.stderr[-2000:]}")
+                continue
+            r = json.loads(lines[-1])
+            seconds = r["seconds"][0]
+            label = f"{target}/{args.shard_workers} x{scale}" if target == "sharded" else f"{target} x{scale}"
+            print(f"{label:<18}{r['rows']:>9}{seconds:>9.2f}{r['rows'] / seconds:>10.0f}{r['peak_rss_mib']:>10.0f}"
+                  f"{r['ru']:>11.0f}{r['ru'] / max(1, r['rows']):>8.1f}{r['requests']:>10}{r['throttled']:>6}"
+                  f"{r['errors']:>8}")
+            if len(r["seconds"]) > 1:
+                print(f"{'  repeated':<18}{'':>9}" + "".join(f"{s:>9.2f}" for s in r["seconds"][1:]))
+            if r["first_error"]:
+                print(f"  first error: {r['first_error'][:200]}")
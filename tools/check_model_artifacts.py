@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+# the function app's modules (and bundled models) are in function-app/, next to this directory
+app_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "function-app")
+sys.path.insert(0, app_dir)
+
+from model_artifacts import ArtifactCache, HotModel, LocalBlobSource
+
+# for testing purpose: exercise the model artifact cache against a local blob stand-in
+local_prophet = os.path.join(app_dir, "prophet_model.json")
+
+
+class CountingSource(LocalBlobSource):
+    def __init__(self, directory):
+        super().__init__(directory, chunk_size=64 * 1024)
+        self.downloads = 0
+
+    def download(self, name, etag, f):
+        new_etag = super().download(name, etag, f)
+        if new_etag is not None:
+            self.downloads += 1
+        return new_etag
+
+
+def load_json(path):
+    with open(path, "r") as f:
+        doc = json.load(f)
+    return doc, doc.get("version", "packaged")
+
+
+def check(label, ok):
+    print(f"{'ok  ' if ok else 'FAIL'} {label}")
+    return ok
+
+
+if __name__ == "__main__":
+    blobs = tempfile.mkdtemp()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(blobs, "models"))
+        shutil.copy(local_prophet, os.path.join(blobs, "models", "prophet.json"))
+        with open(os.path.join(blobs, "models", "other.json"), "w") as f:
+            json.dump({"version": "v1"}, f)
+
+        source = CountingSource(blobs)
+        cache = ArtifactCache(source, cache_dir)
+        results = []
+
+        etags = cache.refresh(["models/prophet.json", "models/other.json"])
+        results.append(check("parallel refresh downloads both artifacts", source.downloads == 2 and all(etags.values())))
+
+        cache.refresh(["models/prophet.json", "models/other.json"])
+        results.append(check("unchanged artifacts are not downloaded again", source.downloads == 2))
+
+        model = HotModel("models/other.json", load_json, cache=cache, revalidate_seconds=0)
+        results.append(check("model loads from the cache", model.get()[1] == "v1"))
+
+        # a retrained model lands in the container
+        with open(os.path.join(blobs, "models", "other.json"), "w") as f:
+            json.dump({"version": "v2", "padding": "x" * 100}, f)
+        results.append(check("changed artifact is swapped in", model.get()[1] == "v2" and source.downloads == 3))
+
+        # the blob disappears: revalidation fails, the loaded model keeps serving
+        os.remove(os.path.join(blobs, "models", "other.json"))
+        results.append(check("failed revalidation keeps the loaded model", model.get()[1] == "v2"))
+
+        leftovers = [n for n in os.listdir(cache_dir) if n.endswith(".tmp")]
+        results.append(check("no partial files left behind", not leftovers))
+
+        print("All checks passed." if all(results) else "Some checks failed.")
+    finally:
+        shutil.rmtree(blobs, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
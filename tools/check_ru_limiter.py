@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import logging
+import threading
+
+# the function app's modules (and bundled models) are in function-app/, next to this directory
+app_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "function-app")
+sys.path.insert(0, app_dir)
+
+from azure.cosmos.exceptions import CosmosBatchOperationError, CosmosHttpResponseError
+from cosmos_bulk import BulkWriter
+from ru_limiter import RULimiter
+
+# for testing purpose: bulk writes against a simulated container that throttles like cosmos
+RU_PER_SECOND = 20000
+CHARGE_PER_ITEM = 10.0
+ITEMS = 6000
+HOMES = 60
+
+
+class ThrottlingContainer:
+    """
+    Accepts a batch only while its RU budget (refilled at `ru_per_second`)
+    covers the batch; otherwise answers 429 with the time until it would.
+    """
+
+    id = "simulated"
+
+    def __init__(self, ru_per_second, charge_per_item=CHARGE_PER_ITEM, latency=0.005):
+        self.ru_per_second = ru_per_second
+        self.charge_per_item = charge_per_item
+        self.latency = latency
+        self.tokens = ru_per_second
+        self.refilled = time.monotonic()
+        self.items = {}
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def execute_item_batch(self, batch_operations, partition_key, response_hook=None):
+        time.sleep(self.latency)
+        charge = len(batch_operations) * self.charge_per_item
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.ru_per_second, self.tokens + (now - self.refilled) * self.ru_per_second)
+            self.refilled = now
+            self.requests += 1
+            if self.tokens < charge:
+                self.throttled += 1
+                error = CosmosHttpResponseError(status_code=429, message="Request rate is large")
+                error.headers = {"x-ms-retry-after-ms": str((charge - self.tokens) / self.ru_per_second * 1000)}
+                raise error
+            self.tokens -= charge
+            for _, (item,) in batch_operations:
+                self.items[item["id"]] = item
+        if response_hook:
+            response_hook({"x-ms-request-charge": str(charge)}, [])
+        return []
+
+
+def write_all(container, limiter, max_concurrency=8):
+    start = time.perf_counter()
+    with BulkWriter(container, batch_size=50, max_concurrency=max_concurrency, operation="upsert",
+                    limiter=limiter) as writer:
+        for i in range(ITEMS):
+            writer.add({"id": str(i), "HomeID": i % HOMES})
+    seconds = time.perf_counter() - start
+    ru_per_second = writer.items_written * container.charge_per_item / seconds
+    print(f"  {writer.summary()}; {container.throttled} of {container.requests} requests throttled, "
+          f"{ru_per_second:.0f} RU/s in {seconds:.1f}s")
+    if limiter is not None:
+        print(f"  limiter: {limiter.stats()}")
+    return writer, ru_per_second
+
+
+def failing_calls():
+    """
+    A limiter allowing one request at a time, after a failed batch, a plain
+    exception and a throttled batch: every slot must be released, or the
+    next call would wait forever. Returns (limiter, next call completed).
+    """
+    limiter = RULimiter(RU_PER_SECOND, max_concurrency=1, max_retries=1)
+
+    def batch_conflict(response_hook=None):
+        raise CosmosBatchOperationError(error_index=0, headers={"x-ms-request-charge": "5"}, status_code=409,
+                                        message="Conflict", operation_responses=[{"statusCode": 409}])
+
+    def batch_throttled(response_hook=None):
+        raise CosmosBatchOperationError(error_index=0, headers={"x-ms-retry-after-ms": "1"}, status_code=429,
+                                        message="Request rate is large", operation_responses=[{"statusCode": 429}])
+
+    def broken(response_hook=None):
+        raise ValueError("not a cosmos error")
+
+    def run():
+        for fn in (batch_conflict, broken, batch_throttled):
+            try:
+                limiter.call(fn)
+            except Exception:
+                pass
+        limiter.call(lambda response_hook=None: None)
+        done.set()
+
+    # on a thread, so a leaked slot shows up as a failed check rather than a hang
+    done = threading.Event()
+    threading.Thread(target=run, daemon=True).start()
+    return limiter, done.wait(5)
+
+
+def check(label, ok):
+    print(f"{'ok  ' if ok else 'FAIL'} {label}")
+    return ok
+
+
+if __name__ == "__main__":
+    # the failed batches of the unpaced run are expected, keep the output readable
+    logging.disable(logging.ERROR)
+    results = []
+
+    print("without the limiter:")
+    container = ThrottlingContainer(RU_PER_SECOND)
+    writer, _ = write_all(container, None)
+    results.append(check("unpaced writes get throttled and lose batches", writer.items_failed > 0))
+
+    print("with the limiter at 90% of the provisioned RU/s:")
+    container = ThrottlingContainer(RU_PER_SECOND)
+    writer, rate = write_all(container, RULimiter(RU_PER_SECOND * 0.9))
+    results.append(check("every item is written", writer.items_failed == 0 and len(container.items) == ITEMS))
+    results.append(check("at most a few requests are throttled", container.throttled <= container.requests * 0.05))
+    results.append(check("throughput stays near the budget", rate >= RU_PER_SECOND * 0.7))
+
+    print("with the limiter over-provisioned (believes twice the real RU/s) and a low first charge estimate:")
+    container = ThrottlingContainer(RU_PER_SECOND)
+    limiter = RULimiter(RU_PER_SECOND * 2, charge_per_op=1.0)
+    writer, rate = write_all(container, limiter)
+    results.append(check("429s are retried, no item is lost", writer.items_failed == 0 and len(container.items) == ITEMS))
+    results.append(check("throttling backs off concurrency", limiter.throttled > 0 and limiter.concurrency < limiter.max_concurrency))
+    results.append(check("charge estimate converges to the real charge", abs(limiter.charge_per_op - CHARGE_PER_ITEM) < 1.0))
+
+    print("after failing calls with one request in flight at most:")
+    limiter, completed = failing_calls()
+    print(f"  limiter: {limiter.stats()}")
+    results.append(check("failed batches and other errors release their slot", completed and limiter.in_flight == 0))
+    results.append(check("a throttled batch is retried and backs off", limiter.throttled == 2))
+
+    print("All checks passed." if all(results) else "Some checks failed.")
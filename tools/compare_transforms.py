@@ -0,0 +1,80 @@
+import io
+import os
+import sys
+import time
+
+# the function app's modules (and bundled models) are in function-app/, next to this directory
+app_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "function-app")
+sys.path.insert(0, app_dir)
+
+from csv_stream import read_csv_records
+from transform import iter_row_documents
+from columnar_transform import iter_columnar_documents
+
+# for testing purpose: check the row and columnar transforms agree on the sample csv
+script_dir = os.path.dirname(__file__)
+sample_csv = os.path.join(script_dir, "..", "home_energy_consumption_data.csv")
+
+# rows the sample doesn't have: short and long rows, nan/inf, python-only number syntax, long decimals
+EDGE_CASES_CSV = """Home ID,Appliance Type,Energy Consumption (kWh),Time,Date,Outdoor Temperature (°C),Season,Household Size
+5,Oven,1.5
+5,Oven
+5,Fridge,nan,11:00,01-05-2023,20,Spring,3
+5,Fridge,-inf,11:30,01-05-2023,20,Spring,3
+5,Fridge,1_000,12:00,01-05-2023,20,Spring,1_0
+5,TV, 2 ,12:00,01-05-2023,20,Spring, 4
+5,TV,1e3,13:00,,,,
+5,TV,0.30000000000000004441,14:00,01-05-2023,20,Spring,3.0
+5,TV,521924.889825151069090,15:00,01-05-2023,20,Spring,99999999999999999999
+5,TV,2,16:00,01-05-2023,20,Spring,3,extra,fields
+5,TV,NA,17:00,01-05-2023,20,Spring,N/A
+,TV,2,18:00,01-05-2023,20,Spring,3
+"""
+
+
+def run_row(f):
+    _, reader = read_csv_records(f)
+    return list(iter_row_documents(reader))
+
+
+def run_columnar(f):
+    return list(iter_columnar_documents(f))
+
+
+def flatten(chunks):
+    docs = [doc for chunk, _ in chunks for doc in chunk]
+    skipped = sum(s for _, s in chunks)
+    return docs, skipped
+
+
+def compare(label, row_chunks, col_chunks):
+    row_docs, row_skipped = flatten(row_chunks)
+    col_docs, col_skipped = flatten(col_chunks)
+    # documents, ids included, must match field by field and in key order
+    mismatches = sum(1 for a, b in zip(row_docs, col_docs) if list(a.items()) != list(b.items()))
+
+    if len(row_docs) == len(col_docs) and row_skipped == col_skipped and mismatches == 0:
+        print(f"{label}: row and columnar transforms match ({len(row_docs)} documents, {row_skipped} skipped).")
+        return True
+    print(f"{label}: transforms differ: {len(row_docs)} vs {len(col_docs)} documents, {row_skipped} vs "
+          f"{col_skipped} skipped, {mismatches} mismatched documents.")
+    return False
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    with open(sample_csv, "rb") as f:
+        row_chunks = run_row(f)
+    row_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(sample_csv, "rb") as f:
+        col_chunks = run_columnar(f)
+    col_time = time.perf_counter() - start
+
+    print(f"row:      {row_time:.3f}s")
+    print(f"columnar: {col_time:.3f}s")
+    compare("sample csv", row_chunks, col_chunks)
+
+    edge_cases = EDGE_CASES_CSV.encode("utf-8")
+    compare("edge cases", run_row(io.BytesIO(edge_cases)), run_columnar(io.BytesIO(edge_cases)))
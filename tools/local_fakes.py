@@ -0,0 +1,859 @@
+# in-memory stand-ins for the cosmos and blob clients, for local runs and benchmarks without an azure account
+import io
+import os
+import re
+import sys
+import json
+import math
+import time
+import hashlib
+import itertools
+import threading
+from types import SimpleNamespace
+import azure.functions as func
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError, ResourceNotModifiedError
+from azure.cosmos.exceptions import (CosmosAccessConditionFailedError, CosmosBatchOperationError,
+                                     CosmosHttpResponseError, CosmosResourceExistsError,
+                                     CosmosResourceNotFoundError)
+
+FAKE_CONNECTION_STRING = "UseLocalFakes=true"
+
+# rough request charges (RU) per KB of document, and for queries per request and per document scanned
+CHARGES = {"read": 1.0, "write": 5.7, "patch": 6.0, "delete": 5.0, "query": 2.3, "query_doc": 0.05}
+
+_etags = itertools.count(1)
+
+
+def _new_etag():
+    return f'"{next(_etags):016x}"'
+
+
+def _kb(doc):
+    return max(1, math.ceil(len(json.dumps(doc, separators=(",", ":"), default=str)) / 1024))
+
+
+def _http_error(cls, status_code, message, headers=None):
+    error = cls(status_code=status_code, message=message)
+    error.headers = dict(headers or {})
+    return error
+
+
+class Throughput:
+    """
+    Provisioned RU/s of one container: a budget refilled every second's worth
+    of time. A request the budget can't cover is throttled (429) with the
+    time until it could be served as retry-after.
+    """
+
+    def __init__(self, ru_per_second):
+        self.ru_per_second = ru_per_second
+        self.tokens = ru_per_second
+        self.refilled = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, charge):
+        """Take `charge` RU; returns 0 when served, else the seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.ru_per_second, self.tokens + (now - self.refilled) * self.ru_per_second)
+            self.refilled = now
+            if self.tokens >= min(charge, self.ru_per_second):
+                self.tokens -= charge
+                return 0.0
+            return (min(charge, self.ru_per_second) - self.tokens) / self.ru_per_second
+
+
+# ---------------------------------------------------------------------------- cosmos
+
+class FakeCosmosClient:
+    """
+    Stands in for azure.cosmos.CosmosClient. Accepts (and ignores) the real
+    constructor's arguments.
+
+    latency: seconds added to every request.
+    ru_per_second: throughput of each container (None means unlimited).
+    retry_total: 429s retried inside the client like the sdk's throttling
+        policy, reported in x-ms-throttle-retry-count.
+
+    raw_response_hook: called for every attempt like the sdk's client-level
+        hook, with a stand-in pipeline response (status, headers, url).
+
+    Totals over all containers: requests, ru_charged, throttled.
+    """
+
+    def __init__(self, url=None, credential=None, latency=0.0, ru_per_second=None, retry_total=9,
+                 charges=None, raw_response_hook=None, **kwargs):
+        self.raw_response_hook = raw_response_hook
+        self.latency = latency
+        self.ru_per_second = ru_per_second
+        self.retry_total = retry_total
+        self.charges = dict(CHARGES, **(charges or {}))
+        self.databases = {}
+        self.requests = 0
+        self.ru_charged = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def create_database_if_not_exists(self, id, **kwargs):
+        with self._lock:
+            if id not in self.databases:
+                self.databases[id] = FakeDatabase(self, id)
+            return self.databases[id]
+
+    def get_database_client(self, database):
+        return self.create_database_if_not_exists(database)
+
+    def stats(self):
+        return f"{self.requests} requests, {self.ru_charged:.0f} RU, {self.throttled} throttled"
+
+    def _request(self, container, charge, response_hook=None, result=None):
+        """Account for one request: latency, RU, throttling with sdk-style retries. Returns the response headers."""
+        retries = 0
+        while True:
+            if self.latency:
+                time.sleep(self.latency)
+            wait = container.throughput.consume(charge) if container.throughput else 0.0
+            with self._lock:
+                self.requests += 1
+                if wait:
+                    self.throttled += 1
+                else:
+                    self.ru_charged += charge
+            if self.raw_response_hook:
+                status, attempt_charge = (429, 0.0) if wait else (200, charge)
+                self.raw_response_hook(_pipeline_response(container, status, {"x-ms-request-charge": f"{attempt_charge:.2f}"}))
+            if not wait:
+                break
+            if retries >= self.retry_total:
+                raise _http_error(CosmosHttpResponseError, 429, "Request rate is large",
+                                  {"x-ms-retry-after-ms": f"{wait * 1000:.0f}", "x-ms-request-charge": "0"})
+            retries += 1
+            time.sleep(wait)
+        headers = {"x-ms-request-charge": f"{charge:.2f}", "x-ms-throttle-retry-count": str(retries)}
+        if response_hook:
+            response_hook(headers, result)
+        return headers
+
+
+def _pipeline_response(container, status_code, headers):
+    url = f"https://localhost/dbs/local/colls/{container.id}/docs"
+    return SimpleNamespace(http_request=SimpleNamespace(url=url),
+                           http_response=SimpleNamespace(status_code=status_code, headers=headers))
+
+
+class FakeDatabase:
+    def __init__(self, client, id):
+        self.client = client
+        self.id = id
+        self.containers = {}
+        self._lock = threading.Lock()
+
+    def create_container_if_not_exists(self, id, partition_key, offer_throughput=None, **kwargs):
+        with self._lock:
+            path = getattr(partition_key, "path", None) or partition_key
+            if id not in self.containers:
+                self.containers[id] = FakeContainer(self.client, id, path)
+            elif not self.containers[id].exists:
+                self.containers[id].exists = True
+                self.containers[id].partition_key_path = path
+            return self.containers[id]
+
+    def get_container_client(self, container):
+        with self._lock:
+            if container not in self.containers:
+                # like the sdk, a client for a missing container only fails on use
+                self.containers[container] = FakeContainer(self.client, container, "/id", exists=False)
+            return self.containers[container]
+
+    def replace_container(self, container, partition_key, **kwargs):
+        return self.get_container_client(getattr(container, "id", container))
+
+
+class FakeContainer:
+    """An in-memory container: documents by partition key value, then id."""
+
+    def __init__(self, client, id, partition_key_path, exists=True):
+        self.client = client
+        self.id = id
+        self.partition_key_path = partition_key_path
+        self.partitions = {}
+        self.exists = exists
+        self.throughput = Throughput(client.ru_per_second) if client.ru_per_second else None
+        self._lock = threading.RLock()
+
+    def count(self):
+        with self._lock:
+            return sum(len(p) for p in self.partitions.values())
+
+    def _check(self):
+        if not self.exists:
+            raise _http_error(CosmosResourceNotFoundError, 404, f"Container {self.id} does not exist")
+
+    def _pk(self, doc):
+        return _get_path(doc, self.partition_key_path.lstrip("/").split("/"))
+
+    def _store(self, body):
+        doc = json.loads(json.dumps(body, default=str))
+        if not doc.get("id"):
+            raise _http_error(CosmosHttpResponseError, 400, "The input content is invalid because the required "
+                                                            "properties - 'id; ' - are missing")
+        doc["_etag"] = _new_etag()
+        doc["_ts"] = int(time.time())
+        return doc
+
+    # -- point operations
+
+    def create_item(self, body, response_hook=None, **kwargs):
+        self._check()
+        self.client._request(self, self.client.charges["write"] * _kb(body), response_hook)
+        doc = self._store(body)
+        with self._lock:
+            partition = self.partitions.setdefault(self._pk(doc), {})
+            if doc["id"] in partition:
+                raise _http_error(CosmosResourceExistsError, 409, f"Entity with id {doc['id']} already exists")
+            partition[doc["id"]] = doc
+        return dict(doc)
+
+    def upsert_item(self, body, response_hook=None, **kwargs):
+        self._check()
+        self.client._request(self, self.client.charges["write"] * _kb(body), response_hook)
+        doc = self._store(body)
+        with self._lock:
+            self.partitions.setdefault(self._pk(doc), {})[doc["id"]] = doc
+        return dict(doc)
+
+    def replace_item(self, item, body, etag=None, match_condition=None, response_hook=None, **kwargs):
+        self._check()
+        self.client._request(self, self.client.charges["write"] * _kb(body), response_hook)
+        doc = self._store(body)
+        with self._lock:
+            partition = self.partitions.setdefault(self._pk(doc), {})
+            current = partition.get(doc["id"])
+            if current is None:
+                raise _http_error(CosmosResourceNotFoundError, 404, f"Entity with id {doc['id']} not found")
+            if etag and match_condition is not None and current["_etag"] != etag:
+                raise _http_error(CosmosAccessConditionFailedError, 412, "Precondition failed")
+            partition[doc["id"]] = doc
+        return dict(doc)
+
+    def read_item(self, item, partition_key, response_hook=None, **kwargs):
+        self._check()
+        with self._lock:
+            doc = self.partitions.get(partition_key, {}).get(item)
+        self.client._request(self, self.client.charges["read"] * (_kb(doc) if doc else 1), response_hook)
+        if doc is None:
+            raise _http_error(CosmosResourceNotFoundError, 404, f"Entity with id {item} not found")
+        return json.loads(json.dumps(doc))
+
+    def delete_item(self, item, partition_key, response_hook=None, **kwargs):
+        self._check()
+        self.client._request(self, self.client.charges["delete"], response_hook)
+        with self._lock:
+            if self.partitions.get(partition_key, {}).pop(item, None) is None:
+                raise _http_error(CosmosResourceNotFoundError, 404, f"Entity with id {item} not found")
+
+    def patch_item(self, item, partition_key, patch_operations, response_hook=None, **kwargs):
+        self._check()
+        self.client._request(self, self.client.charges["patch"], response_hook)
+        with self._lock:
+            partition = self.partitions.get(partition_key, {})
+            if item not in partition:
+                raise _http_error(CosmosResourceNotFoundError, 404, f"Entity with id {item} not found")
+            partition[item] = _patched(partition[item], patch_operations)
+            return dict(partition[item])
+
+    def execute_item_batch(self, batch_operations, partition_key, response_hook=None, **kwargs):
+        """All operations apply, or none (the failing one is reported like the sdk does)."""
+        self._check()
+        charges = self.client.charges
+        charge = 0.0
+        for operation in batch_operations:
+            kind, args = operation[0], operation[1]
+            if kind in ("create", "upsert"):
+                charge += charges["write"] * _kb(args[0])
+            elif kind == "replace":
+                charge += charges["write"] * _kb(args[1])
+            else:
+                charge += charges.get(kind, charges["patch"])
+        headers = self.client._request(self, charge)
+
+        with self._lock:
+            partition = dict(self.partitions.get(partition_key, {}))
+            results = []
+            for index, operation in enumerate(batch_operations):
+                kind, args = operation[0], operation[1]
+                options = operation[2] if len(operation) > 2 else {}
+                status, doc = self._batch_operation(partition, kind, args, options)
+                if status >= 400:
+                    responses = [{"statusCode": 424}] * len(batch_operations)
+                    responses[index] = {"statusCode": status}
+                    raise CosmosBatchOperationError(error_index=index, headers=headers, status_code=status,
+                                                    message=f"Batch operation {index} ({kind}) failed with {status}",
+                                                    operation_responses=responses)
+                results.append({"statusCode": status, "resourceBody": doc})
+            self.partitions[partition_key] = partition
+        if response_hook:
+            response_hook(headers, results)
+        return results
+
+    def _batch_operation(self, partition, kind, args, options):
+        if kind in ("create", "upsert"):
+            try:
+                doc = self._store(args[0])
+            except CosmosHttpResponseError:
+                return 400, None
+            if kind == "create" and doc["id"] in partition:
+                return 409, None
+            partition[doc["id"]] = doc
+            return 201, doc
+
+        item = args[0]
+        current = partition.get(item)
+        if current is None:
+            return 404, None
+        if options.get("if_match_etag") and options["if_match_etag"] != current["_etag"]:
+            return 412, None
+        if kind == "read":
+            return 200, current
+        if kind == "delete":
+            del partition[item]
+            return 204, None
+        if kind == "replace":
+            doc = self._store(args[1])
+        elif kind == "patch":
+            doc = _patched(current, args[1])
+        else:
+            return 400, None
+        partition[item] = doc
+        return 200, doc
+
+    # -- queries
+
+    def query_items(self, query, parameters=None, partition_key=None, enable_cross_partition_query=None,
+                    max_item_count=None, response_hook=None, **kwargs):
+        self._check()
+        # like the sdk's query plan check, raised when the results are first read
+        cross_partition = partition_key is None and bool(enable_cross_partition_query)
+        return FakeItemPaged(self, query, parameters, partition_key, max_item_count, response_hook, cross_partition)
+
+    def _run_query(self, query, parameters, partition_key):
+        with self._lock:
+            if partition_key is not None:
+                docs = list(self.partitions.get(partition_key, {}).values())
+            else:
+                docs = [doc for partition in self.partitions.values() for doc in partition.values()]
+        rows = evaluate_query(query, {p["name"]: p["value"] for p in parameters or []}, docs)
+        return rows, len(docs)
+
+
+class FakeItemPaged:
+    """Query results, iterable item by item or by_page() with continuation tokens like the sdk's ItemPaged."""
+
+    def __init__(self, container, query, parameters, partition_key, max_item_count, response_hook,
+                 cross_partition=False):
+        self.container = container
+        self.cross_partition = cross_partition
+        self.query = query
+        self.parameters = parameters
+        self.partition_key = partition_key
+        self.page_size = max_item_count or 100
+        self.response_hook = response_hook
+        self._rows = None
+
+    def _results(self):
+        if self._rows is None:
+            if self.cross_partition and is_non_value_aggregate(self.query):
+                raise _http_error(CosmosHttpResponseError, 400,
+                                  "Cross partition query only supports 'VALUE <AggregateFunc>' for aggregates")
+            rows, scanned = self.container._run_query(self.query, self.parameters, self.partition_key)
+            charges = self.container.client.charges
+            self.container.client._request(self.container, charges["query"] + charges["query_doc"] * scanned,
+                                           self.response_hook)
+            self._rows = rows
+        return self._rows
+
+    def __iter__(self):
+        return iter(self._results())
+
+    def by_page(self, continuation_token=None):
+        return FakePageIterator(self, int(continuation_token or 0))
+
+
+class FakePageIterator:
+    def __init__(self, paged, offset):
+        self.paged = paged
+        self.offset = offset
+        self.continuation_token = None
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # an empty result is still one (empty) page
+        if self.done:
+            raise StopIteration
+        rows = self.paged._results()
+        page = rows[self.offset:self.offset + self.paged.page_size]
+        self.offset += self.paged.page_size
+        self.done = self.offset >= len(rows)
+        self.continuation_token = None if self.done else str(self.offset)
+        return iter(page)
+
+
+# ---------------------------------------------------------------------------- query subset
+
+_SELECT = re.compile(r"^\s*SELECT\s+(?P<distinct>DISTINCT\s+)?(?P<value>VALUE\s+)?(?P<projection>.+?)\s+FROM\s+c"
+                     r"(?:\s+WHERE\s+(?P<where>.+?))?(?:\s+ORDER\s+BY\s+(?P<order>.+?))?\s*$", re.I | re.S)
+_COMPARE = re.compile(r"^(?P<field>c(?:\.\w+)+)\s*(?P<op>=|!=|<>|>=|<=|>|<)\s*(?P<value>.+)$")
+_AGGREGATE = re.compile(r"^(?P<fn>SUM|COUNT|MIN|MAX|AVG)\((?P<arg>[^)]*)\)(?:\s+AS\s+(?P<alias>\w+))?$", re.I)
+_FIELD = re.compile(r"^(?P<field>c(?:\.\w+)+)(?:\s+AS\s+(?P<alias>\w+))?$", re.I)
+_UNDEFINED = object()
+
+
+def _get_path(doc, parts):
+    for part in parts:
+        if not isinstance(doc, dict) or part not in doc:
+            return _UNDEFINED
+        doc = doc[part]
+    return doc
+
+
+def _field(expression):
+    return expression.strip().split(".")[1:]
+
+
+def _literal(text, parameters):
+    text = text.strip()
+    if text.startswith("@"):
+        return parameters[text]
+    return json.loads(text.replace("'", '"')) if text[0] in "'\"" else json.loads(text)
+
+
+def _predicate(condition, parameters):
+    condition = condition.strip()
+    match = re.match(r"^(NOT\s+)?IS_DEFINED\((c(?:\.\w+)+)\)$", condition, re.I)
+    if match:
+        negate, parts = bool(match.group(1)), _field(match.group(2))
+        return lambda doc: (_get_path(doc, parts) is _UNDEFINED) == negate
+    match = re.match(r"^ARRAY_CONTAINS\((@\w+),\s*(c(?:\.\w+)+)\)$", condition, re.I)
+    if match:
+        values, parts = parameters[match.group(1)], _field(match.group(2))
+        lookup = set(json.dumps(v) for v in values)
+        return lambda doc: json.dumps(_get_path(doc, parts)) in lookup
+    match = _COMPARE.match(condition)
+    if match:
+        parts, op, value = _field(match.group("field")), match.group("op"), _literal(match.group("value"), parameters)
+        compare = {"=": lambda a: a == value, "!=": lambda a: a != value, "<>": lambda a: a != value,
+                   ">=": lambda a: a >= value, "<=": lambda a: a <= value, ">": lambda a: a > value,
+                   "<": lambda a: a < value}[op]
+
+        def test(doc):
+            current = _get_path(doc, parts)
+            # like cosmos, comparing undefined or mismatched types is false
+            if current is _UNDEFINED or (op not in ("=", "!=", "<>") and type(current) is not type(value)
+                                         and not (isinstance(current, (int, float)) and isinstance(value, (int, float)))):
+                return False
+            return compare(current)
+        return test
+    raise NotImplementedError(f"Query condition not supported by the local fake: {condition}")
+
+
+def _aggregate(fn, arg, docs):
+    fn = fn.upper()
+    if fn == "COUNT":
+        return len(docs)
+    values = [v for v in (_get_path(doc, _field(arg)) for doc in docs) if isinstance(v, (int, float))]
+    if fn == "SUM":
+        return sum(values)
+    if not values:
+        return None
+    return {"MIN": min, "MAX": max, "AVG": lambda v: sum(v) / len(v)}[fn](values)
+
+
+def is_non_value_aggregate(query):
+    # the sdk only merges cross-partition aggregates written as SELECT VALUE <AggregateFunc>(...)
+    match = _SELECT.match(query)
+    return bool(match and not match.group("value")
+                and any(_AGGREGATE.match(p.strip()) for p in match.group("projection").split(",")))
+
+
+def evaluate_query(query, parameters, docs):
+    """
+    Evaluate the subset of cosmos SQL this repo uses: SELECT [DISTINCT] [VALUE]
+    *, fields or aggregates FROM c, WHERE conditions joined by AND
+    (comparisons, ARRAY_CONTAINS, [NOT] IS_DEFINED) and ORDER BY one field.
+    """
+    match = _SELECT.match(query)
+    if not match:
+        raise NotImplementedError(f"Query not supported by the local fake: {query}")
+
+    if match.group("where"):
+        predicates = [_predicate(c, parameters) for c in re.split(r"\s+AND\s+", match.group("where"), flags=re.I)]
+        docs = [doc for doc in docs if all(p(doc) for p in predicates)]
+
+    if match.group("order"):
+        field, _, direction = match.group("order").strip().partition(" ")
+        parts = _field(field)
+        docs = sorted((d for d in docs if _get_path(d, parts) is not _UNDEFINED), key=lambda d: _get_path(d, parts),
+                      reverse=direction.strip().upper() == "DESC")
+
+    projection = [p.strip() for p in match.group("projection").split(",")]
+    value = bool(match.group("value"))
+    aggregates = [_AGGREGATE.match(p) for p in projection]
+
+    if all(aggregates):
+        row = {(m.group("alias") or f"${i + 1}"): _aggregate(m.group("fn"), m.group("arg"), docs)
+               for i, m in enumerate(aggregates)}
+        return [next(iter(row.values()))] if value else [row]
+
+    if projection == ["*"]:
+        rows = [json.loads(json.dumps(doc)) for doc in docs]
+    else:
+        fields = []
+        for p in projection:
+            m = _FIELD.match(p)
+            if not m:
+                raise NotImplementedError(f"Projection not supported by the local fake: {p}")
+            parts = _field(m.group("field"))
+            fields.append((m.group("alias") or parts[-1], parts))
+        if value:
+            rows = [v for v in (_get_path(doc, fields[0][1]) for doc in docs) if v is not _UNDEFINED]
+        else:
+            rows = [{name: v for name, parts in fields for v in [_get_path(doc, parts)] if v is not _UNDEFINED}
+                    for doc in docs]
+
+    if match.group("distinct"):
+        seen = set()
+        rows = [r for r in rows if not (json.dumps(r, sort_keys=True) in seen or seen.add(json.dumps(r, sort_keys=True)))]
+    return rows
+
+
+def _patched(doc, operations):
+    doc = json.loads(json.dumps(doc))
+    for operation in operations:
+        parts = operation["path"].lstrip("/").split("/")
+        parent = doc
+        for part in parts[:-1]:
+            parent = parent.setdefault(part, {})
+        key = parts[-1]
+        if operation["op"] in ("set", "add", "replace"):
+            parent[key] = operation["value"]
+        elif operation["op"] == "remove":
+            parent.pop(key, None)
+        elif operation["op"] == "incr":
+            parent[key] = parent.get(key, 0) + operation["value"]
+    doc["_etag"] = _new_etag()
+    return doc
+
+
+# ---------------------------------------------------------------------------- blob storage
+
+class FakeBlobAccount:
+    """Blobs of one (fake) storage account: {(container, name): (data, etag)}."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.containers = set()
+        self.blobs = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+_accounts = {}
+_accounts_lock = threading.Lock()
+
+
+def blob_account(conn_str=FAKE_CONNECTION_STRING):
+    """The in-memory account behind a connection string (one per string, shared by every client)."""
+    with _accounts_lock:
+        return _accounts.setdefault(conn_str, FakeBlobAccount())
+
+
+def _read_data(data):
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    if hasattr(data, "read"):
+        return _read_data(data.read())
+    return b"".join(data)
+
+
+class FakeBlobServiceClient:
+    """Stands in for azure.storage.blob.BlobServiceClient."""
+
+    def __init__(self, account=None):
+        self.account = account or blob_account()
+
+    @classmethod
+    def from_connection_string(cls, conn_str, **kwargs):
+        return cls(blob_account(conn_str))
+
+    def get_container_client(self, container):
+        return FakeContainerClient(self.account, container)
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(self.account, container, blob)
+
+
+class FakeContainerClient:
+    def __init__(self, account, container):
+        self.account = account
+        self.container_name = container
+
+    def create_container(self, **kwargs):
+        self.account.request()
+        with self.account.lock:
+            if self.container_name in self.account.containers:
+                raise ResourceExistsError("The specified container already exists.")
+            self.account.containers.add(self.container_name)
+
+    def get_blob_client(self, blob):
+        return FakeBlobClient(self.account, self.container_name, blob)
+
+    def upload_blob(self, name, data, overwrite=False, **kwargs):
+        return self.get_blob_client(name).upload_blob(data, overwrite=overwrite, **kwargs)
+
+    def download_blob(self, blob, **kwargs):
+        return self.get_blob_client(blob).download_blob(**kwargs)
+
+    def list_blob_names(self, name_starts_with=None, **kwargs):
+        self.account.request()
+        with self.account.lock:
+            return sorted(name for container, name in self.account.blobs
+                          if container == self.container_name and name.startswith(name_starts_with or ""))
+
+
+class BlobProperties:
+    def __init__(self, name, container, size, etag):
+        self.name = name
+        self.container = container
+        self.size = size
+        self.etag = etag
+
+
+class FakeDownloader:
+    def __init__(self, data, properties, encoding=None, chunk_size=4 * 1024 * 1024):
+        self.properties = properties
+        self.chunk_size = chunk_size
+        self.size = len(data)
+        self._data = data
+        self._encoding = encoding
+
+    def readall(self):
+        return self._data.decode(self._encoding) if self._encoding else self._data
+
+    def content_as_text(self, encoding="utf-8"):
+        return self._data.decode(encoding)
+
+    def readinto(self, stream):
+        stream.write(self._data)
+        return len(self._data)
+
+    def chunks(self):
+        for i in range(0, len(self._data), self.chunk_size):
+            yield self._data[i:i + self.chunk_size]
+
+
+class FakeBlobClient:
+    """Stands in for azure.storage.blob.BlobClient."""
+
+    def __init__(self, account, container, blob, max_chunk_get_size=4 * 1024 * 1024):
+        self.account = account
+        self.container_name = container
+        self.blob_name = blob
+        self.max_chunk_get_size = max_chunk_get_size
+
+    @classmethod
+    def from_connection_string(cls, conn_str, container_name, blob_name, **kwargs):
+        return cls(blob_account(conn_str), container_name, blob_name,
+                   kwargs.get("max_chunk_get_size", 4 * 1024 * 1024))
+
+    @property
+    def key(self):
+        return (self.container_name, self.blob_name)
+
+    def get_container_client(self):
+        return FakeContainerClient(self.account, self.container_name)
+
+    def upload_blob(self, data, overwrite=False, **kwargs):
+        self.account.request()
+        data = _read_data(data)
+        with self.account.lock:
+            if self.key in self.account.blobs and not overwrite:
+                raise ResourceExistsError("The specified blob already exists.")
+            etag = '"0x' + hashlib.sha1(data + str(time.monotonic_ns()).encode()).hexdigest()[:16].upper() + '"'
+            self.account.blobs[self.key] = (data, etag)
+        return {"etag": etag}
+
+    def _get(self):
+        with self.account.lock:
+            if self.key not in self.account.blobs:
+                raise ResourceNotFoundError("The specified blob does not exist.")
+            return self.account.blobs[self.key]
+
+    def download_blob(self, offset=None, length=None, encoding=None, etag=None, match_condition=None, **kwargs):
+        self.account.request()
+        data, current = self._get()
+        if etag and match_condition == MatchConditions.IfModified and etag == current:
+            raise ResourceNotModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+        if etag and match_condition == MatchConditions.IfNotModified and etag != current:
+            raise ResourceModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+        if offset is not None:
+            data = data[offset:offset + length if length is not None else None]
+        return FakeDownloader(data, BlobProperties(self.blob_name, self.container_name, len(data), current), encoding,
+                              self.max_chunk_get_size)
+
+    def get_blob_properties(self, **kwargs):
+        self.account.request()
+        data, etag = self._get()
+        return BlobProperties(self.blob_name, self.container_name, len(data), etag)
+
+    def exists(self, **kwargs):
+        with self.account.lock:
+            return self.key in self.account.blobs
+
+    def delete_blob(self, **kwargs):
+        self.account.request()
+        with self.account.lock:
+            if self.account.blobs.pop(self.key, None) is None:
+                raise ResourceNotFoundError("The specified blob does not exist.")
+
+
+def blob_created_event(container, name):
+    """The BlobCreated event Event Grid sends for a blob uploaded to the fake account."""
+    properties = FakeBlobServiceClient().get_blob_client(container, name).get_blob_properties()
+    return func.EventGridEvent(
+        id=hashlib.sha1(f"{container}/{name}{properties.etag}".encode()).hexdigest(), topic="/subscriptions/local",
+        subject=f"/blobServices/default/containers/{container}/blobs/{name}", event_type="Microsoft.Storage.BlobCreated",
+        event_time=None, data_version="", data={"api": "PutBlob", "eTag": properties.etag, "contentLength": properties.size,
+                                               "url": f"https://local.blob.core.windows.net/{container}/{name}"})
+
+
+def upload_blob_event(container, name, data):
+    """Upload `data` (bytes or a file) as a blob and return its BlobCreated event."""
+    FakeBlobServiceClient().get_blob_client(container, name).upload_blob(data, overwrite=True)
+    return blob_created_event(container, name)
+
+
+class FakeInputStream(func.InputStream):
+    """What a blob trigger passes to the function (the legacy module's), read from a local file or bytes."""
+
+    def __init__(self, name, f, length, etag=None):
+        self._name = name
+        self._f = f
+        self._length = length
+        self._etag = etag
+
+    @classmethod
+    def from_file(cls, path, name, etag=None):
+        return cls(name, open(path, "rb"), os.path.getsize(path), etag)
+
+    @classmethod
+    def from_bytes(cls, data, name, etag=None):
+        return cls(name, io.BytesIO(data), len(data), etag)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def length(self):
+        return self._length
+
+    @property
+    def uri(self):
+        return f"https://local/{self._name}"
+
+    @property
+    def blob_properties(self):
+        return {"ETag": self._etag} if self._etag else {}
+
+    @property
+    def metadata(self):
+        return {}
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._f.read(size)
+
+    # as in the worker's InputStream
+    read1 = read
+
+    def seekable(self):
+        return False
+
+    def writable(self):
+        return False
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+class FakeOut(func.Out):
+    """An output binding (e.g. the shard queue) that keeps what the function set."""
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, val):
+        self.value = val
+
+    def get(self):
+        return self.value
+
+
+# ---------------------------------------------------------------------------- wiring
+
+def install(cosmos_client=None, blob_connection_string=FAKE_CONNECTION_STRING):
+    """
+    Point the function modules at the fakes: the shared cosmos client
+    (cosmos_pool), the ingest manifests, shard checkpoints and source blobs,
+    the model registry blobs, and the legacy blob_to_cosmosdb module if it
+    is loaded. Returns the fake cosmos
+    client. Call before invoking functions; clients already built are dropped.
+    """
+    import cosmos_pool
+    import ingest_manifest
+    import model_registry
+    import ru_limiter
+    import shard_ingest
+
+    cosmos_client = cosmos_client or FakeCosmosClient()
+
+    def client_factory(*args, raw_response_hook=None, **kwargs):
+        cosmos_client.raw_response_hook = raw_response_hook
+        return cosmos_client
+
+    cosmos_pool.CosmosClient = client_factory
+    cosmos_pool.DATABASE = cosmos_pool.DATABASE or "local"
+    cosmos_pool.client.reset()
+    cosmos_pool._containers.clear()
+    cosmos_pool._created.clear()
+    ru_limiter._limiters.clear()
+
+    ingest_manifest.BlobServiceClient = FakeBlobServiceClient
+    ingest_manifest.MANIFEST_CONNECTION_STRING = blob_connection_string
+    shard_ingest.BlobClient = FakeBlobClient
+    shard_ingest.SHARD_CONNECTION_STRING = blob_connection_string
+    model_registry.BlobClient = FakeBlobClient
+    model_registry.STORAGE_ACC_CONNECTION_STRING = blob_connection_string
+
+    legacy = sys.modules.get("blob_to_cosmosdb")
+    if legacy is not None:
+        legacy.CosmosClient = lambda *args, **kwargs: cosmos_client
+        legacy.DATABASE_NAME = legacy.DATABASE_NAME or "local"
+        legacy.CONTAINER_NAME = legacy.CONTAINER_NAME or "legacy"
+        legacy._container = None
+    return cosmos_client